@@ -1,8 +1,8 @@
 import pandas as pd
 import streamlit as st
-import sqlite3
 import os
 import re
+import sqlite_engine
 
 # ---------- SESSION STATE ----------
 if "logged_in" not in st.session_state:
@@ -18,8 +18,8 @@ EXCEL_FILE = "ERR Drug Audit.csv"
 
 # ---------- DATABASE CONNECTION ----------
 def get_connection():
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    return conn
+    # Shared per-thread connection (WAL + tuned pragmas). Do not close it.
+    return sqlite_engine.get_connection(DB_FILE)
 
 # ---------- LOAD ICD DATA ----------
 def load_icd_diagnosis():
@@ -56,7 +56,7 @@ def init_db():
     # Patients table
     c.execute("""
         CREATE TABLE IF NOT EXISTS patients (
-            patient_id TEXT PRIMARY KEY,
+            patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
             patient_name TEXT,
             cnic TEXT,
             nationality TEXT,
@@ -93,7 +93,12 @@ def init_db():
         )
     """)
     conn.commit()
-    conn.close()
+
+    # Older databases used TEXT ids generated as "last id + 1" (racy between tabs)
+    sqlite_engine.migrate_integer_pk(conn, "patients", "patient_id")
+    sqlite_engine.ensure_unique_key(conn, "stock", "key")
+    sqlite_engine.ensure_index(conn, "idx_patients_dispensed", "patients", ["dispensed"])
+    sqlite_engine.ensure_index(conn, "idx_stock_generic", "stock", ["generic"])
 
 init_db()
 
@@ -125,13 +130,19 @@ def load_stock():
         except Exception as e:
             print("Error importing CSV:", e)
     stock_df = pd.read_sql("SELECT * FROM stock", conn)
-    conn.close()
     return stock_df
 
 def save_stock(df):
+    # Upsert instead of to_sql(if_exists="replace"), which would drop the key and indexes
     conn = get_connection()
-    df.to_sql("stock", conn, if_exists="replace", index=False)
-    conn.close()
+    conn.executemany("""
+        INSERT INTO stock (key,generic,brand,dosage_form,dose,expiry,unit,stock_qty)
+        VALUES (?,?,?,?,?,?,?,?)
+        ON CONFLICT(key) DO UPDATE SET
+            generic=excluded.generic, brand=excluded.brand, dosage_form=excluded.dosage_form,
+            dose=excluded.dose, expiry=excluded.expiry, unit=excluded.unit, stock_qty=excluded.stock_qty
+    """, df[["key","generic","brand","dosage_form","dose","expiry","unit","stock_qty"]].values.tolist())
+    conn.commit()
 
 if "stock_df" not in st.session_state:
     st.session_state["stock_df"] = load_stock()
@@ -174,25 +185,13 @@ def run_app():
 
     tab_objs = st.tabs(tabs)
 
-    # ---------- NEXT PATIENT ID ----------
-    def get_next_patient_id():
-        conn = get_connection()
-        try:
-            last = conn.execute("SELECT patient_id FROM patients ORDER BY ROWID DESC LIMIT 1").fetchone()
-            conn.close()
-            return str(int(last[0])+1) if last else "1"
-        except:
-            conn.close()
-            return str(int(pd.Timestamp.now().timestamp()))
-
     # ---------- PATIENT ENTRY ----------
     if "Patient Entry" in tabs:
         with tab_objs[tabs.index("Patient Entry")]:
             st.header("Patient Information")
             stock_df = st.session_state["stock_df"]
-            next_id = get_next_patient_id()
-            st.text_input("Patient ID (auto)", value=next_id, key="p_patient_id", disabled=True)
-            patient_id = st.session_state.get("p_patient_id", next_id)
+            # IDs come from SQLite AUTOINCREMENT on save, so two tabs can't get the same one
+            st.text_input("Patient ID (auto)", value="Assigned on save", disabled=True)
 
             # Personal Details
             st.subheader("Personal Details")
@@ -261,7 +260,6 @@ def run_app():
                     st.error("Patient Name required.")
                 else:
                     record = {
-                        "patient_id": patient_id,
                         "patient_name": patient_name,
                         "cnic": cnic,
                         "nationality": nationality,
@@ -287,10 +285,10 @@ def run_app():
                     placeholders = ",".join(["?"]*len(record))
                     columns = ",".join(record.keys())
                     values = list(record.values())
-                    conn.cursor().execute(f"INSERT OR REPLACE INTO patients ({columns}) VALUES ({placeholders})", values)
+                    cur = conn.execute(f"INSERT INTO patients ({columns}) VALUES ({placeholders})", values)
                     conn.commit()
-                    conn.close()
-                    st.success("Patient record saved!")
+                    record = {"patient_id": cur.lastrowid, **record}
+                    st.success(f"Patient record saved! (ID: {record['patient_id']})")
                     st.json(record)
 
     # ---------- PATIENT RECORDS TAB ----------
@@ -299,7 +297,6 @@ def run_app():
             st.header("Patient Records")
             conn = get_connection()
             records_df = pd.read_sql("SELECT * FROM patients", conn)
-            conn.close()
             if records_df.empty:
                 st.info("No patient records.")
             else:
@@ -317,7 +314,6 @@ def run_app():
             # Select patient
             conn = get_connection()
             patient_list = pd.read_sql("SELECT patient_id, patient_name, medicines, dispensed FROM patients", conn)
-            conn.close()
             if patient_list.empty:
                 st.info("No patients found.")
             else:
@@ -327,7 +323,7 @@ def run_app():
                     st.subheader(f"Patient: {patient_row['patient_name']}")
                     st.markdown(f"**Medicines Prescribed:**")
                     meds = patient_row["medicines"].split("; ") if patient_row["medicines"] else []
-                    dispensed_details = []
+                    dispensed_details, deductions = [], []
                     for med in meds:
                         st.markdown(f"- {med}")
                         generic_match = re.findall(r"^([^\[]+)", med)
@@ -339,20 +335,25 @@ def run_app():
                                 qty_dispensed = st.number_input(f"Dispense quantity for {generic_name}", min_value=0, max_value=int(stock_row["stock_qty"]), key=f"disp_{generic_name}")
                                 if qty_dispensed > 0:
                                     dispensed_details.append(f"{generic_name} - {qty_dispensed} units")
-                                    # Update stock
-                                    new_qty = int(stock_row["stock_qty"]) - int(qty_dispensed)
-                                    conn = get_connection()
-                                    conn.execute("UPDATE stock SET stock_qty=? WHERE key=?", (new_qty, stock_row["key"]))
-                                    conn.commit()
-                                    conn.close()
+                                    deductions.append((stock_row["key"], int(qty_dispensed)))
                     if st.button("Confirm Dispensation"):
+                        # Deduct inside the database, only on confirm, and never below zero
                         conn = get_connection()
-                        conn.execute("UPDATE patients SET dispensed='Yes', dispensed_details=? WHERE patient_id=?",
-                                     ("; ".join(dispensed_details), patient_selected))
-                        conn.commit()
-                        conn.close()
-                        refresh_stock()
-                        st.success("Dispensation completed and stock updated!")
+                        try:
+                            for key, qty in deductions:
+                                cur = conn.execute("UPDATE stock SET stock_qty = stock_qty - ? WHERE key=? AND stock_qty >= ?",
+                                                   (qty, key, qty))
+                                if cur.rowcount != 1:
+                                    raise ValueError(f"Not enough stock left for {key}. Refresh stock and retry.")
+                            conn.execute("UPDATE patients SET dispensed='Yes', dispensed_details=? WHERE patient_id=?",
+                                         ("; ".join(dispensed_details), patient_selected))
+                            conn.commit()
+                        except ValueError as e:
+                            conn.rollback()
+                            st.error(str(e))
+                        else:
+                            refresh_stock()
+                            st.success("Dispensation completed and stock updated!")
 
 if __name__ == "__main__":
     run_app()
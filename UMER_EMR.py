@@ -3,10 +3,16 @@ import pandas as pd
 import streamlit as st
 import os
 import re
+from record_store import RecordStore, import_csv
 
 # --------- Config / filenames ----------
 EXCEL_FILE = "ERR Drug Audit.csv"          # keep this file in same folder
-SAVE_FILE = "UmerEMR_records.csv.csv"       # your existing record file name
+SAVE_FILE = "UmerEMR_records.csv.csv"       # your existing record file name (legacy, imported once)
+RECORDS_STORE = "UmerEMR_records"           # append-only journal + snapshot
+STOCK_STORE = "UmerEMR_stock"
+
+RECORD_COLUMNS = ["Patient ID", "Patient Name", "History", "BP", "Heart Rate", "Gender", "Age",
+                  "Symptoms", "Indications", "Medicines", "Dispensed", "Dispensed Details"]
 
 st.set_page_config(layout="centered", page_title="Medical Camp EMR & Pharmacy")
 st.title("Medical Camp EMR System")
@@ -49,9 +55,39 @@ def load_stock(csv_path: str = EXCEL_FILE):
     return agg.reset_index(drop=True)
 
 
-# Load initial stock from Excel (this is the canonical source); if we persisted CSV already, prefer it for read+write
+# --------- Record stores (append-only, crash-safe) ----------
+@st.cache_resource
+def get_record_store():
+    store = RecordStore(RECORDS_STORE, key_field="Patient ID")
+    # One-time conversion of the old CSV file
+    if len(store) == 0 and os.path.exists(SAVE_FILE):
+        import_csv(SAVE_FILE, store, dtype=str, keep_default_na=False)
+    return store
+
+@st.cache_resource
+def get_stock_store():
+    store = RecordStore(STOCK_STORE, key_field="StoreKey")
+    # Seed from ERR Drug Audit.csv the first time; afterwards the store is the source of truth
+    if len(store) == 0:
+        stock = load_stock()
+        # "Key" (generic||brand) repeats across forms/doses, so rows are stored under a unique key
+        stock["StoreKey"] = (stock["Key"] + "||" + stock["Dosage Form"] + "||" + stock["Dose"] + "||" + stock["Expiry"]).str.lower()
+        store.import_dataframe(stock)
+    return store
+
+def load_records():
+    return get_record_store().to_dataframe(columns=RECORD_COLUMNS).fillna("").astype(str)
+
+def current_stock():
+    return get_stock_store().to_dataframe()
+
 def save_stock(df):
-    df.to_csv(EXCEL_FILE, index=False)
+    """Journal only the stock rows whose quantity changed."""
+    store = get_stock_store()
+    for row in df[["StoreKey", "StockQty"]].itertuples(index=False):
+        old = store.get(row.StoreKey)
+        if old is None or int(old["StockQty"]) != int(row.StockQty):
+            store.patch(row.StoreKey, {"StockQty": int(row.StockQty)})
 
 # --------- UI Tabs ----------
 tab1, tab2, tab3 = st.tabs(["Patient Entry", "Patient Records", "Pharmacy Dispensation"])
@@ -90,7 +126,7 @@ with tab1:
             indications.append(val.strip())
 
     # load stock to provide dropdown options
-    stock_df = load_stock()
+    stock_df = current_stock()
 
     st.subheader("Medicines (Up to 10)")
     medicines = []
@@ -164,17 +200,8 @@ if st.button("Save Patient Record"):
                 "Dispensed Details": ""
             }
 
-            if os.path.exists(SAVE_FILE):
-                saved_df = pd.read_csv(SAVE_FILE, dtype=str).fillna("")
-                if str(patient_id) in saved_df["Patient ID"].astype(str).values:
-                    # update existing row
-                    saved_df.loc[saved_df["Patient ID"].astype(str) == str(patient_id), list(record.keys())] = list(record.values())
-                else:
-                    saved_df = pd.concat([saved_df, pd.DataFrame([record])], ignore_index=True)
-            else:
-                saved_df = pd.DataFrame([record])
-
-            saved_df.to_csv(SAVE_FILE, index=False)
+            # O(1) journal append; an existing Patient ID is simply replaced
+            get_record_store().put(record)
             st.success("Patient record saved successfully!")
             st.subheader("Saved Patient Record")
             st.json(record)
@@ -182,14 +209,23 @@ if st.button("Save Patient Record"):
 # ---------------- TAB 2: Patient Records ----------------
 with tab2:
     st.header("Patient Records")
-    if os.path.exists(SAVE_FILE):
-        records_df = pd.read_csv(SAVE_FILE, dtype=str).fillna("")
+    store = get_record_store()
+    if len(store) > 0:
+        records_df = load_records()
         edited_df = st.data_editor(records_df, num_rows="dynamic")
 
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Update Records"):
-                edited_df.to_csv(SAVE_FILE, index=False)
+                # Journal only what actually changed
+                edited_df = edited_df.fillna("").astype(str)
+                before = {r["Patient ID"]: r for r in records_df.to_dict("records")}
+                after = {r["Patient ID"]: r for r in edited_df.to_dict("records") if r["Patient ID"]}
+                for pid in before.keys() - after.keys():
+                    store.delete(pid)
+                for pid, rec in after.items():
+                    if before.get(pid) != rec:
+                        store.put(rec)
                 st.success("Records updated successfully!")
 
         with col2:
@@ -199,13 +235,18 @@ with tab2:
                 if del_id == "":
                     st.warning("Please select a Patient ID to delete.")
                 else:
-                    new_df = records_df[records_df["Patient ID"] != del_id]
-                    new_df.to_csv(SAVE_FILE, index=False)
+                    store.delete(del_id)
                     st.success(f"Record with Patient ID '{del_id}' deleted.")
                     st.experimental_rerun()
 
         st.subheader("All Patient Records")
         st.dataframe(records_df, use_container_width=True)
+        st.download_button(
+            "📥 Export Records CSV",
+            data=records_df.to_csv(index=False).encode("utf-8"),
+            file_name=SAVE_FILE,
+            mime="text/csv"
+        )
     else:
         st.info("No patient records found. Save some records in the 'Patient Entry' tab first.")
 
@@ -213,13 +254,13 @@ with tab2:
 with tab3:
     st.header("Pharmacy Dispensation (based on Baba Island sheet format)")
 
-    # Load stocks (prefer persisted CSV if exists, otherwise Excel parse)
-    stock_df = load_stock()  # this reads STOCK_FILE_CSV if exists else from excel
+    # Load stocks from the stock store (seeded from the Excel export on first run)
+    stock_df = current_stock()
     st.write("Stock loaded")
 
     # allow pharmacist to add/update stock rows from UI
     with st.expander("🔧 Stock Management (view / quick edit)"):
-        st.write("You can update stock quantities here. Changes will be saved to `medicine_stock.csv`.")
+        st.write("You can update stock quantities here. Only changed rows are written to the stock journal.")
         editable = stock_df.copy()
         # show a simple table with edit inputs for StockQty
         for idx, row in editable.iterrows():
@@ -233,12 +274,12 @@ with tab3:
                 st.write(f"Expiry: {row.get('Expiry','')}")
         if st.button("Save Stock Changes"):
             save_stock(editable)
-            st.success("Stock saved to medicine_stock.csv")
+            st.success("Stock changes saved.")
             stock_df = editable.copy()
 
     # Pick a patient to dispense for
-    if os.path.exists(SAVE_FILE):
-        patients_df = pd.read_csv(SAVE_FILE, dtype=str).fillna("")
+    if len(get_record_store()) > 0:
+        patients_df = load_records()
         patient_ids = patients_df["Patient ID"].tolist()
         selected_patient = st.selectbox("Select Patient ID to Dispense For", options=[""] + patient_ids, index=0)
 
@@ -337,20 +378,17 @@ with tab3:
                             "RemainingStock": new_stock_val
                         })
 
-                    # persist stock
+                    # persist stock (only the dispensed rows are journaled)
                     save_stock(updated_stock)
-                    # update patients file with Dispensed info
-                    patients_df.loc[patients_df["Patient ID"] == selected_patient, "Dispensed"] = "Yes"
                     # build dispensed details string
                     dd = "; ".join([f"{s['Medicine']} => {s['QuantityDispensed']} (remaining {s['RemainingStock']})" for s in dispensed_summary])
-                    patients_df.loc[patients_df["Patient ID"] == selected_patient, "Dispensed Details"] = dd
-                    patients_df.to_csv(SAVE_FILE, index=False)
+                    get_record_store().patch(selected_patient, {"Dispensed": "Yes", "Dispensed Details": dd})
 
                     st.success("Dispensation recorded and stock updated.")
                     st.subheader("Dispensed summary")
                     st.table(pd.DataFrame(dispensed_summary))
                     # refresh in-memory stock
-                    stock_df = load_stock()
+                    stock_df = current_stock()
     else:
         st.info("No patient records found. Save a patient record first in Patient Entry tab.")
 
@@ -0,0 +1,2 @@
+# Synthetic camp workload generator + page-level benchmarks.
+# Run with:  python -m bench --scales 1000 10000 100000
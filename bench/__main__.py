@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bench import synth
+from bench.pages import WORKLOADS, make_context
+
+# ---------- Benchmark Runner ----------
+# Generates a synthetic camp at each scale, loads it into a stand-in
+# database and times every page workload. Results go to a JSON file so
+# runs from different commits can be compared.
+#
+#   python -m bench --scales 1000 10000 100000 --out bench_results.json
+#   python -m bench --backend mysql --mysql-db camp_bench   (throwaway DB!)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(prog="python -m bench", description="Camp page benchmarks")
+    p.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000], help="Number of patients")
+    p.add_argument("--repeat", type=int, default=5, help="Timed runs per workload")
+    p.add_argument("--warmup", type=int, default=1)
+    p.add_argument("--workloads", nargs="+", choices=sorted(WORKLOADS), default=list(WORKLOADS))
+    p.add_argument("--backend", choices=["sqlite", "mysql"], default="sqlite")
+    p.add_argument("--sqlite-path", default=None, help="SQLite file (default: temp file, deleted afterwards)")
+    p.add_argument("--mysql-host", default="localhost")
+    p.add_argument("--mysql-user", default="root")
+    p.add_argument("--mysql-password", default="")
+    p.add_argument("--mysql-db", default="camp_bench", help="Dropped and recreated: never point at the camp DB")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--out", default="bench_results.json")
+    return p.parse_args()
+
+
+def connect(args, tmpdir):
+    if args.backend == "sqlite":
+        path = args.sqlite_path or os.path.join(tmpdir, "bench.db")
+        if os.path.exists(path):
+            os.remove(path)
+        return sqlite3.connect(path)
+
+    synth.refuse_live_database(args.mysql_db)
+    import mysql.connector
+    server = mysql.connector.connect(host=args.mysql_host, user=args.mysql_user, password=args.mysql_password)
+    cur = server.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{args.mysql_db}`")
+    cur.execute(f"CREATE DATABASE `{args.mysql_db}`")
+    server.close()
+    return mysql.connector.connect(host=args.mysql_host, user=args.mysql_user,
+                                   password=args.mysql_password, database=args.mysql_db)
+
+
+def time_workload(fn, conn, backend, ctx, repeat, warmup):
+    for _ in range(warmup):
+        fn(conn, backend, ctx)
+    times, rows = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = fn(conn, backend, ctx)
+        times.append((time.perf_counter() - t0) * 1000)
+    arr = np.array(times)
+    return {
+        "rows": int(rows),
+        "min_ms": round(float(arr.min()), 2),
+        "median_ms": round(float(np.median(arr)), 2),
+        "p95_ms": round(float(np.percentile(arr, 95)), 2),
+        "runs_ms": [round(t, 2) for t in times],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=synth.REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    args = parse_args()
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "backend": args.backend,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "scales": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in args.scales:
+            t0 = time.perf_counter()
+            data = synth.generate(n, seed=args.seed)
+            gen_s = time.perf_counter() - t0
+
+            conn = connect(args, tmpdir)
+            t0 = time.perf_counter()
+            synth.load(conn, data, args.backend)
+            load_s = time.perf_counter() - t0
+
+            ctx = make_context(data)
+            scale = {
+                "counts": {t: len(df) for t, df in data.items()},
+                "generate_s": round(gen_s, 2),
+                "load_s": round(load_s, 2),
+                "workloads": {},
+            }
+            print(f"\n== {n:,} patients  ({scale['counts']['visits']:,} visits, load {load_s:.1f}s)")
+            for name in args.workloads:
+                r = time_workload(WORKLOADS[name], conn, args.backend, ctx, args.repeat, args.warmup)
+                scale["workloads"][name] = r
+                print(f"  {name:<24} median {r['median_ms']:>9.1f} ms   p95 {r['p95_ms']:>9.1f} ms   rows {r['rows']:,}")
+            conn.close()
+            results["scales"][str(n)] = scale
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bench import synth
+from bench.__main__ import git_commit
+
+# ---------- Concurrent Session Load Test ----------
+# Drives check.py through Streamlit's AppTest, one headless session per
+# simulated user, all in this process (like the real server: one Python
+# process, one script thread per rerun, shared st.cache_* objects).
+# Every session logs in with its role and loops over a scripted flow:
+#
+#   doctor        save a visit (symptom search, diagnosis, medicine) / browse records
+#   pharmacy      dispense a pending visit / browse records
+#   registration  register a patient
+#   admin         browse records
+#
+# The app is pointed at a throwaway MySQL database through the EMR_DB_*
+# environment variables. Each concurrency level runs for --duration
+# seconds and reports p50/p95/p99 rerun latency, errors, MySQL
+# connections in use and process RSS:
+#
+#   python -m bench.loadtest --mysql-db camp_load --levels 0.25 0.5 1 2
+#
+# With the default mix (8 doctors, 2 pharmacists, 2 registration desks)
+# level 1 is a normal camp day; level 2 is twice that.
+
+REPO_DIR = synth.REPO_DIR
+APP_FILE = os.path.join(REPO_DIR, "check.py")
+DEFAULT_MIX = "doctor=8,pharmacy=2,registration=2,admin=0"
+SYMPTOM_QUERIES = ["pain", "fever", "cough", "head", "rash", "vomit"]
+DIAGNOSIS_QUERIES = ["infection", "hypertension", "diabetes", "pain", "fever"]
+
+
+def parse_args():
+    p = argparse.ArgumentParser(prog="python -m bench.loadtest", description="Concurrent check.py sessions")
+    p.add_argument("--mix", default=DEFAULT_MIX, help="Users per role at level 1, e.g. doctor=8,pharmacy=2")
+    p.add_argument("--levels", type=float, nargs="+", default=[0.25, 0.5, 1, 2], help="Multipliers applied to --mix")
+    p.add_argument("--duration", type=float, default=60, help="Seconds per level")
+    p.add_argument("--think", type=float, default=0.5, help="Pause between a user's actions (s)")
+    p.add_argument("--patients", type=int, default=5000, help="Synthetic patients loaded before the run")
+    p.add_argument("--timeout", type=float, default=60, help="AppTest timeout per rerun (s)")
+    p.add_argument("--p95-limit-ms", type=float, default=3000, help="Level counts as overloaded above this p95")
+    p.add_argument("--error-limit", type=float, default=0.05, help="... or above this error rate")
+    p.add_argument("--mysql-host", default="127.0.0.1")
+    p.add_argument("--mysql-port", type=int, default=3306)
+    p.add_argument("--mysql-user", default="root")
+    p.add_argument("--mysql-password", default="")
+    p.add_argument("--mysql-db", default="camp_load", help="Dropped and recreated: never point at the camp DB")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--out", default="loadtest_results.json")
+    return p.parse_args()
+
+
+def parse_mix(mix):
+    users = {}
+    for part in mix.split(","):
+        if part.strip():
+            role, n = part.split("=")
+            users[role.strip()] = int(n)
+    return users
+
+
+# ---------- Stand-in database ----------
+def mysql_connect(args, database=True):
+    import mysql.connector
+    kw = dict(host=args.mysql_host, port=args.mysql_port, user=args.mysql_user, password=args.mysql_password)
+    if database:
+        kw["database"] = args.mysql_db
+    return mysql.connector.connect(**kw)
+
+
+def prepare_database(args):
+    """Fresh DB with synthetic camp data plus the ICD tables the app loads at login."""
+    synth.refuse_live_database(args.mysql_db)
+    server = mysql_connect(args, database=False)
+    cur = server.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{args.mysql_db}`")
+    cur.execute(f"CREATE DATABASE `{args.mysql_db}`")
+    server.close()
+
+    conn = mysql_connect(args)
+    synth.load(conn, synth.generate(args.patients, seed=args.seed), "mysql")
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE icd_diagnosis (code VARCHAR(10), Diagnosis VARCHAR(255))")
+    cur.executemany("INSERT INTO icd_diagnosis VALUES (%s, %s)",
+                    [(f"D{i:03d}", d) for i, d in enumerate(synth.DIAGNOSES)])
+    symptoms = pd.read_csv(synth.SYMPTOM_FILE)[["Symptom", "Body_System"]].fillna("")
+    cur.execute("CREATE TABLE icd10_symptom_list_all (Symptom VARCHAR(255), Body_System VARCHAR(255))")
+    cur.executemany("INSERT INTO icd10_symptom_list_all VALUES (%s, %s)", symptoms.values.tolist())
+    conn.commit()
+    conn.close()
+
+    # The app modules read these when they are first imported
+    os.environ.update({
+        "EMR_DB_HOST": args.mysql_host, "EMR_DB_PORT": str(args.mysql_port),
+        "EMR_DB_USER": args.mysql_user, "EMR_DB_PASSWORD": args.mysql_password,
+        "EMR_DB_NAME": args.mysql_db,
+    })
+
+
+# ---------- Resource sampling ----------
+def process_rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Sampler(threading.Thread):
+    """Samples MySQL Threads_connected and process RSS every `interval` seconds."""
+
+    def __init__(self, args, interval=0.5):
+        super().__init__(daemon=True)
+        self.args = args
+        self.interval = interval
+        self.samples = []
+        self._halt = threading.Event()
+
+    def run(self):
+        conn = mysql_connect(self.args)
+        cur = conn.cursor()
+        while not self._halt.is_set():
+            cur.execute("SHOW GLOBAL STATUS LIKE 'Threads_connected'")
+            connected = int(cur.fetchone()[1]) - 1  # minus this sampler
+            self.samples.append((time.time(), connected, process_rss_mb()))
+            self._halt.wait(self.interval)
+        conn.close()
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+# ---------- Scripted sessions ----------
+def _find(widgets, label=None, key=None, prefix=None):
+    for w in widgets:
+        if key is not None and w.key == key:
+            return w
+        if label is not None and w.label == label:
+            return w
+        if prefix is not None and w.label.startswith(prefix):
+            return w
+    return None
+
+
+class Session:
+    """One logged-in browser tab."""
+
+    def __init__(self, role, user_no, args, log, rng):
+        from streamlit.testing.v1 import AppTest
+        self.role = role
+        self.name = f"{role}-{user_no}"
+        self.args = args
+        self.log = log
+        self.rng = rng
+        self.at = AppTest.from_file(APP_FILE, default_timeout=args.timeout)
+        self.at.session_state["logged_in"] = True
+        self.at.session_state["role"] = role
+        self.at.session_state["username"] = role
+        self.run("login")
+
+    def run(self, step, widget=None):
+        t0 = time.perf_counter()
+        error = None
+        try:
+            if widget is not None:
+                widget.run()
+            else:
+                self.at.run()
+            if self.at.exception:
+                error = self.at.exception[0].message
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.log.append({
+            "t": time.time(), "session": self.name, "role": self.role, "step": step,
+            "ms": (time.perf_counter() - t0) * 1000, "error": error,
+        })
+        return error is None
+
+    def goto(self, page):
+        menu = _find(self.at.sidebar.radio, prefix="📌")
+        if menu is not None and menu.value != page:
+            self.run(f"open {page}", menu.set_value(page))
+
+    # --- flows ---
+    def browse_records(self):
+        self.goto("Patient Records")
+        refresh = _find(self.at.button, prefix="🔄 Refresh Records")
+        if refresh is not None:
+            self.run("refresh records", refresh.click())
+
+    def save_visit(self):
+        self.goto("Patient Entry")
+        picker = _find(self.at.selectbox, label="Select Registered Patient")
+        if picker is None or len(picker.options) < 2:
+            return
+        self.run("select patient", picker.set_value(self.rng.choice(picker.options[1:])))
+
+        for search_key, picker_key, queries in [("sym_search_box", "sym_picker", SYMPTOM_QUERIES),
+                                                ("diag_search_box", "diag_picker", DIAGNOSIS_QUERIES)]:
+            box = _find(self.at.text_input, key=search_key)
+            if box is None:
+                continue
+            self.run(f"search {search_key}", box.input(self.rng.choice(queries)))
+            result = _find(self.at.selectbox, key=picker_key)
+            if result is not None and len(result.options) > 1:
+                self.run(f"pick {picker_key}", result.set_value(result.options[1]))
+
+        med = _find(self.at.selectbox, key="med_0")
+        if med is not None and len(med.options) > 1:
+            self.run("pick medicine", med.set_value(self.rng.choice(med.options[1:])))
+
+        save = _find(self.at.button, label="Save Visit")
+        if save is not None:
+            self.run("save visit", save.click())
+
+    def dispense(self, pending):
+        self.goto("Pharmacy Dispensation")
+        if not pending:
+            return
+        visit_id, label = pending.pop()
+        picker = _find(self.at.selectbox, key="pharmacy_patient_selector")
+        if picker is None or label not in picker.options:
+            return
+        self.run("select patient", picker.set_value(label))
+        visit = _find(self.at.selectbox, key="pharmacy_visit_selector")
+        if visit is None:
+            return
+        option = next((o for o in visit.options if o.startswith(f"{visit_id} ")), None)
+        if option is None:
+            return
+        self.run("select visit", visit.set_value(option))
+        for qty in self.at.number_input:
+            if qty.key and qty.key.startswith(f"qty_{visit_id}_") and (qty.max or 0) > 0:
+                qty.set_value(1)
+        confirm = _find(self.at.button, prefix="✅ Confirm Dispensation")
+        if confirm is not None:
+            self.run("confirm dispensation", confirm.click())
+
+    def register(self):
+        form = {w.label: w for w in self.at.text_input}
+        if "Patient Name" not in form:
+            return
+        name = " ".join(self.rng.choice(synth.FIRST_NAMES + synth.LAST_NAMES) for _ in range(2))
+        form["Patient Name"].input(name)
+        form["Phone Number"].input("03" + "".join(self.rng.choice(string.digits) for _ in range(9)))
+        _find(self.at.number_input, label="Age").set_value(self.rng.randint(1, 90))
+        _find(self.at.selectbox, label="Gender").set_value(self.rng.choice(["Male", "Female"]))
+        self.run("register patient", _find(self.at.button, label="Register Patient").click())
+        anyway = _find(self.at.button, key="reg_dup_new")
+        if anyway is not None:
+            self.run("register anyway", anyway.click())
+
+    def step(self, pending):
+        if self.role == "doctor":
+            self.save_visit() if self.rng.random() < 0.8 else self.browse_records()
+        elif self.role == "pharmacy":
+            self.dispense(pending) if self.rng.random() < 0.8 else self.browse_records()
+        elif self.role == "registration":
+            self.register()
+        else:
+            self.browse_records()
+
+
+def pending_dispensations(args, limit=5000):
+    """(visit_id, pharmacy selectbox label) of undispensed visits, shared by the pharmacists."""
+    conn = mysql_connect(args)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT v.visit_id, p.patient_id, p.patient_name FROM visits v
+        JOIN patients p ON p.patient_id = v.patient_id
+        WHERE v.dispensed <> 'Yes' ORDER BY v.visit_id DESC LIMIT %s
+    """, (limit,))
+    rows = [(vid, f"{pid} - {name}") for vid, pid, name in cur.fetchall()]
+    conn.close()
+    return rows
+
+
+def user_loop(role, user_no, args, log, pending, start_gate):
+    rng = random.Random(f"{args.seed}-{role}-{user_no}")
+    start_gate.wait()
+    deadline = time.time() + args.duration
+    try:
+        session = Session(role, user_no, args, log, rng)
+    except Exception as e:
+        log.append({"t": time.time(), "session": f"{role}-{user_no}", "role": role, "step": "login",
+                    "ms": 0.0, "error": f"{type(e).__name__}: {e}"})
+        return
+    while time.time() < deadline:
+        session.step(pending)
+        time.sleep(args.think * rng.uniform(0.5, 1.5))
+
+
+# ---------- Reporting ----------
+def summarize(log, samples, n_users, duration):
+    df = pd.DataFrame(log)
+    out = {"users": n_users, "reruns": len(df)}
+    if df.empty:
+        return out
+    ok = df[df["error"].isna()]
+    out["errors"] = int(df["error"].notna().sum())
+    out["error_rate"] = round(out["errors"] / len(df), 4)
+    out["reruns_per_s"] = round(len(df) / duration, 2)
+    for p in (50, 95, 99):
+        out[f"p{p}_ms"] = round(float(np.percentile(ok["ms"], p)), 1) if not ok.empty else None
+    out["by_role"] = {
+        role: {f"p{p}_ms": round(float(np.percentile(g["ms"], p)), 1) for p in (50, 95, 99)} | {"reruns": len(g)}
+        for role, g in ok.groupby("role")
+    }
+    out["slowest_steps"] = (
+        ok.groupby("step")["ms"].quantile(0.95).sort_values(ascending=False).head(5).round(1).to_dict()
+    )
+    out["sample_errors"] = df["error"].dropna().value_counts().head(5).to_dict()
+    if samples:
+        conns = [s[1] for s in samples]
+        rss = [s[2] for s in samples]
+        out["db_connections_max"] = max(conns)
+        out["db_connections_mean"] = round(float(np.mean(conns)), 1)
+        out["rss_mb_max"] = round(max(rss), 1)
+    return out
+
+
+def run_level(args, mix, level, pending):
+    # AppTest flips global.appTest on and back off around every run; with
+    # overlapping sessions the first run to finish would switch it off under
+    # the others. Turn it on once for the whole process instead.
+    from streamlit import config
+    config.set_option("global.appTest", True)
+
+    counts = {role: max(0, round(n * level)) for role, n in mix.items()}
+    n_users = sum(counts.values())
+    log = []
+    start_gate = threading.Barrier(n_users + 1) if n_users else None
+    threads = [
+        threading.Thread(target=user_loop, args=(role, i, args, log, pending, start_gate), daemon=True)
+        for role, n in counts.items() for i in range(n)
+    ]
+    sampler = Sampler(args)
+    sampler.start()
+    for t in threads:
+        t.start()
+    if start_gate:
+        start_gate.wait()
+    t0 = time.time()
+    for t in threads:
+        t.join()
+    sampler.stop()
+    summary = summarize(log, sampler.samples, n_users, max(time.time() - t0, 1e-9))
+    summary["level"] = level
+    summary["mix"] = counts
+    return summary
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, REPO_DIR)
+    mix = parse_mix(args.mix)
+    prepare_database(args)
+    pending = pending_dispensations(args)
+
+    conn = mysql_connect(args)
+    cur = conn.cursor()
+    cur.execute("SHOW VARIABLES LIKE 'max_connections'")
+    max_connections = int(cur.fetchone()[1])
+    conn.close()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "patients": args.patients,
+            "duration_s": args.duration,
+            "think_s": args.think,
+            "mysql_max_connections": max_connections,
+        },
+        "levels": [],
+        "overloaded_at": None,
+    }
+
+    for level in args.levels:
+        s = run_level(args, mix, level, pending)
+        results["levels"].append(s)
+        print(f"level {level:<5} users {s['users']:>3}  reruns {s['reruns']:>5}  "
+              f"p50 {s.get('p50_ms')} ms  p95 {s.get('p95_ms')} ms  p99 {s.get('p99_ms')} ms  "
+              f"errors {s.get('errors', 0)}  conns {s.get('db_connections_max')}  rss {s.get('rss_mb_max')} MB")
+        overloaded = (s.get("p95_ms") or 0) > args.p95_limit_ms or s.get("error_rate", 0) > args.error_limit
+        if overloaded and results["overloaded_at"] is None:
+            results["overloaded_at"] = level
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+    if results["overloaded_at"] is not None:
+        print(f"\nOverloaded from level {results['overloaded_at']} "
+              f"(p95 > {args.p95_limit_ms} ms or error rate > {args.error_limit:.0%})")
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
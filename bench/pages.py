@@ -0,0 +1,70 @@
+import pandas as pd
+
+import camp_queries as q
+import prescriptions as rx
+from bench.schema import adapt_sql
+
+# ---------- Page Workloads ----------
+# Each workload replays the data work one page render does (queries +
+# pandas transforms from camp_queries), without the Streamlit widgets.
+# Returns the number of rows the page had to handle.
+
+
+def _read(conn, backend, sql, params=None):
+    return pd.read_sql(adapt_sql(sql, backend), conn, params=params)
+
+
+def patient_entry(conn, backend, ctx):
+    """Patient Entry: patient selectbox + loading the selected patient."""
+    patients_df = _read(conn, backend, q.PATIENT_LIST_SQL)
+    q.patient_option_labels(patients_df)
+    one = _read(conn, backend, q.PATIENT_BY_ID_SQL, (ctx["patient_id"],))
+    return len(patients_df) + len(one)
+
+
+def patient_records(conn, backend, ctx):
+    """Patient Records: full patient/visit join + analytics dashboard."""
+    df = _read(conn, backend, q.RECORDS_SQL)
+    q.records_analytics(df)
+    return len(df)
+
+
+def pharmacy_dispensation(conn, backend, ctx):
+    """Pharmacy: patient picker, visits of one patient, prescription lines + stock match per visit."""
+    stock_df = _read(conn, backend, q.STOCK_SQL)
+    patients_df = _read(conn, backend, q.PHARMACY_PATIENTS_SQL)
+    [f"{row['patient_id']} - {row['patient_name']}" for _, row in patients_df.iterrows()]
+    visits_df = _read(conn, backend, q.PHARMACY_VISITS_SQL, (ctx["busy_patient_id"],))
+    lines = 0
+    for visit_id in visits_df["visit_id"]:
+        for line in _read(conn, backend, rx.LOAD_SQL, (int(visit_id),)).itertuples(index=False):
+            q.stock_rows_for_generic(stock_df, str(line.generic).lower())
+            q.stock_row_for_brand(stock_df, str(line.generic).lower(), str(line.brand))
+            lines += 1
+    return len(stock_df) + len(patients_df) + len(visits_df) + lines
+
+
+def dental_records(conn, backend, ctx):
+    """Dental Records: summary table + full CSV export."""
+    summary_df = _read(conn, backend, q.DENTAL_SUMMARY_SQL)
+    full_df = _read(conn, backend, q.DENTAL_FULL_SQL)
+    full_df.to_csv(index=False)
+    return len(summary_df) + len(full_df)
+
+
+WORKLOADS = {
+    "patient_entry": patient_entry,
+    "patient_records": patient_records,
+    "pharmacy_dispensation": pharmacy_dispensation,
+    "dental_records": dental_records,
+}
+
+
+def make_context(data):
+    """Fixed inputs for the workloads: a mid-list patient and the patient with the most visits."""
+    patients = data["patients"]
+    busiest = data["visits"]["patient_id"].value_counts().idxmax()
+    return {
+        "patient_id": int(patients["patient_id"].iloc[len(patients) // 2]),
+        "busy_patient_id": int(busiest),
+    }
@@ -0,0 +1,98 @@
+# ---------- Benchmark schema ----------
+# Mirrors the tables created by medical_camp.init_db (plus dental_visits,
+# which dental_camp writes to) for the two stand-in backends.
+
+SQLITE_DDL = [
+    """
+    CREATE TABLE patients (
+        patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_name TEXT, cnic TEXT, nationality TEXT, address TEXT,
+        phone TEXT, gender TEXT, age INTEGER
+    )""",
+    """
+    CREATE TABLE visits (
+        visit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER REFERENCES patients(patient_id),
+        doctor_type TEXT, visit_date TEXT, history TEXT, bp TEXT, bp_sys INTEGER, bp_dia INTEGER,
+        heart_rate INTEGER, sat_o2 REAL, temp REAL, rr INTEGER, blood_glucose REAL,
+        gender TEXT, age INTEGER, symptoms TEXT, indications TEXT, medicines TEXT, medicine_keys TEXT,
+        dispensed TEXT, dispensed_details TEXT
+    )""",
+    "CREATE INDEX idx_visits_patient ON visits (patient_id)",
+    """
+    CREATE TABLE stock (
+        "key" TEXT PRIMARY KEY, generic TEXT, brand TEXT, dosage_form TEXT,
+        dose TEXT, expiry TEXT, unit TEXT, stock_qty INTEGER
+    )""",
+    """
+    CREATE TABLE dental_visits (
+        visit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER REFERENCES patients(patient_id),
+        doctor_name TEXT, visit_date TEXT,
+        presenting_complaint TEXT, history_complaint TEXT,
+        la_experience TEXT, scaling TEXT, filling_rct TEXT, extraction TEXT, prosthesis TEXT,
+        smoking TEXT, gutkha TEXT, naswar TEXT, pan TEXT, mauva TEXT, alcohol TEXT,
+        brushing_type TEXT, brushing_freq TEXT, brushing_timing TEXT,
+        medical_history_notes TEXT, dentition_status TEXT,
+        provisional_diagnosis TEXT, medicines TEXT, dispensed TEXT,
+        pre_op_image TEXT, post_op_image TEXT
+    )""",
+    "CREATE INDEX idx_dental_patient ON dental_visits (patient_id)",
+    """
+    CREATE TABLE visit_prescriptions (
+        visit_id INTEGER, line_no INTEGER, stock_key TEXT, generic TEXT, brand TEXT,
+        frequency TEXT, time_of_day TEXT, amount TEXT, qty INTEGER,
+        PRIMARY KEY (visit_id, line_no)
+    )""",
+]
+
+MYSQL_DDL = [
+    """
+    CREATE TABLE patients (
+        patient_id INT AUTO_INCREMENT PRIMARY KEY,
+        patient_name VARCHAR(255), cnic VARCHAR(20), nationality VARCHAR(100), address TEXT,
+        phone VARCHAR(20), gender VARCHAR(10), age INT
+    ) ENGINE=InnoDB""",
+    """
+    CREATE TABLE visits (
+        visit_id INT AUTO_INCREMENT PRIMARY KEY,
+        patient_id INT,
+        doctor_type VARCHAR(100), visit_date DATETIME, history TEXT, bp VARCHAR(20), bp_sys INT, bp_dia INT,
+        heart_rate INT, sat_o2 FLOAT, temp FLOAT, rr INT, blood_glucose FLOAT,
+        gender VARCHAR(10), age INT, symptoms TEXT, indications TEXT, medicines TEXT, medicine_keys TEXT,
+        dispensed VARCHAR(10), dispensed_details TEXT,
+        FOREIGN KEY (patient_id) REFERENCES patients(patient_id)
+    ) ENGINE=InnoDB""",
+    """
+    CREATE TABLE stock (
+        `key` VARCHAR(255) PRIMARY KEY, generic VARCHAR(255), brand VARCHAR(255),
+        dosage_form VARCHAR(255), dose VARCHAR(100), expiry DATE, unit VARCHAR(50), stock_qty INT
+    ) ENGINE=InnoDB""",
+    """
+    CREATE TABLE dental_visits (
+        visit_id INT AUTO_INCREMENT PRIMARY KEY,
+        patient_id INT,
+        doctor_name VARCHAR(100), visit_date DATETIME,
+        presenting_complaint TEXT, history_complaint TEXT,
+        la_experience VARCHAR(5), scaling VARCHAR(5), filling_rct VARCHAR(5), extraction VARCHAR(5), prosthesis VARCHAR(5),
+        smoking VARCHAR(5), gutkha VARCHAR(5), naswar VARCHAR(5), pan VARCHAR(5), mauva VARCHAR(5), alcohol VARCHAR(5),
+        brushing_type VARCHAR(20), brushing_freq VARCHAR(20), brushing_timing VARCHAR(20),
+        medical_history_notes TEXT, dentition_status TEXT,
+        provisional_diagnosis TEXT, medicines TEXT, dispensed VARCHAR(10),
+        pre_op_image VARCHAR(255), post_op_image VARCHAR(255),
+        FOREIGN KEY (patient_id) REFERENCES patients(patient_id)
+    ) ENGINE=InnoDB""",
+    """
+    CREATE TABLE visit_prescriptions (
+        visit_id INT, line_no INT, stock_key VARCHAR(255), generic VARCHAR(255), brand VARCHAR(255),
+        frequency VARCHAR(50), time_of_day VARCHAR(50), amount VARCHAR(50), qty INT,
+        PRIMARY KEY (visit_id, line_no)
+    ) ENGINE=InnoDB""",
+]
+
+TABLES = ["visit_prescriptions", "dental_visits", "visits", "stock", "patients"]
+
+
+def adapt_sql(sql, backend):
+    """Page queries are written for MySQL (%s); SQLite wants ?."""
+    return sql.replace("%s", "?") if backend == "sqlite" else sql
@@ -0,0 +1,234 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from bench.schema import MYSQL_DDL, SQLITE_DDL, TABLES
+
+# ---------- Synthetic Camp Workload ----------
+# N patients with ~1.5 visits each, symptoms drawn from
+# ICD10_Symptom_List_All.csv, prescriptions drawn from the drug list, about
+# 60% of visits dispensed and ~20% of patients seen by the dentist.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYMPTOM_FILE = os.path.join(REPO_DIR, "ICD10_Symptom_List_All.csv")
+DRUG_FILE = os.path.join(REPO_DIR, "ERR Drug Audit.csv")
+
+FIRST_NAMES = ["Muhammad", "Ali", "Ahmed", "Fatima", "Ayesha", "Hassan", "Bilal", "Zainab", "Usman", "Sana",
+               "Imran", "Nadia", "Hamza", "Khadija", "Umar", "Maryam", "Asif", "Rabia", "Tariq", "Hina"]
+LAST_NAMES = ["Khan", "Hussain", "Shah", "Malik", "Iqbal", "Raza", "Butt", "Qureshi", "Sheikh", "Abbasi",
+              "Baloch", "Chaudhry", "Siddiqui", "Mirza", "Ansari"]
+DOCTOR_TYPES = ["General Physician", "Cardiologist", "Pediatrician", "Dermatologist", "Other"]
+DIAGNOSES = ["Acute upper respiratory infection", "Essential hypertension", "Type 2 diabetes mellitus",
+             "Gastroenteritis", "Iron deficiency anaemia", "Scabies", "Urinary tract infection",
+             "Acute pharyngitis", "Allergic rhinitis", "Dyspepsia", "Tension-type headache",
+             "Low back pain", "Malaria", "Typhoid fever", "Bronchial asthma", "Conjunctivitis"]
+HISTORY_PHRASES = ["fever for 3 days", "cough and runny nose", "burning micturition", "joint pain",
+                   "loose motions since yesterday", "itching at night", "headache on and off",
+                   "known diabetic, poor compliance", "shortness of breath on exertion", "epigastric pain after meals"]
+FREQUENCIES = ["1+0+1", "1+1+1", "0+0+1", "1+0+0"]
+DURATIONS = ["3 Days", "5 Days", "7 Days"]
+DENTAL_DIAGNOSES = ["Dental caries", "Chronic periodontitis", "Pulpitis", "Gingivitis", "Dental abscess", "Fractured tooth"]
+DENTAL_COMPLAINTS = ["toothache", "bleeding gums", "swelling", "sensitivity to cold", "broken tooth", "bad breath"]
+TOOTH_CODES = ["Decayed (D)", "Filled (F)", "Mobile (M)", "BDR", "Missing"]
+CAMP_START = pd.Timestamp("2026-01-10 08:00")
+
+
+def load_symptoms():
+    return pd.read_csv(SYMPTOM_FILE)["Symptom"].dropna().astype(str).tolist()
+
+
+def load_stock():
+    """Drug list normalised the way it is imported into the stock table."""
+    stock = pd.read_csv(DRUG_FILE)
+    stock.columns = stock.columns.str.strip()
+    stock = stock[["Generic", "Brand", "Dosage Form", "Dose", "Expiry", "Quantity", "Unit"]].copy()
+    for col in ["Generic", "Brand", "Dosage Form"]:
+        stock[col] = stock[col].fillna("").astype(str).str.strip().str.title()
+    stock["Dose"] = stock["Dose"].fillna("").astype(str).str.strip()
+    stock = stock[(stock["Generic"] != "") | (stock["Brand"] != "")]
+    out = pd.DataFrame({
+        "key": (stock["Generic"] + "||" + stock["Brand"] + "||" + stock["Dosage Form"] + "||" + stock["Dose"]).str.lower(),
+        "generic": stock["Generic"],
+        "brand": stock["Brand"],
+        "dosage_form": stock["Dosage Form"],
+        "dose": stock["Dose"],
+        "expiry": pd.to_datetime(stock["Expiry"].astype(str).str.strip(), format="%y-%b", errors="coerce").dt.strftime("%Y-%m-%d"),
+        "unit": stock["Unit"].fillna("").astype(str).str.strip().str.lower(),
+        "stock_qty": pd.to_numeric(stock["Quantity"], errors="coerce").fillna(0).astype(int),
+    })
+    out = out.drop_duplicates("key").reset_index(drop=True)
+    return out.astype(object).where(out.notna(), None)
+
+
+def _pick_joined(rng, pool, counts, sep="; "):
+    idx = rng.integers(0, len(pool), size=int(counts.sum()))
+    out, pos = [], 0
+    for c in counts:
+        out.append(sep.join(pool[i] for i in idx[pos:pos + c]))
+        pos += c
+    return out
+
+
+def generate(n_patients, seed=42):
+    """Return a dict of DataFrames: patients, visits, stock, dental_visits, visit_prescriptions."""
+    rng = np.random.default_rng(seed)
+    symptoms = load_symptoms()
+    stock = load_stock()
+
+    # --- patients ---
+    first = np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), n_patients)]
+    last = np.array(LAST_NAMES)[rng.integers(0, len(LAST_NAMES), n_patients)]
+    has_cnic = rng.random(n_patients) < 0.7
+    cnic_digits = rng.integers(10**12, 10**13, n_patients).astype(str)
+    cnic = np.where(
+        has_cnic,
+        [f"{c[:5]}-{c[5:12]}-{c[12:]}" for c in cnic_digits],
+        [f"NO-ID-{x}" for x in rng.integers(100000, 999999, n_patients)]
+    )
+    patients = pd.DataFrame({
+        "patient_id": np.arange(1, n_patients + 1),
+        "patient_name": np.char.add(np.char.add(first, " "), last),
+        "cnic": cnic,
+        "nationality": "Pakistani",
+        "address": "Village " + pd.Series(rng.integers(1, 200, n_patients)).astype(str),
+        "phone": ["03" + str(x) for x in rng.integers(10**8, 10**9, n_patients)],
+        "gender": np.array(["Male", "Female"])[rng.integers(0, 2, n_patients)],
+        "age": rng.integers(1, 90, n_patients),
+    })
+
+    # --- medical visits ---
+    n_visits = int(n_patients * 1.5)
+    v_patient = rng.integers(1, n_patients + 1, n_visits)
+    v_date = CAMP_START + pd.to_timedelta(np.sort(rng.integers(0, 3 * 10 * 3600, n_visits)), unit="s")
+    sys_bp = rng.normal(125, 18, n_visits).astype(int)
+    dia_bp = rng.normal(80, 10, n_visits).astype(int)
+
+    med_counts = rng.integers(1, 5, n_visits)
+    drug_idx = rng.integers(0, len(stock), int(med_counts.sum()))
+    freq_idx = rng.integers(0, len(FREQUENCIES), len(drug_idx))
+    dur_idx = rng.integers(0, len(DURATIONS), len(drug_idx))
+    med_lines = [
+        f"{stock.at[d, 'generic']} [{stock.at[d, 'brand']}] ({FREQUENCIES[f]}, {DURATIONS[t]})"
+        for d, f, t in zip(drug_idx, freq_idx, dur_idx)
+    ]
+    med_keys = stock["key"].to_numpy()[drug_idx]
+    medicines, medicine_keys, pos = [], [], 0
+    for c in med_counts:
+        medicines.append("; ".join(med_lines[pos:pos + c]))
+        medicine_keys.append("; ".join(med_keys[pos:pos + c]))
+        pos += c
+    # the same lines as visit_prescriptions rows (qty = doses per day x days)
+    prescriptions = pd.DataFrame({
+        "visit_id": np.repeat(np.arange(1, n_visits + 1), med_counts),
+        "line_no": np.concatenate([np.arange(c) for c in med_counts]),
+        "stock_key": med_keys,
+        "generic": stock["generic"].to_numpy()[drug_idx],
+        "brand": stock["brand"].to_numpy()[drug_idx],
+        "frequency": np.array(FREQUENCIES)[freq_idx],
+        "time_of_day": "After Meal",
+        "amount": np.array(DURATIONS)[dur_idx],
+        "qty": [sum(map(int, FREQUENCIES[f].split("+"))) * int(DURATIONS[t].split()[0]) for f, t in zip(freq_idx, dur_idx)],
+    })
+
+    dispensed = rng.random(n_visits) < 0.6
+    visits = pd.DataFrame({
+        "visit_id": np.arange(1, n_visits + 1),
+        "patient_id": v_patient,
+        "doctor_type": np.array(DOCTOR_TYPES)[rng.integers(0, len(DOCTOR_TYPES), n_visits)],
+        "visit_date": v_date.strftime("%Y-%m-%d %H:%M:%S"),
+        "history": np.array(HISTORY_PHRASES)[rng.integers(0, len(HISTORY_PHRASES), n_visits)],
+        "bp": [f"{s}/{d}" for s, d in zip(sys_bp, dia_bp)],
+        "bp_sys": sys_bp,
+        "bp_dia": dia_bp,
+        "heart_rate": rng.normal(82, 12, n_visits).astype(int),
+        "sat_o2": np.clip(rng.normal(97, 2.5, n_visits), 70, 100).round(0),
+        "temp": rng.normal(37.1, 0.7, n_visits).round(1),
+        "rr": rng.normal(18, 3, n_visits).astype(int),
+        "blood_glucose": np.clip(rng.normal(120, 45, n_visits), 40, 450).round(0),
+        "gender": patients["gender"].to_numpy()[v_patient - 1],
+        "age": patients["age"].to_numpy()[v_patient - 1],
+        "symptoms": _pick_joined(rng, symptoms, rng.integers(1, 5, n_visits)),
+        "indications": _pick_joined(rng, DIAGNOSES, rng.integers(1, 3, n_visits)),
+        "medicines": medicines,
+        "medicine_keys": medicine_keys,
+        "dispensed": np.where(dispensed, "Yes", "No"),
+        "dispensed_details": np.where(
+            dispensed, [m.split(" (")[0] + " (Qty: 10)" for m in medicines], None
+        ),
+    })
+
+    # --- dental visits ---
+    n_dental = max(1, n_patients // 5)
+    d_patient = rng.choice(np.arange(1, n_patients + 1), size=n_dental, replace=False)
+    yes_no = np.array(["No", "Yes"])
+    flags = {c: yes_no[(rng.random(n_dental) < p).astype(int)] for c, p in [
+        ("la_experience", 0.3), ("scaling", 0.2), ("filling_rct", 0.15), ("extraction", 0.3), ("prosthesis", 0.05),
+        ("smoking", 0.25), ("gutkha", 0.15), ("naswar", 0.1), ("pan", 0.2), ("mauva", 0.05), ("alcohol", 0.01)]}
+    charts = [
+        json.dumps({str(t): TOOTH_CODES[rng.integers(0, len(TOOTH_CODES))]
+                    for t in rng.choice([11, 12, 16, 21, 26, 36, 37, 46, 47], size=rng.integers(0, 4), replace=False)})
+        for _ in range(n_dental)
+    ]
+    dental = pd.DataFrame({
+        "visit_id": np.arange(1, n_dental + 1),
+        "patient_id": d_patient,
+        "doctor_name": "Dentist",
+        "visit_date": (CAMP_START + pd.to_timedelta(np.sort(rng.integers(0, 3 * 10 * 3600, n_dental)), unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "presenting_complaint": np.array(DENTAL_COMPLAINTS)[rng.integers(0, len(DENTAL_COMPLAINTS), n_dental)],
+        "history_complaint": np.array(HISTORY_PHRASES)[rng.integers(0, len(HISTORY_PHRASES), n_dental)],
+        **flags,
+        "brushing_type": np.array(["Nil", "Finger", "Miswak", "Brush"])[rng.integers(0, 4, n_dental)],
+        "brushing_freq": np.array(["OD (Once)", "BD (Twice)", "TDS (Thrice)"])[rng.integers(0, 3, n_dental)],
+        "brushing_timing": np.array(["Morning", "Night", "Both"])[rng.integers(0, 3, n_dental)],
+        "medical_history_notes": "",
+        "dentition_status": charts,
+        "provisional_diagnosis": np.array(DENTAL_DIAGNOSES)[rng.integers(0, len(DENTAL_DIAGNOSES), n_dental)],
+        "medicines": "Amoxicillin (1+0+1, 5 Days)",
+        "dispensed": "No",
+        "pre_op_image": None,
+        "post_op_image": None,
+    })
+
+    return {"patients": patients, "visits": visits, "stock": stock, "dental_visits": dental,
+            "visit_prescriptions": prescriptions}
+
+
+# ---------- Loading into a stand-in database ----------
+LIVE_DATABASES = {"emr_system", "medical_camp"}
+
+
+def refuse_live_database(name):
+    """Stop before a benchmark drops `name` if it is (or may be) the camp's real database."""
+    live = LIVE_DATABASES | {os.environ.get("EMR_DB_NAME", "emr_system")}
+    if name.lower() in {db.lower() for db in live}:
+        raise SystemExit(f"Refusing to drop the live `{name}` database: pass a throwaway --mysql-db.")
+
+
+def _rows(df):
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+def load(conn, data, backend, chunk_size=5000):
+    """(Re)create the schema and bulk insert the generated data."""
+    cur = conn.cursor()
+    if backend == "mysql":
+        cur.execute("SET FOREIGN_KEY_CHECKS=0")
+    for table in TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    if backend == "mysql":
+        cur.execute("SET FOREIGN_KEY_CHECKS=1")
+    for ddl in (SQLITE_DDL if backend == "sqlite" else MYSQL_DDL):
+        cur.execute(ddl)
+
+    ph = "?" if backend == "sqlite" else "%s"
+    for table in ["patients", "visits", "stock", "dental_visits", "visit_prescriptions"]:
+        df = data[table]
+        cols = ", ".join(f"`{c}`" if c == "key" else c for c in df.columns)
+        sql = f"INSERT INTO {table} ({cols}) VALUES ({', '.join([ph] * len(df.columns))})"
+        rows = _rows(df)
+        for start in range(0, len(rows), chunk_size):
+            cur.executemany(sql, rows[start:start + chunk_size])
+    conn.commit()
+    cur.close()
@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import streamlit as st
+
+# ---------- Camp Server Metrics ----------
+# In-process counters, exposed in Prometheus text format on a small HTTP
+# endpoint that runs next to Streamlit:
+#
+#   check.py        -> http://<host>:9108/metrics
+#   dental_camp.py  -> http://<host>:9109/metrics
+#
+# (EMR_METRICS_PORT overrides the port, 0 turns the endpoint off.)
+# Incrementing is a dict update under a lock, cheap enough for every query.
+
+SESSION_IDLE_SECONDS = 300      # a session counts as active for 5 min after its last rerun
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+
+
+def _fmt_labels(names, values, extra=""):
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=(), rate_window=None):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.values = {}
+        # Timestamps of recent increments, for the "... per minute" gauges
+        self.rate_window = rate_window
+        self.recent = deque()
+
+    def inc(self, *labels, n=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + n
+            if self.rate_window:
+                self.recent.append((time.time(), labels, n))
+
+    def per_window(self):
+        cutoff = time.time() - self.rate_window
+        with _lock:
+            while self.recent and self.recent[0][0] < cutoff:
+                self.recent.popleft()
+            out = {}
+            for _, labels, n in self.recent:
+                out[labels] = out.get(labels, 0) + n
+        return out
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            items = list(self.values.items())
+        lines += [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in items]
+        if self.rate_window:
+            name = self.name.replace("_total", "_per_minute")
+            lines += [f"# HELP {name} {self.help} in the last {self.rate_window:g} s", f"# TYPE {name} gauge"]
+            per = self.per_window()
+            lines += [f"{name}{_fmt_labels(self.labelnames, k)} {per.get(k, 0)}" for k, _ in items]
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.values = {}
+
+    def inc(self, *labels, n=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + n
+
+    def dec(self, *labels, n=1):
+        self.inc(*labels, n=-n)
+
+    def set(self, value, *labels):
+        with _lock:
+            self.values[labels] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with _lock:
+            items = list(self.values.items())
+        lines += [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        with _lock:
+            s = self.series.get(labels)
+            if s is None:
+                s = self.series[labels] = [0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+                    break
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = [(k, list(v)) for k, v in self.series.items()]
+        for labels, s in items:
+            cumulative = 0
+            for i, b in enumerate(self.buckets):
+                cumulative += s[i]
+                le = 'le="%g"' % b
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {s[-1]}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {s[-2]:.6f}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {s[-1]}")
+        return lines
+
+
+# ---------- The camp's metrics ----------
+VISITS_SAVED = Counter("camp_visits_saved_total", "Visits saved", ["app"], rate_window=60)
+DISPENSATIONS = Counter("camp_dispensations_total", "Dispensations confirmed", rate_window=60)
+CACHE_LOOKUPS = Counter("camp_cache_lookups_total", "Reference data lookups (ICD lists, stock)", ["cache"])
+CACHE_MISSES = Counter("camp_cache_misses_total", "Lookups that had to go to MySQL", ["cache"])
+DB_CONNECTIONS_OPEN = Gauge("camp_db_connections_open", "MySQL connections currently open by this process")
+DB_CONNECTIONS_PEAK = Gauge("camp_db_connections_peak", "Most MySQL connections open at once since start")
+QUERY_LATENCY = Histogram("camp_query_latency_seconds", "MySQL statement latency (execute + fetch)", labelnames=["app"])
+CONNECT_LATENCY = Histogram("camp_db_connect_seconds", "Time to open a MySQL connection")
+
+_sessions = {}   # session tag -> (role, last seen)
+
+
+def touch_session(session, role):
+    if session:
+        with _lock:
+            _sessions[session] = (role, time.time())
+
+
+def cache_lookup(cache):
+    CACHE_LOOKUPS.inc(cache)
+
+
+def cache_miss(cache):
+    CACHE_MISSES.inc(cache)
+
+
+def connection_opened(seconds):
+    CONNECT_LATENCY.observe(seconds)
+    DB_CONNECTIONS_OPEN.inc()
+    with _lock:
+        peak = max(DB_CONNECTIONS_PEAK.values.get((), 0), DB_CONNECTIONS_OPEN.values.get((), 0))
+        DB_CONNECTIONS_PEAK.values[()] = peak
+
+
+def connection_closed():
+    DB_CONNECTIONS_OPEN.dec()
+
+
+def _active_sessions_lines():
+    cutoff = time.time() - SESSION_IDLE_SECONDS
+    counts = {}
+    with _lock:
+        for tag, (role, seen) in list(_sessions.items()):
+            if seen < cutoff:
+                del _sessions[tag]
+            else:
+                counts[role] = counts.get(role, 0) + 1
+    lines = ["# HELP camp_active_sessions Sessions with a rerun in the last 5 minutes",
+             "# TYPE camp_active_sessions gauge"]
+    lines += [f'camp_active_sessions{{role="{r}"}} {n}' for r, n in sorted(counts.items())]
+    return lines
+
+
+def _cache_hit_rate_lines():
+    with _lock:
+        lookups, misses = dict(CACHE_LOOKUPS.values), dict(CACHE_MISSES.values)
+    lines = ["# HELP camp_cache_hit_ratio Share of lookups served without going to MySQL",
+             "# TYPE camp_cache_hit_ratio gauge"]
+    for (cache,), n in sorted(lookups.items()):
+        ratio = max(0.0, 1 - misses.get((cache,), 0) / n)
+        lines.append(f'camp_cache_hit_ratio{{cache="{cache}"}} {ratio:.4f}')
+    return lines
+
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    lines = _active_sessions_lines()
+    for metric in (VISITS_SAVED, DISPENSATIONS, CACHE_LOOKUPS, CACHE_MISSES):
+        lines += metric.render()
+    lines += _cache_hit_rate_lines()
+    for metric in (DB_CONNECTIONS_OPEN, DB_CONNECTIONS_PEAK, QUERY_LATENCY, CONNECT_LATENCY):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ---------- HTTP endpoint ----------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass   # keep the Streamlit console clean
+
+
+@st.cache_resource
+def start_metrics_server(default_port):
+    """Start the endpoint once per process. Returns the port, or None if disabled/busy."""
+    port = int(os.environ.get("EMR_METRICS_PORT", default_port))
+    if port == 0:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError:
+        return None   # port taken (e.g. a second app on this laptop); metrics stay in-process
+    threading.Thread(target=server.serve_forever, name="camp-metrics", daemon=True).start()
+    return port
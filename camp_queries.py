@@ -0,0 +1,129 @@
+import re
+
+import pandas as pd
+
+import vitals
+
+# ---------- Page Queries & Transforms ----------
+# The SQL and pandas work behind the main pages, kept in one place so the
+# pages and the benchmark suite (bench/) run exactly the same code.
+# Queries use MySQL "%s" placeholders.
+
+# --- Patient Entry ---
+PATIENT_LIST_SQL = "SELECT patient_id, patient_name, cnic FROM patients ORDER BY patient_id DESC"
+PATIENTS_SINCE_SQL = "SELECT patient_id, patient_name, cnic FROM patients WHERE patient_id > %s ORDER BY patient_id DESC"
+PATIENT_BY_ID_SQL = "SELECT * FROM patients WHERE patient_id=%s"
+
+# --- Patient Records ---
+RECORDS_SQL = """
+    SELECT
+        p.patient_id, p.patient_name, p.cnic, p.age, p.gender,
+        v.visit_id, v.doctor_type, v.visit_date, v.history,
+        v.bp, v.bp_sys, v.bp_dia, v.heart_rate, v.sat_o2, v.temp, v.rr, v.blood_glucose,
+        v.symptoms, v.indications,
+        v.medicines, v.dispensed, v.dispensed_details
+    FROM patients p
+    LEFT JOIN visits v ON p.patient_id = v.patient_id
+    ORDER BY v.visit_date DESC, p.patient_id DESC
+"""
+
+# --- Pharmacy Dispensation ---
+PHARMACY_PATIENTS_SQL = "SELECT * FROM patients"
+PHARMACY_VISITS_SQL = "SELECT visit_id, patient_id, visit_date, doctor_type, dispensed FROM visits WHERE patient_id=%s ORDER BY visit_date DESC"
+STOCK_SQL = "SELECT * FROM stock"
+
+# --- Dental Records ---
+DENTAL_PATIENTS_SQL = "SELECT * FROM patients ORDER BY patient_id DESC"
+DENTAL_SUMMARY_SQL = """
+    SELECT d.visit_id, p.patient_name, p.age, p.gender, d.visit_date, d.provisional_diagnosis
+    FROM dental_visits d
+    JOIN patients p ON d.patient_id = p.patient_id
+    ORDER BY d.visit_date DESC
+"""
+DENTAL_FULL_SQL = """
+    SELECT *
+    FROM dental_visits d
+    JOIN patients p ON d.patient_id = p.patient_id
+    ORDER BY d.visit_date DESC
+"""
+
+AGE_BINS = [0, 10, 20, 30, 40, 50, 60, 120]
+AGE_LABELS = ['0-10', '11-20', '21-30', '31-40', '41-50', '51-60', '60+']
+
+
+def patient_option_labels(patients_df):
+    """'<id> - <name> (<cnic>)' labels for the Patient Entry selectbox."""
+    labels = []
+    for _, r in patients_df.iterrows():
+        labels.append(f"{int(r['patient_id'])} - {r['patient_name']} ({r['cnic']})")
+    return labels
+
+
+def merge_patient_rows(patients_df, rows):
+    """Patient list (newest first) with `rows` added or replacing the same patient_id."""
+    new = pd.DataFrame(rows, columns=["patient_id", "patient_name", "cnic"])
+    if new.empty:
+        return patients_df
+    merged = pd.concat([new, patients_df[~patients_df["patient_id"].isin(new["patient_id"])]], ignore_index=True)
+    return merged.sort_values("patient_id", ascending=False, ignore_index=True)
+
+
+def split_list_column(series):
+    """Flatten a '; ' separated text column into a list of stripped items."""
+    s_series = series.dropna().astype(str)
+    return [s.strip() for sub in s_series.str.split(';') for s in sub if s.strip()]
+
+
+def records_analytics(df, flags=None):
+    """
+    Everything the Patient Records analytics dashboard shows, from the records
+    frame (and its vitals.flag_vitals frame, if the page already has one).
+    """
+    stats = {
+        "total_visits": len(df["visit_id"].dropna()),
+        "unique_patients": df["patient_id"].nunique(),
+    }
+    if stats["total_visits"] == 0:
+        return stats
+
+    stats["doc_counts"] = df["doctor_type"].value_counts()
+    stats["age_groups"] = pd.cut(df["age"].fillna(0), bins=AGE_BINS, labels=AGE_LABELS, right=False).value_counts().sort_index()
+    stats["gender_counts"] = df["gender"].fillna("Unknown").value_counts()
+
+    stats["top_sym"] = pd.Series(split_list_column(df['symptoms'])).value_counts().head(5)
+    stats["top_diag"] = pd.Series(split_list_column(df['indications'])).value_counts().head(5)
+
+    m_list = []
+    for m_str in df['medicines'].dropna().astype(str):
+        for m in m_str.split(';'):
+            m = m.strip()
+            if m:
+                gen = m.split('[')[0].strip() if '[' in m else m
+                m_list.append(gen)
+    stats["top_meds"] = pd.Series(m_list).value_counts().head(5)
+
+    if flags is None:
+        flags = vitals.flag_vitals(df)
+    stats["vital_flags"] = flags[df["visit_id"].notna()].sum().astype(int)
+    return stats
+
+
+def parse_medicine_line(med_text):
+    """'Generic [Brand] (1+0+1, 3 Days)' -> (generic, brand, prescribed_details)."""
+    brand_match = re.search(r"\[([^\]]+)\]", med_text)
+    brand = brand_match.group(1).strip() if brand_match else ""
+    generic = med_text.split("[")[0].strip()
+    prescribed_match = re.search(r"\(([^)]*)\)", med_text)
+    prescribed_details = prescribed_match.group(1) if prescribed_match else ""
+    return generic, brand, prescribed_details
+
+
+def stock_rows_for_generic(stock_df, generic_norm):
+    return stock_df[stock_df["generic"].str.lower() == generic_norm]
+
+
+def stock_row_for_brand(stock_df, generic_norm, brand):
+    return stock_df[
+        (stock_df["generic"].str.strip().str.lower() == generic_norm) &
+        (stock_df["brand"].str.strip().str.lower() == brand.lower())
+    ]
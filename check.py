@@ -2,6 +2,7 @@
 import streamlit as st
 import medical_camp  # Ensure medical_camp.py is in the same folder
 import registration  # Ensure registration.py is in the same folder
+import camp_metrics  # Prometheus-style /metrics endpoint for the camp server
 
 # --- Persistent session setup ---
 if "logged_in" not in st.session_state:
@@ -12,6 +13,7 @@ if "username" not in st.session_state:
     st.session_state["username"] = ""
 
 st.set_page_config(layout="centered", page_title="EMR Login")
+camp_metrics.start_metrics_server(9108)
 
 # --- Hardcoded users and roles ---
 USERS = {
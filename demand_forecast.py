@@ -0,0 +1,197 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# ---------- Demand Forecast & Reorder Report ----------
+# Burn rate per medicine (generic, across brands/batches) from the stock
+# ledger's dispense movements, plus visits.dispensed_details for visits
+# dispensed before the ledger existed. Daily totals are kept in a
+# per-process aggregate that only pulls new ledger rows on refresh, so the
+# report itself is a few vectorized pandas ops over (days x generics).
+#
+#   rate           = dispensed over the last `window` camp days / those days
+#   days_left      = unexpired stock / rate
+#   reorder        = days_left <= lead time + safety days
+#   reorder_qty    = enough to cover lead time + `cover` days at that rate
+#
+# Camp days = days with any dispensing, so the gap between two camps doesn't
+# dilute the rate.
+
+SETTLE_SECONDS = 60     # ledger rows younger than this are re-read next refresh
+DETAILS_RE = r"(?P<generic>[^;\[]+?)\s*\[(?P<brand>[^\]]*)\]\s*\(Qty:\s*(?P<qty>\d+)\)"
+
+
+def generic_of_key(keys):
+    """Stock keys are generic||brand||form||dose[||expiry] -> lowercase generic."""
+    return pd.Series(keys, dtype=object).astype(str).str.split("||", regex=False).str[0].str.strip().str.lower()
+
+
+def parse_dispensed_details(df):
+    """visits rows (visit_date, dispensed_details) -> [day, generic, qty], vectorized."""
+    if df.empty:
+        return pd.DataFrame(columns=["day", "generic", "qty"])
+    items = df["dispensed_details"].fillna("").str.extractall(DETAILS_RE)
+    if items.empty:
+        return pd.DataFrame(columns=["day", "generic", "qty"])
+    days = pd.to_datetime(df["visit_date"]).dt.normalize()
+    items["day"] = days.reindex(items.index.get_level_values(0)).values
+    items["generic"] = items["generic"].str.strip().str.lower()
+    items["qty"] = items["qty"].astype(int)
+    return items[["day", "generic", "qty"]].reset_index(drop=True)
+
+
+def _empty():
+    index = pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), pd.Index([], dtype=object)], names=["day", "generic"])
+    return pd.Series(dtype="int64", index=index)
+
+
+class DemandAggregates:
+    """Daily dispensed qty per generic, kept up to date from the ledger."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.settled = _empty()   # (day, generic) -> qty, never re-read
+        self.fresh = _empty()     # recent rows, replaced on every refresh
+        self.last_movement_id = 0
+        self.loaded_legacy = False
+
+    def _add(self, rows):
+        if rows.empty:
+            return _empty()
+        return rows.groupby(["day", "generic"])["qty"].sum()
+
+    def refresh(self, conn):
+        with self._lock:
+            if not self.loaded_legacy:
+                legacy = pd.read_sql(LEGACY_SQL, conn)
+                self.settled = self.settled.add(self._add(parse_dispensed_details(legacy)), fill_value=0)
+                self.loaded_legacy = True
+
+            moves = pd.read_sql(NEW_DISPENSES_SQL, conn, params=(self.last_movement_id,))
+            if moves.empty:
+                self.fresh = _empty()
+                return self
+            moves["day"] = pd.to_datetime(moves["moved_at"]).dt.normalize()
+            moves["generic"] = generic_of_key(moves["stock_key"]).values
+            # A dispensation still committing can hold a lower movement_id than
+            # rows we already see, so only rows older than SETTLE_SECONDS below
+            # the first young one are folded in for good.
+            young = moves["settled"] == 0
+            cut = moves.loc[young, "movement_id"].min() if young.any() else moves["movement_id"].max() + 1
+            done = moves["movement_id"] < cut
+            self.settled = self.settled.add(self._add(moves[done]), fill_value=0)
+            self.fresh = self._add(moves[~done])
+            if done.any():
+                self.last_movement_id = int(moves.loc[done, "movement_id"].max())
+            return self
+
+    def daily(self):
+        """DataFrame: one row per camp day, one column per generic."""
+        with self._lock:
+            totals = self.settled.add(self.fresh, fill_value=0)
+        if totals.empty:
+            return pd.DataFrame()
+        return totals.unstack("generic", fill_value=0).sort_index().astype("int64")
+
+
+LEGACY_SQL = """
+    SELECT v.visit_date, v.dispensed_details
+    FROM visits v
+    WHERE v.dispensed = 'Yes' AND v.dispensed_details IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM stock_movements m WHERE m.visit_id = v.visit_id AND m.kind = 'dispense')
+"""
+
+NEW_DISPENSES_SQL = f"""
+    SELECT movement_id, moved_at, stock_key, -qty AS qty,
+           CASE WHEN moved_at < NOW() - INTERVAL {SETTLE_SECONDS} SECOND THEN 1 ELSE 0 END AS settled
+    FROM stock_movements
+    WHERE movement_id > %s AND kind = 'dispense'
+    ORDER BY movement_id
+"""
+
+
+@st.cache_resource
+def get_demand_aggregates():
+    """One aggregate per server process, shared by every admin session."""
+    return DemandAggregates()
+
+
+def available_by_generic(stock_df, today=None):
+    """Unexpired stock per lowercase generic."""
+    today = pd.Timestamp(today or pd.Timestamp.today().normalize())
+    exp = pd.to_datetime(stock_df["expiry"], errors="coerce")
+    usable = exp.isna() | (exp >= today)
+    qty = pd.to_numeric(stock_df["stock_qty"], errors="coerce").fillna(0).clip(lower=0)
+    generic = stock_df["generic"].fillna("").astype(str).str.strip().str.lower()
+    return qty[usable].groupby(generic[usable]).sum().astype(int)
+
+
+def forecast(daily, stock_df, lead_time_days=2, window_days=3, cover_days=3, safety_days=1, today=None):
+    """Reorder report for every generic in stock or dispensed recently."""
+    available = available_by_generic(stock_df, today)
+    if daily.empty:
+        recent = pd.DataFrame(columns=available.index)
+    else:
+        active = daily[daily.sum(axis=1) > 0]
+        recent = active.tail(int(window_days))
+    n_days = max(len(recent), 1)
+
+    generics = available.index.union(recent.columns)
+    dispensed = recent.sum().reindex(generics, fill_value=0).astype(int)
+    avail = available.reindex(generics, fill_value=0).astype(int)
+    rate = dispensed / n_days
+
+    with np.errstate(divide="ignore"):
+        days_left = np.where(rate > 0, avail / rate.replace(0, np.nan), np.inf)
+    reorder = (rate > 0) & (days_left <= lead_time_days + safety_days)
+    target = rate * (lead_time_days + cover_days)
+    reorder_qty = np.ceil((target - avail).clip(lower=0)).where(reorder, 0).astype(int)
+
+    report = pd.DataFrame({
+        "generic": generics.str.title(),
+        "dispensed": dispensed.values,
+        "camp_days": n_days,
+        "daily_rate": rate.round(1).values,
+        "available": avail.values,
+        "days_left": np.round(days_left, 1),
+        "reorder": reorder.values,
+        "reorder_qty": reorder_qty.values,
+    })
+    report = report[(report["dispensed"] > 0) | (report["available"] > 0)]
+    return report.sort_values(["reorder", "days_left", "daily_rate"], ascending=[False, True, False]).reset_index(drop=True)
+
+
+def show_demand_forecast(conn, stock_df):
+    st.header("Demand Forecast & Reorder")
+    c1, c2, c3, c4 = st.columns(4)
+    lead = c1.number_input("Lead time (days)", min_value=0, max_value=30, value=2, key="fc_lead")
+    window = c2.number_input("Rate over last N camp days", min_value=1, max_value=30, value=3, key="fc_window")
+    cover = c3.number_input("Order to cover (days)", min_value=1, max_value=60, value=3, key="fc_cover")
+    safety = c4.number_input("Safety (days)", min_value=0, max_value=10, value=1, key="fc_safety")
+
+    agg = get_demand_aggregates().refresh(conn)
+    daily = agg.daily()
+    report = forecast(daily, stock_df, lead, window, cover, safety)
+
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Camp days on record", len(daily))
+    m2.metric("Items to reorder", int(report["reorder"].sum()))
+    runs_out = report["days_left"] < 1
+    m3.metric("Out within a day", int(runs_out.sum()))
+
+    st.subheader("Reorder List")
+    to_order = report[report["reorder"]]
+    if to_order.empty:
+        st.success("Nothing needs reordering at the current burn rate.")
+    else:
+        st.dataframe(to_order.drop(columns=["reorder"]), use_container_width=True, hide_index=True)
+        st.download_button("⬇️ Download Reorder List", to_order.to_csv(index=False), "reorder_list.csv", "text/csv")
+
+    with st.expander("All medicines"):
+        st.dataframe(report, use_container_width=True, hide_index=True)
+    if not daily.empty:
+        with st.expander("Daily dispensing (top 10 medicines)"):
+            top = daily.sum().nlargest(10).index
+            st.line_chart(daily[top])
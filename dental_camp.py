@@ -4,6 +4,12 @@ import mysql.connector
 import json
 import os
 from datetime import datetime
+import camp_queries as q
+import instrumentation as perf
+import camp_metrics as metrics
+import drug_safety as safety
+import patient_flow as flow
+import patient_timeline as timeline
 
 # --- SAFE IMPORTS FROM MAIN APP ---
 try:
@@ -12,6 +18,18 @@ except ImportError:
     st.error("❌ Critical Error: Could not import 'medical_camp.py'. Ensure both files are in the same folder.")
     st.stop()
 
+# --- STOCK BRAND NAMES (for the Rx safety check) ---
+@st.cache_data(ttl=600, show_spinner=False)
+def load_brand_names():
+    """(brand, generic) pairs, so a free-text 'Amoxil 500mg' resolves to amoxicillin."""
+    conn = get_connection()
+    try:
+        return safety.stock_brands(pd.read_sql("SELECT DISTINCT brand, generic FROM stock", conn))
+    except Exception:
+        return ()
+    finally:
+        conn.close()
+
 # --- IMAGE SETUP ---
 IMAGE_FOLDER = "dental_images"
 if not os.path.exists(IMAGE_FOLDER):
@@ -32,8 +50,10 @@ def save_image(uploaded_file, patient_id, tag):
 
     return filename
 
+@perf.timed_rerun("dental_camp")
 def run_dental_app():
     st.set_page_config(layout="wide", page_title="Dental Camp Module")
+    metrics.start_metrics_server(9109)
     st.title("🦷 Dental Camp Module")
 
     # --- TABS ---
@@ -42,15 +62,31 @@ def run_dental_app():
     # ==========================================
     # TAB 1: DENTAL ASSESSMENT
     # ==========================================
-    with tab1:
+    with tab1, perf.section("Dental Assessment"):
         st.subheader("New Dental Visit")
 
         conn = get_connection()
-        patients_df = pd.read_sql("SELECT * FROM patients ORDER BY patient_id DESC", conn)
+        patients_df = pd.read_sql(q.DENTAL_PATIENTS_SQL, conn)
+        waiting_df = flow.worklist(conn, "waiting_dental")
         conn.close()
 
         patient_list = [f"{row['patient_id']} - {row['patient_name']}" for index, row in patients_df.iterrows()]
-        selected_patient = st.selectbox("Select Patient", [""] + patient_list)
+
+        # Patients sent to dental (longest waiting first); Start moves them to "with dental"
+        with st.expander(f"🧾 Waiting for Dental ({len(waiting_df)})", expanded=not waiting_df.empty):
+            if waiting_df.empty:
+                st.caption("Nobody waiting.")
+            for w in waiting_df.head(10).itertuples(index=False):
+                w1, w2 = st.columns([4, 1])
+                w1.write(f"{w.patient_id} - {w.patient_name} · waiting {w.waiting_min} min")
+                if w2.button("Start", key=f"dental_start_{w.patient_id}"):
+                    conn = get_connection()
+                    flow.move(conn, int(w.patient_id), "with_dental", st.session_state.get("username"))
+                    conn.close()
+                    st.session_state["dental_patient"] = f"{w.patient_id} - {w.patient_name}"
+                    st.rerun()
+
+        selected_patient = st.selectbox("Select Patient", [""] + patient_list, key="dental_patient")
 
         if selected_patient:
             pid = int(selected_patient.split(" - ")[0])
@@ -61,6 +97,11 @@ def run_dental_app():
             c2.info(f"Age: {p_data['age']}")
             c3.info(f"Gender: {p_data['gender']}")
 
+            # Earlier medical / dental visits and dispensations (cached per patient)
+            conn = get_connection()
+            timeline.show_timeline(timeline.get_timeline_cache().get(conn, pid))
+            conn.close()
+
             # --- 1. History ---
             st.markdown("### 1. History & Complaints")
             col_a, col_b = st.columns(2)
@@ -159,9 +200,21 @@ def run_dental_app():
                 if m_name:
                     med_list.append(f"{m_name} ({m_instr})")
 
+            # Interaction / contraindication check against the Medical Alert findings
+            safety_index = safety.get_safety_index(load_brand_names())
+            rx_findings = safety_index.check(
+                safety_index.medicines_in(med_list),
+                safety_index.conditions_in(selected_meds + [pc, hpc, prov_diag], age=p_data['age'])
+            )
+            rx_ok = safety.show_findings(rx_findings, key=f"rx_override_{pid}")
+
             st.write("---")
 
             if st.button("💾 Save Dental Visit", type="primary", key=f"save_btn_{pid}"):
+                if not rx_ok:
+                    st.error("Review the prescription safety warnings above before saving.")
+                    st.stop()
+
                 # 1. Save Images
                 pre_filename = save_image(pre_img, pid, "PreOp")
                 post_filename = save_image(post_img, pid, "PostOp")
@@ -205,7 +258,10 @@ def run_dental_app():
 
                 try:
                     cur.execute(sql, vals)
+                    flow.advance(cur, pid, "done", st.session_state.get("username"))
                     conn.commit()
+                    timeline.get_timeline_cache().invalidate(pid)
+                    metrics.VISITS_SAVED.inc("dental")
                     st.success("✅ Dental Visit & Images Saved Successfully!")
                 except Exception as e:
                     st.error(f"Error saving: {e}")
@@ -215,7 +271,7 @@ def run_dental_app():
     # ==========================================
     # TAB 2: RECORDS
     # ==========================================
-    with tab2:
+    with tab2, perf.section("View Records"):
         st.header("Dental Records")
 
         col1, col2 = st.columns([1, 3])
@@ -225,23 +281,13 @@ def run_dental_app():
         conn = get_connection()
 
         # 1. Summary Table
-        summary_df = pd.read_sql("""
-            SELECT d.visit_id, p.patient_name, p.age, p.gender, d.visit_date, d.provisional_diagnosis
-            FROM dental_visits d
-            JOIN patients p ON d.patient_id = p.patient_id
-            ORDER BY d.visit_date DESC
-        """, conn)
+        summary_df = pd.read_sql(q.DENTAL_SUMMARY_SQL, conn)
 
         st.dataframe(summary_df, use_container_width=True)
 
         # 2. EXPORT BUTTON
         st.write("---")
-        full_df = pd.read_sql("""
-            SELECT *
-            FROM dental_visits d
-            JOIN patients p ON d.patient_id = p.patient_id
-            ORDER BY d.visit_date DESC
-        """, conn)
+        full_df = pd.read_sql(q.DENTAL_FULL_SQL, conn)
 
         csv = full_df.to_csv(index=False).encode('utf-8')
         col2.download_button(
@@ -0,0 +1,218 @@
+import os
+import re
+from itertools import combinations
+
+import pandas as pd
+import streamlit as st
+
+# ---------- Interaction & Contraindication Check ----------
+# Rules live in two local CSVs next to the app (no DB queries at check time):
+#
+#   drug_groups.csv        name,member   who belongs to what:
+#                            class:nsaid,ibuprofen          drug classes
+#                            paracetamol,panadol            brand / other names of a generic
+#                            condition:pregnancy,pregnant   words that mean a condition
+#   drug_interactions.csv  item_a,item_b,severity,message   a generic, class:* or condition:*
+#
+# Both are compiled once per process into
+#
+#   expand   name -> frozenset of items it stands for (generic + its classes, or a condition)
+#   pairs    frozenset({item, item}) -> [rule, ...]
+#
+# so a prescription of k medicines with c conditions costs k^2/2 + k*c
+# small set walks and dict lookups.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RULES_FILE = os.path.join(BASE_DIR, "drug_interactions.csv")
+GROUPS_FILE = os.path.join(BASE_DIR, "drug_groups.csv")
+
+SEVERITY_RANK = {"contraindicated": 0, "major": 1, "moderate": 2, "minor": 3}
+BLOCKING = {"contraindicated", "major"}   # Save needs an explicit override
+CHILD_AGE = 12
+
+
+def normalize(name):
+    """'  Mefenamic  Acid ' -> 'mefenamic acid'; keeps the class:/condition: prefix."""
+    return re.sub(r"\s+", " ", str(name or "").strip().lower())
+
+
+def _label(item):
+    return item.split(":", 1)[-1].title()
+
+
+class SafetyIndex:
+    def __init__(self, groups, rules, brands=()):
+        """
+        groups: [(name, member)], rules: [(item_a, item_b, severity, message)],
+        brands: [(brand, generic)] from stock, so free-text Rx can be resolved.
+        """
+        classes, aliases, conditions = {}, {}, {}
+        for name, member in groups:
+            name, member = normalize(name), normalize(member)
+            if not name or not member:
+                continue
+            if name.startswith("class:"):
+                classes.setdefault(member, set()).add(name)
+            elif name.startswith("condition:"):
+                conditions[member] = name
+            else:
+                aliases[member] = name
+        self.expand = {}
+        generics = set(classes) | set(aliases.values())
+        for g in generics:
+            self.expand[g] = frozenset({g} | classes.get(g, set()))
+        for alias, g in aliases.items():
+            self.expand.setdefault(alias, self.expand.get(g, frozenset({g})))
+        self.conditions = dict(conditions)
+        self.canonical = {**{g: g for g in generics}, **aliases}
+
+        self.pairs = {}
+        for a, b, severity, message in rules:
+            a, b = normalize(a), normalize(b)
+            for x in (a, b):
+                if not x.startswith(("class:", "condition:")) and x not in self.expand:
+                    self.expand[x] = frozenset({x})
+                    self.canonical[x] = x
+            rule = {"a": a, "b": b, "severity": normalize(severity), "message": str(message).strip()}
+            self.pairs.setdefault(frozenset((a, b)), []).append(rule)
+
+        # Stock names: "Diclofenac Sodium" -> diclofenac (longest known generic in it), brand -> same
+        known = sorted(self.canonical, key=len, reverse=True)
+        known_re = re.compile(r"\b(" + "|".join(map(re.escape, known)) + r")\b") if known else None
+        for brand, generic in brands:
+            brand, generic = normalize(brand), normalize(generic)
+            if not generic:
+                continue
+            if generic in self.canonical:
+                target = self.canonical[generic]
+            else:
+                m = known_re.search(generic) if known_re else None
+                target = self.canonical[m.group(1)] if m else generic
+            for name in (generic, brand):
+                if name and name not in self.canonical:
+                    self.canonical[name] = target
+                    self.expand[name] = self.expand.get(target, frozenset({target}))
+
+        # One alternation over every known name, longest first, for free text
+        names = sorted(set(self.expand) | set(self.conditions), key=len, reverse=True)
+        self._name_re = re.compile(r"\b(" + "|".join(map(re.escape, names)) + r")\b") if names else None
+
+    def __len__(self):
+        return sum(len(r) for r in self.pairs.values())
+
+    # ---------- Resolving names ----------
+    def find(self, text):
+        """Known names mentioned in free text, in order: 'Amoxil 500mg' -> ['amoxil']."""
+        if self._name_re is None:
+            return []
+        return self._name_re.findall(normalize(text))
+
+    def medicines_in(self, texts):
+        """Generics for free-text medicine lines (unknown names are dropped)."""
+        out = []
+        for text in texts:
+            for name in self.find(text):
+                if name in self.canonical and self.canonical[name] not in out:
+                    out.append(self.canonical[name])
+                    break
+        return out
+
+    def conditions_in(self, texts, age=None):
+        """condition:* items mentioned in diagnoses / alerts / history, plus age-based ones."""
+        found = set()
+        for text in texts:
+            for name in self.find(text):
+                if name in self.conditions:
+                    found.add(self.conditions[name])
+        try:
+            if age is not None and 0 < int(age) < CHILD_AGE:
+                found.add("condition:child")
+        except (TypeError, ValueError):
+            pass
+        return sorted(found)
+
+    # ---------- Check ----------
+    def check(self, generics, conditions=()):
+        """
+        [{"severity", "a", "b", "message"}] for a list of generics and
+        condition:* items, most severe first. One finding per rule and pair.
+        """
+        items = []
+        for g in generics:
+            g = normalize(g)
+            g = self.canonical.get(g, g)
+            if g and g not in [i for i, _ in items]:
+                items.append((g, self.expand.get(g, frozenset({g}))))
+
+        found, seen = [], set()
+
+        def hit(rules, left, right):
+            for rule in rules:
+                mark = (id(rule), left, right)
+                if mark not in seen:
+                    seen.add(mark)
+                    found.append({"severity": rule["severity"], "a": _label(left), "b": _label(right),
+                                  "message": rule["message"]})
+
+        for (g1, e1), (g2, e2) in combinations(items, 2):
+            for x in e1:
+                for y in e2:
+                    rules = self.pairs.get(frozenset((x, y)))
+                    if rules:
+                        hit(rules, g1, g2)
+        for g, e in items:
+            for c in conditions:
+                for x in e:
+                    rules = self.pairs.get(frozenset((x, c)))
+                    if rules:
+                        hit(rules, g, c)
+        found.sort(key=lambda f: SEVERITY_RANK.get(f["severity"], 9))
+        return found
+
+
+def blocking(findings):
+    return [f for f in findings if f["severity"] in BLOCKING]
+
+
+def read_rules(groups_path=GROUPS_FILE, rules_path=RULES_FILE):
+    groups = pd.read_csv(groups_path, dtype=str).fillna("") if os.path.exists(groups_path) else pd.DataFrame()
+    rules = pd.read_csv(rules_path, dtype=str).fillna("") if os.path.exists(rules_path) else pd.DataFrame()
+    return (
+        list(groups[["name", "member"]].itertuples(index=False, name=None)) if not groups.empty else [],
+        list(rules[["item_a", "item_b", "severity", "message"]].itertuples(index=False, name=None)) if not rules.empty else [],
+    )
+
+
+@st.cache_resource
+def get_safety_index(brands=()):
+    """Compiled once per process (and per set of stock brand names)."""
+    groups, rules = read_rules()
+    return SafetyIndex(groups, rules, brands)
+
+
+def stock_brands(stock_df):
+    """Hashable (brand, generic) pairs for get_safety_index."""
+    if stock_df is None or stock_df.empty or "brand" not in stock_df:
+        return ()
+    pairs = stock_df[["brand", "generic"]].dropna().astype(str).drop_duplicates()
+    return tuple(sorted(pairs.itertuples(index=False, name=None)))
+
+
+# ---------- UI ----------
+ICONS = {"contraindicated": "⛔", "major": "🔴", "moderate": "🟠", "minor": "🟡"}
+
+
+def show_findings(findings, key):
+    """
+    Warnings above the Save button. Returns True when Save may go ahead:
+    nothing blocking, or the doctor ticked the override.
+    """
+    if not findings:
+        return True
+    lines = [f"{ICONS.get(f['severity'], '•')} **{f['severity'].title()}** — {f['a']} + {f['b']}: {f['message']}"
+             for f in findings]
+    if blocking(findings):
+        st.error("Prescription safety check:\n\n" + "\n\n".join(lines))
+        return st.checkbox("I have reviewed these warnings and want to save anyway", key=key)
+    st.warning("Prescription safety check:\n\n" + "\n\n".join(lines))
+    return True
@@ -0,0 +1,332 @@
+import functools
+import glob
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import pandas as pd
+import streamlit as st
+
+import camp_metrics as metrics
+
+# ---------- Timing Instrumentation ----------
+# Records how long reruns, page sections, connects, queries and commits take,
+# tagged with app / role / user / session / page, as JSON lines in a rolling
+# log (logs/camp_timings.jsonl, 4 x 5 MB). Every Streamlit process (check.py
+# on 8501, dental_camp.py on 8502) appends to the same files, so the admin
+# Performance page sees the whole camp.
+#
+# Only the SQL text is logged, never the parameters (no patient data).
+#
+#   get_connection()       -> perf.connect(mysql.connector.connect, **db_config)
+#   run_app()              -> @perf.timed_rerun("medical_camp")
+#   if page == "X": ...    -> with perf.section("X"): ...
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.path.join(BASE_DIR, "logs")
+LOG_FILE = os.path.join(LOG_DIR, "camp_timings.jsonl")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+SQL_TEXT_LIMIT = 300
+
+_ctx = threading.local()   # each rerun runs in its own script thread
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                os.makedirs(LOG_DIR, exist_ok=True)
+                logger = logging.getLogger("camp.timings")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                _logger = logger
+    return _logger
+
+
+def _current():
+    """Tags of the rerun running on this thread (empty outside a rerun)."""
+    return getattr(_ctx, "tags", None)
+
+
+def record(kind, ms, **fields):
+    """Append one timing record, tagged with the current rerun's context."""
+    rec = {"ts": datetime.now().isoformat(timespec="milliseconds"), "kind": kind, "ms": round(ms, 2)}
+    tags = _current()
+    if tags is not None:
+        rec.update(tags)
+        if kind in ("query", "commit", "connect"):
+            tags["_queries"] += kind == "query"
+            tags["_db_ms"] += ms
+    rec.update(fields)
+    if kind == "query":
+        metrics.QUERY_LATENCY.observe(ms / 1000, rec.get("app") or "startup")
+    try:
+        _get_logger().info(json.dumps({k: v for k, v in rec.items() if not k.startswith("_")}, default=str))
+    except Exception:
+        pass  # timing must never break a page
+
+
+def normalize_sql(sql):
+    sql = re.sub(r"\s+", " ", str(sql)).strip()
+    return sql[:SQL_TEXT_LIMIT]
+
+
+# ---------- Rerun / page context ----------
+def _session_tag():
+    try:
+        if "_perf_session" not in st.session_state:
+            st.session_state["_perf_session"] = uuid.uuid4().hex[:8]
+        return st.session_state["_perf_session"]
+    except Exception:
+        return None
+
+
+def timed_rerun(app, page=None):
+    """
+    Decorator for a page entry point (run_app, run_registration, ...): one
+    'rerun' record per call. Also goes under @st.fragment, so fragment
+    reruns are timed; inside a full rerun it just passes through.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current() is not None:   # already inside a timed rerun
+                return fn(*args, **kwargs)
+            _ctx.tags = {
+                "app": app,
+                "role": st.session_state.get("role") or app,
+                "user": st.session_state.get("username") or "",
+                "session": _session_tag(),
+                "page": page or app,
+                "_queries": 0,
+                "_db_ms": 0.0,
+            }
+            metrics.touch_session(_ctx.tags["session"], _ctx.tags["role"])
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                tags = _ctx.tags
+                exc = sys.exc_info()[0]
+                record("rerun", (time.perf_counter() - t0) * 1000,
+                       queries=tags["_queries"], db_ms=round(tags["_db_ms"], 2),
+                       end=exc.__name__ if exc else "ok")
+                _ctx.tags = None
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def section(page):
+    """Time a page section; queries from here on are attributed to `page`."""
+    tags = _current()
+    if tags is not None:
+        tags["page"] = page
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record("section", (time.perf_counter() - t0) * 1000, **({} if tags else {"page": page}))
+
+
+# ---------- Connection / cursor wrappers ----------
+class TimedCursor:
+    """Cursor proxy: one 'query' record per statement (execute + fetch time, rows)."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None
+
+    def _flush(self):
+        p, self._pending = self._pending, None
+        if p is not None:
+            rows = p["rows"] if p["rows"] is not None else getattr(self._cursor, "rowcount", -1)
+            record("query", p["ms"], sql=p["sql"], rows=rows)
+
+    def _timed(self, method, sql, *args, **kwargs):
+        self._flush()
+        t0 = time.perf_counter()
+        try:
+            return method(sql, *args, **kwargs)
+        finally:
+            self._pending = {"sql": normalize_sql(sql), "ms": (time.perf_counter() - t0) * 1000, "rows": None}
+
+    def execute(self, sql, *args, **kwargs):
+        return self._timed(self._cursor.execute, sql, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        return self._timed(self._cursor.executemany, sql, *args, **kwargs)
+
+    def _fetch(self, method, *args):
+        t0 = time.perf_counter()
+        result = method(*args)
+        if self._pending is not None:
+            self._pending["ms"] += (time.perf_counter() - t0) * 1000
+            n = len(result) if isinstance(result, list) else int(result is not None)
+            self._pending["rows"] = (self._pending["rows"] or 0) + n
+        return result
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def close(self):
+        self._flush()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Connection proxy handing out TimedCursors and timing commits."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursors = []
+        self._closed = False
+
+    def cursor(self, *args, **kwargs):
+        cur = TimedCursor(self._conn.cursor(*args, **kwargs))
+        self._cursors.append(cur)
+        return cur
+
+    def commit(self):
+        for cur in self._cursors:
+            cur._flush()
+        t0 = time.perf_counter()
+        try:
+            return self._conn.commit()
+        finally:
+            record("commit", (time.perf_counter() - t0) * 1000)
+
+    def close(self):
+        """Idempotent: only the first close counts towards camp_db_connections_open."""
+        if self._closed:
+            return None
+        self._closed = True
+        for cur in self._cursors:
+            cur._flush()
+        self._cursors = []
+        metrics.connection_closed()
+        return self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def connect(factory, **kwargs):
+    """Open a connection via factory(**kwargs), timing the wait, and wrap it."""
+    t0 = time.perf_counter()
+    conn = factory(**kwargs)
+    elapsed = time.perf_counter() - t0
+    record("connect", elapsed * 1000)
+    metrics.connection_opened(elapsed)
+    return TimedConnection(conn)
+
+
+# ---------- Admin dashboard ----------
+def load_timings(max_files=LOG_BACKUPS + 1):
+    """All records from the rolling log (newest file last)."""
+    files = sorted(glob.glob(LOG_FILE + ".*"), reverse=True)[-max_files:] + [LOG_FILE]
+    frames = []
+    for path in files:
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            frames.append(pd.read_json(path, lines=True))
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    df["ts"] = pd.to_datetime(df["ts"])
+    return df
+
+
+def _latency_table(df, by):
+    g = df.groupby(by)["ms"]
+    out = pd.DataFrame({
+        "count": g.size(),
+        "p50_ms": g.median(),
+        "p95_ms": g.quantile(0.95),
+        "max_ms": g.max(),
+        "total_s": g.sum() / 1000,
+    }).round(1)
+    return out.sort_values("p95_ms", ascending=False)
+
+
+def show_performance_dashboard():
+    st.header("Performance")
+    col1, col2 = st.columns([1, 3])
+    if col1.button("🔄 Refresh Timings"):
+        st.rerun()
+    window = col2.selectbox("Window", ["Last 15 minutes", "Last hour", "Today", "Everything logged"], index=1)
+
+    df = load_timings()
+    if df.empty:
+        st.info("No timings logged yet.")
+        return
+    now = pd.Timestamp.now()
+    since = {"Last 15 minutes": now - pd.Timedelta(minutes=15), "Last hour": now - pd.Timedelta(hours=1),
+             "Today": now.normalize()}.get(window)
+    if since is not None:
+        df = df[df["ts"] >= since]
+    if df.empty:
+        st.info("No timings in this window.")
+        return
+
+    reruns = df[df["kind"] == "rerun"]
+    queries = df[df["kind"] == "query"]
+    connects = df[df["kind"] == "connect"]
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Reruns", len(reruns))
+    m2.metric("Rerun p95", f"{reruns['ms'].quantile(0.95):.0f} ms" if not reruns.empty else "-")
+    m3.metric("Queries", len(queries))
+    m4.metric("Connect p95", f"{connects['ms'].quantile(0.95):.0f} ms" if not connects.empty else "-")
+
+    st.subheader("Slowest Pages")
+    if not reruns.empty:
+        st.dataframe(_latency_table(reruns, ["app", "page"]), use_container_width=True)
+
+    st.subheader("Slowest Queries")
+    if not queries.empty:
+        qt = _latency_table(queries, ["sql"])
+        qt["avg_rows"] = queries.groupby("sql")["rows"].mean().round(0)
+        st.dataframe(qt.head(25), use_container_width=True)
+        st.caption("Slowest single executions")
+        st.dataframe(
+            queries.nlargest(10, "ms")[["ts", "ms", "rows", "role", "page", "sql"]],
+            use_container_width=True, hide_index=True
+        )
+
+    st.subheader("Per-Session Breakdown")
+    if not reruns.empty:
+        sessions = reruns.groupby(["session", "role", "user"], dropna=False).agg(
+            reruns=("ms", "size"), rerun_p95_ms=("ms", lambda s: s.quantile(0.95)),
+            total_s=("ms", lambda s: s.sum() / 1000), queries=("queries", "sum"), db_s=("db_ms", lambda s: s.sum() / 1000),
+        ).round(2)
+        sessions["last_seen"] = reruns.groupby(["session", "role", "user"], dropna=False)["ts"].max()
+        if not connects.empty and "session" in connects:
+            sessions["connect_wait_s"] = (connects.groupby("session")["ms"].sum() / 1000).round(2)
+        st.dataframe(sessions.sort_values("total_s", ascending=False), use_container_width=True)
@@ -3,18 +3,39 @@ import streamlit as st
 import mysql.connector
 import os
 import re
+from patient_matcher import get_duplicate_index, sync_duplicate_index
+from symptom_cooccurrence import get_cooccurrence_index, sync_cooccurrence_index
+from prescription_templates import get_prescription_patterns, sync_prescription_patterns, build_template, item_id
+import camp_queries as q
+import instrumentation as perf
+import camp_metrics as metrics
+from medicine_index import MedicineIndex
+from medicine_substitutes import SubstitutionIndex
+import stock_batches as batches
+import stock_ledger as ledger
+import stock_holds as holds
+import drug_safety as safety
+import visit_search as search
+import vitals
+import triage_queue as triage
+import patient_flow as flow
+import visit_service
+import prescriptions as rx
+import patient_timeline as timeline
+from demand_forecast import show_demand_forecast
 
 # --------- Config & Database Setup ----------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 EXCEL_FILE = "New_drug_list.csv"
 
 # DATABASE CREDENTIALS - Update if needed
+# (EMR_DB_* environment variables override these, e.g. for the load test DB)
 db_config = {
-    "host": "127.0.0.1",
-    "user": "root",
-    "port": 3306,
-    "password": "umerEMR123@",  # Your Password
-    "database": "emr_system",   # Ensure this matches your DB name
+    "host": os.environ.get("EMR_DB_HOST", "127.0.0.1"),
+    "user": os.environ.get("EMR_DB_USER", "root"),
+    "port": int(os.environ.get("EMR_DB_PORT", 3306)),
+    "password": os.environ.get("EMR_DB_PASSWORD", "umerEMR123@"),  # Your Password
+    "database": os.environ.get("EMR_DB_NAME", "emr_system"),   # Ensure this matches your DB name
     "connection_timeout": 10,
 }
 
@@ -31,7 +52,7 @@ if "username" not in st.session_state:
 def get_connection():
     try:
         # Just create a fresh connection. It's fast and reliable.
-        return mysql.connector.connect(**db_config)
+        return perf.connect(mysql.connector.connect, **db_config)
     except Exception as e:
         st.error(f"MySQL connection failed: {e}")
         st.stop()
@@ -40,6 +61,7 @@ def get_connection():
 
 @st.cache_data(ttl=None)
 def load_icd_diagnosis_from_db():
+    metrics.cache_miss("icd_diagnosis")
     conn = get_connection()
     try:
         # Try lowercase first (standard)
@@ -83,6 +105,7 @@ def load_icd_diagnosis_from_db():
 
 @st.cache_data(ttl=None)
 def load_icd_symptoms_from_db():
+    metrics.cache_miss("icd_symptoms")
     conn = get_connection()
     try:
         # Try exact name from your SQL file first, then fallback
@@ -122,7 +145,7 @@ def load_stock(force_reload=False):
     conn = get_connection()
     # Just read what is in the database
     try:
-        df = pd.read_sql("SELECT * FROM stock", conn)
+        df = pd.read_sql(q.STOCK_SQL, conn)
         conn.close()
 
         # If the DB is actually empty, warn the user but don't crash
@@ -135,6 +158,33 @@ def load_stock(force_reload=False):
         conn.close()
         return pd.DataFrame()
 
+def ensure_column(cur, table, column, ddl):
+    """Add a column to a table created by an older version of the app. True if it was added."""
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    if cur.fetchone()[0] == 0:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        return True
+    return False
+
+def ensure_index(cur, table, name, columns, kind=""):
+    """CREATE [kind] INDEX unless an index with this name exists (MySQL has no IF NOT EXISTS for indexes)."""
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, name))
+    if cur.fetchone()[0] == 0:
+        cur.execute(f"CREATE {kind + ' ' if kind else ''}INDEX {name} ON {table} ({columns})")
+
+def table_exists(cur, table):
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return cur.fetchone()[0] > 0
+
 def init_db():
     conn = get_connection()
     c = conn.cursor()
@@ -151,7 +201,6 @@ def init_db():
         age INT
     )
     """)
-
     c.execute("""
     CREATE TABLE IF NOT EXISTS visits (
         visit_id INT AUTO_INCREMENT PRIMARY KEY,
@@ -160,6 +209,8 @@ def init_db():
         visit_date DATETIME,
         history TEXT,
         bp VARCHAR(20),
+        bp_sys INT,
+        bp_dia INT,
         heart_rate INT,
         sat_o2 FLOAT,
         temp FLOAT,
@@ -170,11 +221,24 @@ def init_db():
         symptoms TEXT,
         indications TEXT,
         medicines TEXT,
+        medicine_keys TEXT,
         dispensed VARCHAR(10),
         dispensed_details TEXT,
         FOREIGN KEY (patient_id) REFERENCES patients(patient_id)
     )
     """)
+    # stock keys of the prescribed medicines, "; " separated in the same order as `medicines`
+    ensure_column(c, "visits", "medicine_keys", "TEXT AFTER medicines")
+    # numeric BP (bp keeps the "sys/dia" text); older rows are parsed once when the columns appear
+    added_sys = ensure_column(c, "visits", "bp_sys", "INT AFTER bp")
+    added_dia = ensure_column(c, "visits", "bp_dia", "INT AFTER bp_sys")
+    ensure_column(c, "visits", "rr", "INT AFTER temp")
+    if added_sys or added_dia:
+        c.execute(vitals.BACKFILL_BP_SQL)
+
+    # Save Visit finds new registrations by CNIC (locks just that CNIC's index range)
+    for table, name, columns in visit_service.PATIENT_INDEXES:
+        ensure_index(c, table, name, columns)
 
     c.execute("""
     CREATE TABLE IF NOT EXISTS stock (
@@ -188,6 +252,47 @@ def init_db():
         stock_qty INT
     )
     """)
+    for name, columns in batches.STOCK_INDEXES:
+        ensure_index(c, "stock", name, columns)
+
+    # prescription holds (free stock = stock_qty - reserved_qty)
+    ensure_column(c, "stock", "reserved_qty", "INT NOT NULL DEFAULT 0")
+    c.execute(holds.HOLDS_TABLE)
+    for table, name, columns in holds.HOLD_INDEXES:
+        ensure_index(c, table, name, columns)
+
+    # stock movement ledger + snapshots (opening snapshot = stock as it is now)
+    for ddl in ledger.LEDGER_TABLES:
+        c.execute(ddl)
+    for table, name, columns in ledger.LEDGER_INDEXES:
+        ensure_index(c, table, name, columns)
+    ledger.ensure_opening_snapshot(c)
+
+    # structured prescription lines; visits saved before the table existed are converted once
+    if not table_exists(c, "visit_prescriptions"):
+        c.execute(rx.PRESCRIPTIONS_TABLE)
+        rx.convert_visits(c)
+
+    # triage queue (vitals entered at registration, doctors take the highest priority first)
+    c.execute(triage.TRIAGE_TABLE)
+    for table, name, columns in triage.TRIAGE_INDEXES:
+        ensure_index(c, table, name, columns)
+
+    # patient flow: state per patient per camp day + timestamped moves
+    for ddl in flow.FLOW_TABLES:
+        c.execute(ddl)
+    for table, name, columns in flow.FLOW_INDEXES:
+        ensure_index(c, table, name, columns)
+
+    # per-patient timeline reads (dental_visits belongs to the dental app)
+    for table, name, columns in timeline.TIMELINE_INDEXES:
+        if table_exists(c, table):
+            ensure_index(c, table, name, columns)
+
+    # full-text search over history / complaints (dental_visits belongs to the dental app)
+    for table, name, columns in search.FULLTEXT_INDEXES:
+        if table_exists(c, table):
+            ensure_index(c, table, name, columns, kind="FULLTEXT")
 
     conn.commit()
     conn.close()
@@ -196,10 +301,12 @@ def init_db():
 init_db()
 
 
-def save_stock(df):
+def save_stock(df, note=None, moved_holds=None):
     """
     Safely updates stock details without deleting the table.
     Uses 'ON DUPLICATE KEY UPDATE' to handle changes.
+    Quantity changes are booked in the stock ledger in the same transaction,
+    as are hold moves off superseded batches ([(old_key, new_key)]).
     """
     conn = get_connection()
     cur = conn.cursor()
@@ -223,14 +330,18 @@ def save_stock(df):
     data = df[["key", "generic", "brand", "dosage_form", "dose", "expiry", "unit", "stock_qty"]].values.tolist()
 
     try:
+        movements = ledger.upsert_movements(cur, df, st.session_state.get("username"), note)
         cur.executemany(sql, data)
+        ledger.record_movements(cur, movements)
+        holds.move_holds(cur, moved_holds or [])
         conn.commit()
     except Exception as e:
+        conn.rollback()
         st.error(f"❌ Error saving stock: {e}")
     finally:
         conn.close()
 
-def deduct_stock_atomic(key, qty):
+def deduct_stock_atomic(key, qty, visit_id=None):
     """
     Directly subtracts quantity from the database.
     Prevents race conditions (where two users overwrite each other).
@@ -240,6 +351,7 @@ def deduct_stock_atomic(key, qty):
     try:
         # This performs the math INSIDE the database
         cur.execute("UPDATE stock SET stock_qty = stock_qty - %s WHERE `key`=%s", (qty, key))
+        ledger.record_movements(cur, [(key, "dispense", -int(qty), visit_id, st.session_state.get("username"), None)])
         conn.commit()
     except Exception as e:
         st.error(f"❌ Error deducting stock: {e}")
@@ -247,17 +359,34 @@ def deduct_stock_atomic(key, qty):
         conn.close()
 
 def load_stock_df():
+    metrics.cache_miss("stock")
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM stock", conn)
+    df = pd.read_sql(q.STOCK_SQL, conn)
     conn.close()
     return df
 
 def refresh_stock():
     conn = get_connection()
-    latest_stock = pd.read_sql("SELECT * FROM stock", conn)
+    latest_stock = pd.read_sql(q.STOCK_SQL, conn)
     conn.close()
     st.session_state["stock_df"] = latest_stock.copy()
 
+# Reference data accessors: each call is one lookup, misses are counted in the loaders
+def icd_diagnosis():
+    metrics.cache_lookup("icd_diagnosis")
+    return load_icd_diagnosis_from_db()
+
+def icd_symptoms():
+    metrics.cache_lookup("icd_symptoms")
+    return load_icd_symptoms_from_db()
+
+def get_stock_df():
+    """Session stock frame (loaded from MySQL on first use)."""
+    metrics.cache_lookup("stock")
+    if "stock_df" not in st.session_state:
+        st.session_state["stock_df"] = load_stock_df()
+    return st.session_state["stock_df"]
+
 # --------- Input Validation Helpers ----------
 def validate_patient_inputs(name, cnic, nationality, phone, gender, age):
     if not name or not re.match(r"^[A-Za-z\s]+$", name):
@@ -276,7 +405,553 @@ def validate_patient_inputs(name, cnic, nationality, phone, gender, age):
         return False, "Age must be a valid integer."
     return True, ""
 
+# ---------- Fragments (rerun on their own, not the whole page) ----------
+ICD_PICKERS = {
+    "symptoms": {
+        "title": "Symptoms", "search_label": "🔍 Search Symptoms (Type 3+ letters)",
+        "search_key": "sym_search_box", "picker_key": "sym_picker",
+        "state_key": "selected_symptoms", "remove_prefix": "del_sym_",
+    },
+    "diagnosis": {
+        "title": "Diagnosis (ICD-10)", "search_label": "🔍 Search Diagnosis (Type 3+ letters)",
+        "search_key": "diag_search_box", "picker_key": "diag_picker",
+        "state_key": "selected_diagnosis", "remove_prefix": "del_diag_",
+    },
+}
+
+
+@st.cache_data(max_entries=2000, show_spinner=False)
+def search_icd(kind, text, limit=20):
+    """First `limit` ICD symptoms/diagnoses containing `text` (cached per search string)."""
+    if kind == "symptoms":
+        df, col = icd_symptoms(), "Symptom"
+    else:
+        df, col = icd_diagnosis(), "Diagnosis"
+    if df is None or df.empty:
+        return []
+    mask = df[col].str.contains(text, case=False, na=False, regex=False)
+    return df.loc[mask, col].head(limit).tolist()
+
+
+@st.fragment
+@perf.timed_rerun("medical_camp", page="ICD Picker")
+def icd_picker(kind):
+    """Search box + picker + selected list for symptoms or diagnoses (kept in session state)."""
+    cfg = ICD_PICKERS[kind]
+    st.subheader(cfg["title"])
+
+    selected = st.session_state.setdefault(cfg["state_key"], [])
+
+    search = st.text_input(cfg["search_label"], key=cfg["search_key"])
+    options = search_icd(kind, search.strip()) if len(search.strip()) >= 3 else []
+
+    # Diagnoses: most likely for the picked symptoms first (from past visits)
+    cooc = get_cooccurrence_index()
+    symptoms = st.session_state.get("selected_symptoms", [])
+    if kind == "diagnosis" and symptoms:
+        if options:
+            options = cooc.rank(search_icd(kind, search.strip(), 200), symptoms)[:20]
+        else:
+            options = [d for d, _, _ in cooc.suggest(symptoms, k=10, exclude=selected)]
+
+    new_item = st.selectbox("Select Result", [""] + options, key=cfg["picker_key"])
+    if new_item and new_item not in selected:
+        selected.append(new_item)
+
+    if selected:
+        st.write("**Selected:**")
+        for item in selected:
+            col_a, col_b = st.columns([8, 1])
+            col_a.text(item)
+            if col_b.button("❌", key=f"{cfg['remove_prefix']}{item}"):
+                selected.remove(item)
+                st.rerun(scope="fragment")
+
+    if kind == "diagnosis":
+        for d in selected:
+            template = get_prescription_template(d)
+            if not template["items"]:
+                continue
+            stock_df = get_stock_df()
+            med_index = get_medicine_index(stock_df)
+            summary = ", ".join(f"{med_index.row(t['key'])['generic']} ({t['frequency']}, {t['amount']})"
+                                for t in template["items"])
+            missing = f" · not in stock: {', '.join(template['missing'])}" if template["missing"] else ""
+            if st.button(f"📋 Usual for {d}: {summary}", key=f"rx_tpl_{d}", help=f"From past visits{missing}",
+                         on_click=_apply_template, args=(template,)):
+                st.rerun()   # full rerun so the prescription section shows it
+
+    if kind == "symptoms" and selected:
+        chosen = st.session_state.setdefault("selected_diagnosis", [])
+        likely = cooc.suggest(selected, exclude=chosen)
+        if likely:
+            st.write("**Likely diagnoses** (past visits with these symptoms):")
+            for d, score, support in likely:
+                if st.button(f"➕ {d} · {score:.0%}", key=f"sugg_diag_{d}", help=f"Seen together {support} times"):
+                    chosen.append(d)
+                    st.rerun()   # full rerun so the diagnosis picker shows it
+
+
+def get_medicine_index(stock_df):
+    """Medicine search index, built once per loaded stock frame."""
+    cached = st.session_state.get("_medicine_index")
+    if cached is None or cached[0] is not stock_df:
+        cached = st.session_state["_medicine_index"] = (stock_df, MedicineIndex(stock_df))
+    return cached[1]
+
+
+def get_substitution_index(stock_df):
+    """In-stock alternatives, built once per loaded stock frame like the search index."""
+    cached = st.session_state.get("_substitution_index")
+    if cached is None or cached[0] is not stock_df:
+        cached = st.session_state["_substitution_index"] = (stock_df, SubstitutionIndex(stock_df))
+    return cached[1]
+
+
+def _use_substitute(slot, key):
+    st.session_state[f"med_{slot}"] = key
+
+
+def get_prescription_template(diagnosis):
+    """Template for a diagnosis against the loaded stock (cached until stock or patterns change)."""
+    stock_df = get_stock_df()
+    patterns = get_prescription_patterns()
+    cached = st.session_state.get("_rx_templates")
+    if cached is None or cached[0] is not stock_df or cached[1] != patterns.version:
+        cached = st.session_state["_rx_templates"] = (stock_df, patterns.version, {})
+    if diagnosis not in cached[2]:
+        cached[2][diagnosis] = build_template(patterns, get_substitution_index(stock_df), diagnosis)
+    return cached[2][diagnosis]
+
+
+def _apply_template(template):
+    """Fill the prescription rows from a template (runs before the rerun, as a button callback)."""
+    items = template["items"]
+    st.session_state["num_meds"] = max(1, len(items))
+    for i, t in enumerate(items):
+        st.session_state[f"med_search_{i}"] = ""
+        st.session_state[f"med_{i}"] = t["key"]
+        st.session_state[f"freq_{i}"] = t["frequency"] or "1+0+1"
+        if t.get("time"):
+            st.session_state[f"time_{i}"] = t["time"]
+        st.session_state[f"amount_{i}"] = t["amount"] or "3 Days"
+
+
+# Vitals widgets in Patient Entry: triage field -> (session key, form default)
+VITAL_WIDGETS = {
+    "bp_sys": ("v_bp_sys", 0), "bp_dia": ("v_bp_dia", 0), "heart_rate": ("v_heart_rate", 0),
+    "temp": ("v_temp", 36.0), "sat_o2": ("v_sat_o2", 98), "rr": ("v_rr", 0), "blood_glucose": ("v_glucose", 0),
+}
+
+
+def _fill_vitals(row):
+    """Put vitals (a triage row or the last visit) into the Vitals inputs, before they are drawn."""
+    for field, (key, default) in VITAL_WIDGETS.items():
+        value = row.get(field)
+        if value is not None and not pd.isna(value):
+            st.session_state[key] = type(default)(value)
+
+
+def _prefill_for(label):
+    """
+    Start the form for a newly selected patient: cleared, then the last
+    visit's vitals, diagnoses and medicines (from the timeline cache).
+    Runs before the form widgets of this rerun exist.
+    """
+    st.session_state["entry_prefilled_for"] = label
+    last = None
+    if label and label != "+ Register New Patient":
+        conn = get_connection()
+        last = timeline.get_timeline_cache().get(conn, int(label.split(" - ")[0])).last_visit()
+        conn.close()
+
+    for key, default in VITAL_WIDGETS.values():
+        st.session_state[key] = default
+    st.session_state.selected_symptoms = []
+    st.session_state.selected_diagnosis = []
+    for i in range(10):
+        for prefix in ["med_search_", "med_", "freq_", "time_", "amount_"]:
+            st.session_state.pop(f"{prefix}{i}", None)
+    st.session_state["num_meds"] = 1
+    st.session_state.pop("entry_prefill_note", None)
+    if last is None:
+        return
+
+    _fill_vitals(last["vitals"])
+    st.session_state.selected_diagnosis = list(last["diagnoses"])
+    med_index = get_medicine_index(get_stock_df())
+    items = [m for m in last["medicines"] if m["key"] in med_index.pos]
+    if items:
+        _apply_template({"items": items})
+    dropped = len(last["medicines"]) - len(items)
+    when = pd.to_datetime(last["visit_date"]).strftime("%d-%b-%Y")
+    st.session_state["entry_prefill_note"] = f"Prefilled from the last visit on {when}; check before saving." + (
+        f" {dropped} medicine(s) from that visit are no longer in stock." if dropped else "")
+
+
+def _open_triage_entry(row, labels):
+    label = labels.get(int(row["patient_id"]))
+    if label is None:
+        # registered after this page last loaded the patient list
+        conn = get_connection()
+        one = pd.read_sql(q.PATIENT_BY_ID_SQL, conn, params=(int(row["patient_id"]),))
+        conn.close()
+        label = q.patient_option_labels(one)[0] if not one.empty else None
+    if label:
+        st.session_state["entry_patient"] = label
+        _prefill_for(label)
+        _fill_vitals(row)   # today's triage vitals over the last visit's
+
+
+def _take_next_patient(username, labels):
+    conn = get_connection()
+    row = triage.get_triage_queue().claim_next(conn, username)
+    if row is not None:
+        flow.move(conn, int(row["patient_id"]), "with_doctor", username)
+    conn.close()
+    if row is None:
+        st.session_state["triage_note"] = "Nobody is waiting in the triage queue."
+    else:
+        _open_triage_entry(row, labels)
+
+
+def _return_to_queue(row, username):
+    conn = get_connection()
+    triage.release(conn, row["entry_id"])
+    flow.move(conn, int(row["patient_id"]), "waiting_doctor", username)
+    conn.close()
+
+
+def patient_list(conn, refresh=False):
+    """
+    Patient Entry's patient list, kept in the session: read in full once (or
+    on Refresh), then only patients registered since by any desk are added.
+    """
+    cached = st.session_state.get("patient_list")
+    if refresh or cached is None:
+        cached = pd.read_sql(q.PATIENT_LIST_SQL, conn)
+    else:
+        # rows merged in after a save don't count: others may have registered below them
+        since = st.session_state.get("patient_list_synced", 0)
+        cached = q.merge_patient_rows(cached, pd.read_sql(q.PATIENTS_SINCE_SQL, conn, params=(since,)))
+    if not cached.empty:
+        st.session_state["patient_list_synced"] = int(cached["patient_id"].max())
+    st.session_state["patient_list"] = cached
+    return cached
+
+def triage_panel(queue, username, patients_df):
+    """Waiting patients by priority, and the doctor's "Take Next" button."""
+    names = dict(zip(patients_df["patient_id"], patients_df["patient_name"]))
+    labels = dict(zip(patients_df["patient_id"], q.patient_option_labels(patients_df)))
+    waiting = queue.waiting(10)
+    with st.expander(f"🚑 Triage Queue ({len(queue)} waiting)", expanded=bool(waiting)):
+        if waiting:
+            st.dataframe(triage.waiting_frame(waiting, queue.last_sync, names), use_container_width=True, hide_index=True)
+        st.button("▶ Take Next Patient", type="primary", disabled=not waiting, key="triage_take_next",
+                  on_click=_take_next_patient, args=(username, labels))
+        note = st.session_state.pop("triage_note", None)
+        if note:
+            st.info(note)
+        for row in queue.claimed_by(username):
+            c1, c2, c3 = st.columns([3, 1, 1])
+            c1.caption(f"With you: {names.get(row['patient_id'], row['patient_id'])} · priority {row['priority']} · {row['reasons'] or 'no red flags'}")
+            c2.button("Open", key=f"triage_open_{row['entry_id']}", on_click=_open_triage_entry, args=(row, labels))
+            c3.button("Return", key=f"triage_return_{row['entry_id']}", on_click=_return_to_queue, args=(row, username))
+
+
+@st.fragment
+@perf.timed_rerun("medical_camp", page="Prescription")
+def prescription_builder():
+    """Medicine rows for the prescription. Returns the list of medicines on full reruns (Save Visit)."""
+    st.subheader("Prescription")
+    medicines = []
+    stock_df = get_stock_df()
+    med_index = get_medicine_index(stock_df)
+
+    # Allow adding medicines dynamically
+    num_meds = st.number_input("Number of Medicines", 1, 10, key="num_meds")
+
+    for i in range(int(num_meds)):
+        st.markdown(f"**Medicine {i+1}**")
+        search = st.text_input(f"Search Medicine {i+1}", key=f"med_search_{i}",
+                               placeholder="generic, brand, form or dose — e.g. amox syp")
+        options = med_index.search(search)
+        current = st.session_state.get(f"med_{i}")
+        if current and current not in options:
+            options = [current] + options   # keep the pick when the search changes
+        sel_key = st.selectbox(f"Medicine {i+1}", [""] + options, key=f"med_{i}",
+                               format_func=lambda k: "" if k == "" else med_index.label(k))
+
+        if sel_key:
+            row = med_index.row(sel_key)
+            c1, c2, c3 = st.columns(3)
+            st.session_state.setdefault(f"freq_{i}", "1+0+1")
+            st.session_state.setdefault(f"time_{i}", "After Meal")
+            st.session_state.setdefault(f"amount_{i}", "3 Days")
+            freq = c1.text_input(f"Freq {i+1}", key=f"freq_{i}")
+            time_day = c2.text_input(f"Time {i+1}", key=f"time_{i}")
+            amount = c3.text_input(f"Days/Qty {i+1}", key=f"amount_{i}")
+
+            # Out of stock: offer in-stock equivalents (one click swaps the pick)
+            if row["stock_qty"] <= 0:
+                qty = holds.estimate_qty(freq, amount, row["dosage_form"])
+                sub_index = get_substitution_index(stock_df)
+                subs = sub_index.suggest(sel_key, qty, limit=3)
+                if subs:
+                    st.caption("⚠️ Out of stock. In stock instead:")
+                    for j, sub in enumerate(subs):
+                        st.button(sub_index.describe(sub), key=f"sub_{i}_{j}",
+                                  on_click=_use_substitute, args=(i, sub["key"]))
+                else:
+                    st.caption("⚠️ Out of stock, and nothing equivalent in stock.")
+
+            medicines.append({
+                "key": sel_key,
+                "generic": row["generic"],
+                "brand": row["brand"],
+                "dosage_form": row["dosage_form"],
+                "frequency": freq,
+                "time": time_day,
+                "amount": amount
+            })
+    return medicines
+
+
+@st.fragment
+@perf.timed_rerun("medical_camp", page="Dispensation Grid")
+def dispensation_grid(visit_id, visit_row, stock_df):
+    """Per-medicine brand/qty rows and the Confirm button for one visit."""
+    med_index = get_medicine_index(stock_df)
+    substitutes = get_substitution_index(stock_df)
+    conn = get_connection()
+    # 6. Prescription lines as saved by the doctor (stock key, brand, instructions, qty)
+    rx_lines = rx.load_prescriptions(conn, visit_id)
+    # Quantities below are what this visit may take: free stock plus its own holds
+    stock_df = holds.free_stock(stock_df, holds.visit_holds(conn, visit_id))
+    conn.close()
+    st.subheader(f"Dispensing for Visit ID: {visit_id}")
+    st.write(f"**Doctor:** {visit_row['doctor_type']}")
+    fefo = st.toggle("Allocate by earliest expiry (FEFO)", value=True, key=f"fefo_{visit_id}",
+                     help="Take from the batch that expires first, across brands of the same medicine, form and dose.")
+
+    dispense_plan = []
+    # Units already taken by earlier lines of this visit, per stock row (or per FEFO group)
+    allocated = {}
+
+    # Grid Header
+    c1, c2, c3, c4, c5 = st.columns([3, 2, 2, 2, 2])
+    c1.markdown("**Medicine**")
+    c2.markdown("**Brand**")
+    c3.markdown("**Stock**")
+    c4.markdown("**Prescribed**")
+    c5.markdown("**Dispense Qty**")
+    st.divider()
+
+    for line in rx_lines.itertuples(index=False):
+        i = int(line.line_no)
+        generic, brand = str(line.generic or ""), str(line.brand or "")
+        prescribed_details = ", ".join(str(x) for x in [line.frequency, line.time_of_day, line.amount] if x)
+        generic_norm = generic.lower()
+
+        # Find matching stock
+        possible_brands = q.stock_rows_for_generic(stock_df, generic_norm)
+        brand_options = possible_brands["brand"].unique().tolist()
+
+        # Exact stock row the doctor picked, when the prescription carries its key
+        keyed = med_index.row(line.stock_key) if line.stock_key else None
+        if keyed is not None and keyed["brand"] not in brand_options:
+            brand_options = [keyed["brand"]] + brand_options
+
+        # Auto-select brand if only one exists, or let user pick
+        selected_brand = brand # Default to prescribed brand
+        if brand_options:
+            # If the prescribed brand isn't in stock, or multiple options exist
+            if len(brand_options) > 0:
+                # Try to find the prescribed brand in the options
+                default_ix = 0
+                if brand in brand_options:
+                    default_ix = brand_options.index(brand)
+
+                selected_brand = st.selectbox(
+                    f"Brand for {generic}",
+                    options=brand_options,
+                    index=default_ix,
+                    key=f"br_{visit_id}_{i}",
+                    label_visibility="collapsed"
+                )
+
+        # Get precise stock row: by key if the prescribed brand was kept, else by name
+        if keyed is not None and selected_brand == keyed["brand"]:
+            matched = stock_df[stock_df["key"] == keyed["key"]]
+        else:
+            matched = q.stock_row_for_brand(stock_df, generic_norm, selected_brand)
+
+        if matched.empty:
+            stock_qty, group = 0, None
+        elif fefo:
+            m = matched.iloc[0]
+            stock_qty = batches.fefo_available(stock_df, m["generic"], m["dosage_form"], m["dose"])
+            group = (m["generic"], m["dosage_form"], m["dose"])
+        else:
+            stock_qty, group = int(matched.iloc[0]["stock_qty"]), matched.iloc[0]["key"]
+        left = max(stock_qty - allocated.get(group, 0), 0)
+
+        # Render Row
+        c1, c2, c3, c4, c5 = st.columns([3, 2, 2, 2, 2])
+        with c1: st.write(f"{generic}")
+        with c2: st.write(f"{selected_brand}")
+        with c3: st.write(f"{stock_qty}")
+        with c4: st.caption(f"{prescribed_details} · {line.qty} units")
+        with c5:
+            qty_to_dispense = st.number_input(
+                "Qty", min_value=0, max_value=stock_qty, value=min(line.qty, left), step=1,
+                key=f"qty_{visit_id}_{i}", label_visibility="collapsed"
+            )
+        if group is not None:
+            allocated[group] = allocated.get(group, 0) + int(qty_to_dispense)
+
+        # Nothing to give: list in-stock equivalents (switch brand above, or note the change)
+        ref = matched.iloc[0] if not matched.empty else keyed
+        if stock_qty == 0 and ref is not None:
+            for sub in substitutes.suggest(ref["key"], line.qty, limit=3):
+                st.caption(f"🔁 {substitutes.describe(sub)}")
+
+        dispense_plan.append({
+            "display": f"{generic} [{selected_brand}]",
+            "generic": generic,
+            "brand": selected_brand,
+            "dispense_qty": int(qty_to_dispense),
+            "matched_index": matched.index[0] if not matched.empty else None
+        })
+        st.divider()
+
+    # 7. Confirm Button
+    if st.button("✅ Confirm Dispensation"):
+        to_dispense = [d for d in dispense_plan if d["dispense_qty"] > 0]
+
+        if not to_dispense:
+            st.error("Please enter a quantity greater than 0 for at least one medicine.")
+        else:
+            dispensed_summary, movements = [], []
+            # Stock deductions, their ledger rows and the visit update commit or roll back together
+            conn2 = get_connection()
+            cur2 = conn2.cursor()
+            try:
+                conn2.start_transaction()
+                holds.convert_holds(cur2, visit_id)
+                for d in to_dispense:
+                    if d["matched_index"] is None:
+                        raise batches.InsufficientStock(f"Error finding key for {d['display']}")
+                    row = stock_df.loc[d["matched_index"]]
+                    if fefo:
+                        allocations = batches.allocate_fefo(cur2, row["generic"], d["dispense_qty"], row["dosage_form"], row["dose"])
+                    else:
+                        allocations = [{"key": row["key"], "brand": row["brand"], "expiry": row["expiry"], "take": d["dispense_qty"]}]
+                    batches.apply_allocations(cur2, allocations)
+                    movements += ledger.dispense_movements(allocations, visit_id, st.session_state.get("username"))
+                    for a in allocations:
+                        dispensed_summary.append(f"{d['generic']} [{a['brand']}] (Qty: {a['take']})")
+
+                ledger.record_movements(cur2, movements)
+                cur2.execute(
+                    "UPDATE visits SET dispensed='Yes', dispensed_details=%s WHERE visit_id=%s",
+                    ("; ".join(dispensed_summary), visit_id)
+                )
+                flow.advance(cur2, int(visit_row["patient_id"]), "done", st.session_state.get("username"))
+                conn2.commit()
+            except batches.InsufficientStock as e:
+                conn2.rollback()
+                st.error(f"Nothing was dispensed: {e}")
+            except Exception as e:
+                conn2.rollback()
+                st.error(f"Error saving dispensation: {e}")
+            else:
+                metrics.DISPENSATIONS.inc()
+                timeline.get_timeline_cache().invalidate(visit_row["patient_id"])
+                try:
+                    ledger.maybe_snapshot(conn2)
+                except Exception as e:
+                    st.warning(f"Stock snapshot skipped: {e}")
+                # Refresh Data from DB (So UI shows new true values)
+                refresh_stock()
+                st.success("Dispensation Saved! Inventory Updated.")
+                st.rerun()
+            finally:
+                conn2.close()
+
+
+def show_stock_ledger():
+    st.header("Stock Ledger")
+    conn = get_connection()
+    snap = pd.read_sql(
+        "SELECT snapshot_id, taken_at, last_movement_id FROM stock_snapshots ORDER BY snapshot_id DESC LIMIT 1", conn
+    )
+    pending = pd.read_sql(
+        "SELECT COUNT(*) AS n FROM stock_movements WHERE movement_id > %s", conn,
+        params=(int(snap["last_movement_id"].iloc[0]) if not snap.empty else 0,)
+    )["n"].iloc[0]
+
+    c1, c2, c3 = st.columns([2, 2, 1])
+    c1.metric("Last snapshot", str(snap["taken_at"].iloc[0])[:16] if not snap.empty else "-")
+    c2.metric("Movements since", int(pending))
+    if c3.button("📸 Snapshot Now"):
+        ledger.take_snapshot(conn)
+        conn.close()
+        st.rerun()
+
+    # --- Stock at a point in time ---
+    st.subheader("Stock at Time")
+    t1, t2, t3 = st.columns(3)
+    as_of_now = t1.checkbox("Now", value=True, key="ledger_now")
+    day = t2.date_input("Date", key="ledger_day", disabled=as_of_now)
+    at = t3.time_input("Time", key="ledger_time", disabled=as_of_now)
+    when = None if as_of_now else pd.Timestamp.combine(day, at).to_pydatetime()
+    balance = ledger.stock_at(conn, when).reset_index()
+    names = get_stock_df()[["key", "generic", "brand", "dosage_form", "dose", "expiry"]]
+    st.dataframe(names.merge(balance, on="key", how="right"), use_container_width=True, hide_index=True)
+
+    # --- Recent movements ---
+    st.subheader("Recent Movements")
+    st.dataframe(ledger.recent_movements(conn, 200), use_container_width=True, hide_index=True)
+
+    # --- Prescription holds ---
+    st.subheader("Reserved for Prescriptions")
+    active = holds.active_holds(conn)
+    h1, h2 = st.columns([3, 1])
+    h1.metric("Active holds", len(active), help=f"Released automatically {holds.HOLD_TTL_MINUTES} min after Save Visit")
+    if h2.button("🧹 Release Expired"):
+        n = holds.release_expired(conn)
+        refresh_stock()
+        st.success(f"Released {n} expired holds.")
+    if not active.empty:
+        st.dataframe(active, use_container_width=True, hide_index=True)
+
+    # --- Reconciliation against a physical count ---
+    st.subheader("Reconcile Physical Count")
+    count_csv = st.file_uploader("Count sheet (drug audit layout, or Key + Counted columns)", type=["csv"], key="count_csv")
+    if count_csv is not None:
+        try:
+            counts = ledger.read_count_csv(count_csv)
+        except ValueError as e:
+            st.error(f"Could not read CSV: {e}")
+        else:
+            report = ledger.reconcile(conn, counts)
+            summary = report["status"].value_counts()
+            cols = st.columns(len(summary))
+            for col, (status, n) in zip(cols, summary.items()):
+                col.metric(status.title(), int(n))
+            if report["untracked_change"].any():
+                st.warning(f"{int(report['untracked_change'].sum())} items changed outside the app (stock ≠ ledger).")
+            st.dataframe(report, use_container_width=True, hide_index=True)
+            if st.button("✅ Post Count Adjustments"):
+                n = ledger.post_count(conn, report, st.session_state.get("username"))
+                refresh_stock()
+                st.success(f"Booked {n} adjustments; stock now matches the count.")
+    conn.close()
+
+
 # --------- Main App ----------
+@perf.timed_rerun("medical_camp")
 def run_app():
     st.set_page_config(layout="centered", page_title="Medical Camp EMR & Pharmacy")
 
@@ -296,21 +971,22 @@ def run_app():
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
+
     if "icd_df" not in st.session_state:
         with st.spinner("Loading Diagnosis Database..."):
-            st.session_state["icd_df"] = load_icd_diagnosis_from_db()
+            st.session_state["icd_df"] = icd_diagnosis()
 
     if "icd_symptoms_df" not in st.session_state:
         with st.spinner("Loading Symptoms Database..."):
-            st.session_state["icd_symptoms_df"] = load_icd_symptoms_from_db()
+            st.session_state["icd_symptoms_df"] = icd_symptoms()
 
     # Automatically load CSV into DB if "stock_df" isn't in session yet
     if "stock_loaded" not in st.session_state:
         load_stock()
         st.session_state["stock_loaded"] = True
 
-    if "stock_df" not in st.session_state:
-        st.session_state["stock_df"] = load_stock_df()
+    # plain factory: get_connection() calls st.error/st.stop, which a background thread can't
+    holds.start_hold_sweeper(lambda: perf.connect(mysql.connector.connect, **db_config))
         # ----------------------------------------
     st.title("Medical Camp EMR System")
 
@@ -322,9 +998,9 @@ def run_app():
     # Determine visible tabs
     tabs = []
     if role == "admin":
-        tabs = ["Patient Entry", "Patient Records", "Pharmacy Dispensation"]
+        tabs = ["Patient Entry", "Patient Records", "Search Records", "Pharmacy Dispensation", "Patient Flow", "Stock Ledger", "Demand Forecast", "Performance"]
     elif role == "doctor":
-        tabs = ["Patient Entry", "Patient Records"]
+        tabs = ["Patient Entry", "Patient Records", "Search Records"]
     elif role == "pharmacy":
         tabs = ["Pharmacy Dispensation", "Patient Records"]
     elif role == "registration":
@@ -351,32 +1027,75 @@ def run_app():
             with col2:
                 st.info("Re-reads 'New_drug_list.csv' and wipes current DB stock.")
 
+            # Drug audit sheet -> one stock row per batch (expiry "27-Oct" = Oct 2027)
+            audit_csv = st.file_uploader("Import stock batches (ERR Drug Audit CSV)", type=["csv"], key="stock_batch_csv")
+            if audit_csv is not None and st.button("📦 Import Batches"):
+                try:
+                    batch_df = batches.read_stock_csv(audit_csv)
+                except ValueError as e:
+                    st.error(f"Could not read CSV: {e}")
+                else:
+                    st.session_state["stock_import"] = {
+                        "batches": batch_df, "superseded": batches.superseded_batches(load_stock_df(), batch_df)}
+
+            # Same products already in stock under other keys: admin confirms before they are replaced
+            pending_import = st.session_state.get("stock_import")
+            if pending_import:
+                batch_df, superseded = pending_import["batches"], pending_import["superseded"]
+                confirmed = superseded.empty
+                if not confirmed:
+                    st.warning(f"⚠️ {len(superseded)} existing stock row(s) are products on this sheet under another key. "
+                               "Importing sets them to 0 and moves their open holds to the new batch:")
+                    st.dataframe(superseded[["key", "generic", "brand", "dosage_form", "dose", "expiry", "stock_qty",
+                                             "reserved_qty", "replaced_by"]], use_container_width=True, hide_index=True)
+                    col_a, col_b = st.columns(2)
+                    confirmed = col_a.button("✅ Replace and Import", key="stock_import_confirm")
+                    if col_b.button("✖ Cancel Import", key="stock_import_cancel"):
+                        del st.session_state["stock_import"]
+                        st.rerun()
+                if confirmed:
+                    del st.session_state["stock_import"]
+                    zeroed = superseded.assign(stock_qty=0)[batch_df.columns]
+                    save_stock(pd.concat([batch_df, zeroed], ignore_index=True),
+                               moved_holds=list(zip(superseded["key"], superseded["replaced_by"])))
+                    refresh_stock()
+                    st.success(f"Imported {len(batch_df)} batches ({batch_df['expiry'].isna().sum()} without a readable expiry)"
+                               f"; replaced {len(superseded)} superseded row(s).")
+
     if selected_page == "Patient Entry":
-        with st.container():
+        with st.container(), perf.section("Patient Entry"):
             st.header("Patient Visit Entry")
 
+            refresh_patients = False
             if role == "doctor":
-                if st.button("🔄 Refresh Patient List"):
-                    st.rerun()
+                refresh_patients = st.button("🔄 Refresh Patient List")
 
             conn = get_connection()
-            patients_df = pd.read_sql("SELECT patient_id, patient_name, cnic FROM patients ORDER BY patient_id DESC", conn)
+            patients_df = patient_list(conn, refresh=refresh_patients)
+            sync_cooccurrence_index(get_cooccurrence_index(), conn)
+            sync_prescription_patterns(get_prescription_patterns(), conn)
+            triage_q = triage.get_triage_queue().sync(conn)
             conn.close()
 
+            if role in ["admin", "doctor"]:
+                triage_panel(triage_q, username, patients_df)
+
             patient_options = []
             if role in ["admin", "registration"]:
                 patient_options.append("+ Register New Patient")
 
-            for _, r in patients_df.iterrows():
-                label = f"{int(r['patient_id'])} - {r['patient_name']} ({r['cnic']})"
-                patient_options.append(label)
+            patient_options.extend(q.patient_option_labels(patients_df))
 
             if not patient_options:
                 st.info("No patients available.")
                 st.stop()
 
-            selected_patient_label = st.selectbox("Select Registered Patient", options=patient_options, index=0)
+            if st.session_state.get("entry_patient") not in patient_options:
+                st.session_state.pop("entry_patient", None)
+            selected_patient_label = st.selectbox("Select Registered Patient", options=patient_options, key="entry_patient")
             registering_new = (selected_patient_label == "+ Register New Patient")
+            if st.session_state.get("entry_prefilled_for") != selected_patient_label:
+                _prefill_for(selected_patient_label)
 
             if registering_new and role not in ["admin", "registration"]:
                 st.error("Permission denied: You cannot register new patients.")
@@ -392,11 +1111,22 @@ def run_app():
                 p_phone = st.text_input("Phone Number", key="reg_p_phone")
                 p_gender = st.selectbox("Select Gender", ["", "Male", "Female", "Other"], key="reg_p_gender")
                 p_age = st.number_input("Age", min_value=0, max_value=120, step=1, key="reg_p_age")
+
+                # Live duplicate suggestions while the details are typed in
+                dup_index = get_duplicate_index()
+                if p_name.strip() or p_phone.strip() or p_cnic.strip():
+                    conn = get_connection()
+                    sync_duplicate_index(dup_index, conn)
+                    conn.close()
+                    matches = dup_index.find_matches(p_name, p_cnic, p_phone, int(p_age), p_gender)
+                    if matches:
+                        st.warning("⚠️ Possible existing patients — select them from the list above instead of re-registering:")
+                        st.dataframe(pd.DataFrame(matches), use_container_width=True, hide_index=True)
             else:
                 pid = int(selected_patient_label.split(" - ")[0])
                 conn = get_connection()
                 cur = conn.cursor()
-                cur.execute("SELECT * FROM patients WHERE patient_id=%s", (pid,))
+                cur.execute(q.PATIENT_BY_ID_SQL, (pid,))
                 row = cur.fetchone()
                 conn.close()
 
@@ -409,6 +1139,13 @@ def run_app():
                     p_gender, p_age = row[6], row[7]
 
                     st.text_input("Age", value=str(p_age), disabled=True)
+
+                    conn = get_connection()
+                    timeline.show_timeline(timeline.get_timeline_cache().get(conn, pid))
+                    conn.close()
+                    prefill_note = st.session_state.get("entry_prefill_note")
+                    if prefill_note:
+                        st.info(prefill_note)
                 else:
                     st.error("Patient not found in DB.")
                     st.stop()
@@ -420,164 +1157,104 @@ def run_app():
             # Vitals
             st.subheader("Vitals")
             c1, c2, c3, c4 = st.columns(4)
-            bp_sys = c1.number_input("BP Sys", 0)
-            bp_dia = c2.number_input("BP Dia", 0)
-            heart_rate = c3.number_input("HR (BPM)", 0)
-            temp = c4.number_input("Temp (C)", 36.0)
+            for key, default in VITAL_WIDGETS.values():
+                st.session_state.setdefault(key, default)
+            bp_sys = c1.number_input("BP Sys", 0, key="v_bp_sys")
+            bp_dia = c2.number_input("BP Dia", 0, key="v_bp_dia")
+            heart_rate = c3.number_input("HR (BPM)", 0, key="v_heart_rate")
+            temp = c4.number_input("Temp (C)", key="v_temp")
 
             c5, c6, c7 = st.columns(3)
-            sat_o2 = c5.number_input("O2 Sat %", 0, 100, 98)
-            rr = c6.number_input("Resp Rate", 0)
-            blood_glucose = c7.number_input("Glucose (mg/dL)", 0)
+            sat_o2 = c5.number_input("O2 Sat %", 0, 100, key="v_sat_o2")
+            rr = c6.number_input("Resp Rate", 0, key="v_rr")
+            blood_glucose = c7.number_input("Glucose (mg/dL)", 0, key="v_glucose")
 
             patient_history = st.text_area("Patient History / Complaints")
 
-            # --- SQL BASED SYMPTOMS (Updated with +/- options) ---
-            st.subheader("Symptoms")
-
-            # 1. Initialize selection list in session state if missing
-            if "selected_symptoms" not in st.session_state:
-                st.session_state.selected_symptoms = []
-
-            # 2. Search Box
-            sym_search = st.text_input("🔍 Search Symptoms (Type 3+ letters)", key="sym_search_box")
-
-            # 3. Dynamic Filtering (Only runs if input > 3 chars)
-            sym_options = []
-            if len(sym_search) >= 3:
-                full_sym_df = st.session_state.get("icd_symptoms_df")
-                if full_sym_df is not None and not full_sym_df.empty:
-                    # Filter locally
-                    mask = full_sym_df["Symptom"].str.contains(sym_search, case=False, na=False)
-                    sym_options = full_sym_df[mask]["Symptom"].head(20).tolist() # Limit to 20 results for speed
-
-            # 4. Picker (Only shows filtered options)
-            new_sym = st.selectbox("Select Result", [""] + sym_options, key="sym_picker")
-
-            # 5. Add to list logic
-            if new_sym and new_sym not in st.session_state.selected_symptoms:
-                st.session_state.selected_symptoms.append(new_sym)
-
-            # 6. Display Selected items with Remove buttons
-            if st.session_state.selected_symptoms:
-                st.write("**Selected:**")
-                for s in st.session_state.selected_symptoms:
-                    col_a, col_b = st.columns([8, 1])
-                    col_a.text(s)
-                    if col_b.button("❌", key=f"del_sym_{s}"):
-                        st.session_state.selected_symptoms.remove(s)
-                        st.rerun()
-
-            # IMPORTANT: Map this list to the variable your Save button expects
+            # --- Symptoms & Diagnosis pickers (fragments: typing only reruns the picker) ---
+            icd_picker("symptoms")
+            icd_picker("diagnosis")
             symptoms_selected = st.session_state.selected_symptoms
-
-            # --- SQL BASED DIAGNOSIS (Updated with +/- options) ---
-            st.subheader("Diagnosis (ICD-10)")
-
-            if "selected_diagnosis" not in st.session_state:
-                st.session_state.selected_diagnosis = []
-
-            diag_search = st.text_input("🔍 Search Diagnosis (Type 3+ letters)", key="diag_search_box")
-
-            diag_options = []
-            if len(diag_search) >= 3:
-                full_diag_df = st.session_state.get("icd_df")
-                if full_diag_df is not None and not full_diag_df.empty:
-                    mask = full_diag_df["Diagnosis"].str.contains(diag_search, case=False, na=False)
-                    diag_options = full_diag_df[mask]["Diagnosis"].head(20).tolist()
-
-            new_diag = st.selectbox("Select Result", [""] + diag_options, key="diag_picker")
-
-            if new_diag and new_diag not in st.session_state.selected_diagnosis:
-                st.session_state.selected_diagnosis.append(new_diag)
-
-            if st.session_state.selected_diagnosis:
-                st.write("**Selected:**")
-                for d in st.session_state.selected_diagnosis:
-                    col_a, col_b = st.columns([8, 1])
-                    col_a.text(d)
-                    if col_b.button("❌", key=f"del_diag_{d}"):
-                        st.session_state.selected_diagnosis.remove(d)
-                        st.rerun()
-
-            # IMPORTANT: Map this list to the variable your Save button expects
             indications_selected = st.session_state.selected_diagnosis
 
             # Medicine Entry
-            st.subheader("Prescription")
-            medicines = []
-            stock_df = st.session_state.get("stock_df", pd.DataFrame())
-
-            # Allow adding medicines dynamically
-            num_meds = st.number_input("Number of Medicines", 1, 10, 1)
+            medicines = prescription_builder()
 
-            for i in range(int(num_meds)):
-                st.markdown(f"**Medicine {i+1}**")
-                med_options = stock_df["generic"].dropna().unique().tolist() if not stock_df.empty else []
-                sel_generic = st.selectbox(f"Medicine {i+1}", [""] + med_options, key=f"med_{i}")
+            hold_note = st.session_state.pop("rx_hold_note", None)
+            if hold_note:
+                st.warning(hold_note)
 
-                if sel_generic:
-                    row = stock_df[stock_df["generic"] == sel_generic].iloc[0]
-                    c1, c2, c3 = st.columns(3)
-                    freq = c1.text_input(f"Freq {i+1}", "1+0+1")
-                    time_day = c2.text_input(f"Time {i+1}", "After Meal")
-                    amount = c3.text_input(f"Days/Qty {i+1}", "3 Days")
-
-                    medicines.append({
-                        "generic": row["generic"],
-                        "brand": row["brand"],
-                        "frequency": freq,
-                        "time": time_day,
-                        "amount": amount
-                    })
+            # Interaction / contraindication check (precompiled rules, no queries)
+            safety_index = safety.get_safety_index(safety.stock_brands(get_stock_df()))
+            rx_conditions = safety_index.conditions_in(
+                indications_selected + symptoms_selected + [patient_history], age=p_age)
+            # stock generics ("Diclofenac Sodium") and brands resolve to the rule names
+            rx_generics = safety_index.medicines_in([f"{m['generic']} {m['brand']}" for m in medicines])
+            rx_findings = safety_index.check(rx_generics, rx_conditions)
+            rx_ok = safety.show_findings(rx_findings, key="rx_safety_override")
 
             if st.button("Save Visit"):
+                if not rx_ok:
+                    st.error("Review the prescription safety warnings above before saving.")
+                    st.stop()
                 if registering_new:
                     valid, msg = validate_patient_inputs(p_name, p_cnic, p_nationality, p_phone, p_gender, int(p_age))
                     if not valid:
                         st.error(msg)
                         st.stop()
 
-                conn = get_connection()
-                cur = conn.cursor()
-
-                # 1. Handle Patient
                 if registering_new:
-                    # check exist
-                    cur.execute("SELECT patient_id FROM patients WHERE cnic=%s", (p_cnic,))
-                    exist = cur.fetchone()
-                    if exist:
-                        patient_id = exist[0]
-                        # Update details
-                        cur.execute("UPDATE patients SET patient_name=%s, age=%s WHERE patient_id=%s", (p_name, p_age, patient_id))
-                    else:
-                        cur.execute("INSERT INTO patients (patient_name, cnic, nationality, address, phone, gender, age) VALUES (%s,%s,%s,%s,%s,%s,%s)",
-                                    (p_name, p_cnic, p_nationality, p_address, p_phone, p_gender, p_age))
-                        patient_id = cur.lastrowid
+                    patient = {"patient_name": p_name, "cnic": p_cnic, "nationality": p_nationality, "address": p_address,
+                               "phone": p_phone, "gender": p_gender, "age": p_age}
                 else:
-                    patient_id = pid
+                    patient = {"patient_id": pid}
+                visit = {"doctor_type": doctor_type, "history": patient_history, "bp_sys": bp_sys, "bp_dia": bp_dia,
+                         "heart_rate": heart_rate, "sat_o2": sat_o2, "temp": temp, "rr": rr, "blood_glucose": blood_glucose,
+                         "gender": p_gender, "age": p_age, "symptoms": symptoms_selected, "indications": indications_selected}
 
-                # 2. Insert Visit
-                med_str = "; ".join([f"{m['generic']} [{m['brand']}] ({m['frequency']}, {m['amount']})" for m in medicines])
-
-                cur.execute("""
-                    INSERT INTO visits (patient_id, doctor_type, visit_date, history, bp, heart_rate, sat_o2, temp, blood_glucose, gender, age, symptoms, indications, medicines, dispensed)
-                    VALUES (%s, %s, NOW(), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'No')
-                """, (patient_id, doctor_type, patient_history, f"{bp_sys}/{bp_dia}", heart_rate, sat_o2, temp, blood_glucose, p_gender, p_age,
-                      "; ".join(symptoms_selected), "; ".join(indications_selected), med_str))
-
-                conn.commit()
-                conn.close()
+                # Patient (by CNIC) + visit + triage/flow/holds in one transaction
+                conn = get_connection()
+                try:
+                    saved = visit_service.save_visit(conn, patient, visit, medicines, username)
+                except Exception as e:
+                    st.error(f"Error saving visit: {e}")
+                    st.stop()
+                finally:
+                    conn.close()
+                patient_id, visit_id = saved["patient_id"], saved["visit_id"]
+                timeline.get_timeline_cache().invalidate(patient_id)
+                if saved["short"]:
+                    st.session_state["rx_hold_note"] = "Last visit: not enough free stock to reserve " + ", ".join(
+                        f"{k.split('||')[0].title()} ({held} of {want})" for k, want, held in saved["short"]
+                    ) + ". Pharmacy may need a substitute."
+
+                # Local caches take the saved rows; the rerun below doesn't reread them
+                if registering_new:
+                    st.session_state["patient_list"] = q.merge_patient_rows(
+                        patients_df, [(patient_id, p_name, p_cnic)])
+                    if saved["created"]:
+                        get_duplicate_index().add(patient_id, p_name, p_cnic, p_phone, p_age, p_gender)
+                    else:
+                        # existing CNIC: save_visit updated its name and age
+                        get_duplicate_index().refile(patient_id, patient_name=p_name, age=p_age)
+                get_cooccurrence_index().add(visit_id, symptoms_selected, indications_selected)
+                get_prescription_patterns().add(visit_id, indications_selected, [
+                    (item_id(m["key"], m["generic"]), m["frequency"], m["amount"]) for m in medicines
+                ])
+                metrics.VISITS_SAVED.inc("medical")
                 st.success("Visit Saved Successfully!")
 
                 # --- NEW: Clear selections for next patient ---
                 st.session_state.selected_symptoms = []
                 st.session_state.selected_diagnosis = []
+                st.session_state.pop("rx_safety_override", None)
+                for key, _ in VITAL_WIDGETS.values():
+                    st.session_state.pop(key, None)
                 st.rerun()
 
     # ---------- PATIENT RECORDS TAB (The "Good" Version) ----------
     if selected_page == "Patient Records":
-        with st.container():
+        with st.container(), perf.section("Patient Records"):
             st.header("All Patient Records & Analytics")
 
             # 1. Refresh Button
@@ -587,16 +1264,7 @@ def run_app():
             # 2. Fetch Combined Data (Patients + Visits)
             conn = get_connection()
             try:
-                df = pd.read_sql("""
-                    SELECT 
-                        p.patient_id, p.patient_name, p.cnic, p.age, p.gender,
-                        v.visit_id, v.doctor_type, v.visit_date, v.history,
-                        v.bp, v.heart_rate, v.symptoms, v.indications,
-                        v.medicines, v.dispensed, v.dispensed_details
-                    FROM patients p
-                    LEFT JOIN visits v ON p.patient_id = v.patient_id
-                    ORDER BY v.visit_date DESC, p.patient_id DESC
-                """, conn)
+                df = pd.read_sql(q.RECORDS_SQL, conn)
             except Exception as e:
                 st.error(f"Error fetching records: {e}")
                 df = pd.DataFrame()
@@ -608,6 +1276,10 @@ def run_app():
             else:
                 import streamlit.components.v1 as components
 
+                # Abnormal vitals, flagged for every visit in one pass
+                vital_flags = vitals.flag_vitals(df)
+                df.insert(df.columns.get_loc("bp"), "vital_flags", vitals.flag_labels(vital_flags))
+
                 # ==========================================
                 # NEW FEATURE 1: ANALYTICS DASHBOARD
                 # ==========================================
@@ -615,63 +1287,43 @@ def run_app():
                     st.subheader("Camp Statistics")
 
                     c1, c2, c3 = st.columns(3)
-                    total_visits = len(df["visit_id"].dropna())
-                    unique_patients = df["patient_id"].nunique()
-                    c1.metric("Total Visits", total_visits)
-                    c2.metric("Unique Patients", unique_patients)
+                    stats = q.records_analytics(df, vital_flags)
+                    c1.metric("Total Visits", stats["total_visits"])
+                    c2.metric("Unique Patients", stats["unique_patients"])
 
-                    if total_visits > 0:
+                    if stats["total_visits"] > 0:
                         st.markdown("---")
                         col_a, col_b, col_c = st.columns(3)
 
                         with col_a:
                             st.markdown("**Visits by Doctor Type**")
-                            doc_counts = df["doctor_type"].value_counts()
-                            st.bar_chart(doc_counts)
+                            st.bar_chart(stats["doc_counts"])
 
                         with col_b:
                             st.markdown("**Patient Age Distribution**")
-                            bins = [0, 10, 20, 30, 40, 50, 60, 120]
-                            labels = ['0-10', '11-20', '21-30', '31-40', '41-50', '51-60', '60+']
-                            age_groups = pd.cut(df["age"].fillna(0), bins=bins, labels=labels, right=False).value_counts().sort_index()
-                            st.bar_chart(age_groups)
+                            st.bar_chart(stats["age_groups"])
 
                         with col_c:
                             st.markdown("**Gender Distribution**")
-                            gender_counts = df["gender"].fillna("Unknown").value_counts()
-                            st.bar_chart(gender_counts)
+                            st.bar_chart(stats["gender_counts"])
+
+                        st.markdown("---")
+                        st.markdown("**Abnormal Vitals (visits flagged)**")
+                        st.bar_chart(stats["vital_flags"])
 
                         st.markdown("---")
                         st.markdown("**Top Medical Trends**")
                         c_sym, c_diag, c_med = st.columns(3)
 
-                        s_series = df['symptoms'].dropna().astype(str)
-                        s_list = [s.strip() for sub in s_series.str.split(';') for s in sub if s.strip()]
-                        top_sym = pd.Series(s_list).value_counts().head(5)
-
-                        i_series = df['indications'].dropna().astype(str)
-                        i_list = [i.strip() for sub in i_series.str.split(';') for i in sub if i.strip()]
-                        top_diag = pd.Series(i_list).value_counts().head(5)
-
-                        m_series = df['medicines'].dropna().astype(str)
-                        m_list = []
-                        for m_str in m_series:
-                            for m in m_str.split(';'):
-                                m = m.strip()
-                                if m:
-                                    gen = m.split('[')[0].strip() if '[' in m else m
-                                    m_list.append(gen)
-                        top_meds = pd.Series(m_list).value_counts().head(5)
-
                         with c_sym:
                             st.caption("Most Common Symptoms")
-                            st.dataframe(top_sym, column_config={"count": "Freq"}, use_container_width=True)
+                            st.dataframe(stats["top_sym"], column_config={"count": "Freq"}, use_container_width=True)
                         with c_diag:
                             st.caption("Most Common Diagnosis")
-                            st.dataframe(top_diag, column_config={"count": "Freq"}, use_container_width=True)
+                            st.dataframe(stats["top_diag"], column_config={"count": "Freq"}, use_container_width=True)
                         with c_med:
                             st.caption("Most Prescribed Medicines")
-                            st.dataframe(top_meds, column_config={"count": "Freq"}, use_container_width=True)
+                            st.dataframe(stats["top_meds"], column_config={"count": "Freq"}, use_container_width=True)
 
                 # ==========================================
                 # NEW FEATURE 2: PRINT RECORDS (100% STABLE DOWNLOAD APPROACH)
@@ -707,7 +1359,8 @@ def run_app():
                                 </table>
                                 <br>
                                 <h3 style="color: black;">Clinical Information</h3>
-                                <p><strong>Vitals:</strong> BP: {v_data['bp']} &nbsp;|&nbsp; HR: {v_data['heart_rate']}</p>
+                                <p><strong>Vitals:</strong> BP: {v_data['bp']} &nbsp;|&nbsp; HR: {v_data['heart_rate']} &nbsp;|&nbsp; SpO2: {v_data['sat_o2']} &nbsp;|&nbsp; Temp: {v_data['temp']} &nbsp;|&nbsp; RR: {v_data['rr']} &nbsp;|&nbsp; Glucose: {v_data['blood_glucose']}</p>
+                                <p><strong>Flags:</strong> {v_data['vital_flags'] or 'None'}</p>
                                 <p><strong>History / Complaints:</strong> {v_data['history']}</p>
                                 <p><strong>Symptoms:</strong> {v_data['symptoms']}</p>
                                 <p><strong>Diagnosis:</strong> {v_data['indications']}</p>
@@ -776,7 +1429,16 @@ def run_app():
                 # ==========================================
                 st.write("---")
                 st.markdown("### Record Table")
-                st.dataframe(df, use_container_width=True)
+                f1, f2 = st.columns([1, 3])
+                only_flagged = f1.checkbox("Abnormal vitals only", key="records_flagged_only")
+                flag_filter = f2.multiselect("Flags", vitals.FLAGS, key="records_flag_filter",
+                                             placeholder="any flag") if only_flagged else []
+                if only_flagged:
+                    show = vital_flags[flag_filter or vitals.FLAGS].any(axis=1)
+                    st.caption(f"{int(show.sum())} of {int(df['visit_id'].notna().sum())} visits flagged")
+                    st.dataframe(df[show], use_container_width=True)
+                else:
+                    st.dataframe(df, use_container_width=True)
 
             # 4. Management / Deletion Tools
             if role in ["admin", "doctor"]:
@@ -795,9 +1457,13 @@ def run_app():
                             if del_visit:
                                 conn = get_connection()
                                 cur = conn.cursor()
+                                holds.release_holds(cur, int(del_visit))   # reserved units go back to free stock
+                                rx.delete_prescriptions(cur, [int(del_visit)])
                                 cur.execute("DELETE FROM visits WHERE visit_id=%s", (int(del_visit),))
                                 conn.commit()
                                 conn.close()
+                                for owner in df.loc[df["visit_id"] == int(del_visit), "patient_id"].unique():
+                                    timeline.get_timeline_cache().invalidate(owner)
                                 st.success(f"✅ Visit ID {del_visit} deleted.")
                                 st.rerun()
                             else:
@@ -815,20 +1481,26 @@ def run_app():
                             if del_patient:
                                 conn = get_connection()
                                 cur = conn.cursor()
+                                cur.execute("SELECT visit_id FROM visits WHERE patient_id=%s FOR UPDATE", (int(del_patient),))
+                                patient_visits = [r[0] for r in cur.fetchall()]
+                                for v_id in patient_visits:
+                                    holds.release_holds(cur, v_id)   # reserved units go back to free stock
+                                rx.delete_prescriptions(cur, patient_visits)
                                 cur.execute("DELETE FROM visits WHERE patient_id=%s", (int(del_patient),))
                                 cur.execute("DELETE FROM patients WHERE patient_id=%s", (int(del_patient),))
                                 conn.commit()
                                 conn.close()
+                                get_duplicate_index().discard(int(del_patient))
+                                timeline.get_timeline_cache().invalidate(del_patient)
+                                st.session_state.pop("patient_list", None)
                                 st.success(f"✅ Patient ID {del_patient} wiped from database.")
                                 st.rerun()
                             else:
                                 st.warning("Select a Patient ID first.")
 
-            conn.close()
-
     # ---------- PHARMACY DISPENSATION TAB (RESTORED) ----------
     if selected_page == "Pharmacy Dispensation":
-        with st.container():
+        with st.container(), perf.section("Pharmacy Dispensation"):
             st.header("Pharmacy Dispensation")
 
             # 1. Refresh Stock Button
@@ -836,14 +1508,22 @@ def run_app():
                 refresh_stock()
                 st.success("Stock refreshed.")
 
-            # Ensure stock is loaded
-            if "stock_df" not in st.session_state:
-                st.session_state["stock_df"] = load_stock_df()
-            stock_df = st.session_state["stock_df"]
+            stock_df = get_stock_df()
+
+            with st.expander("⏳ Expiring Soon"):
+                days = st.number_input("Expiring within (days)", min_value=0, max_value=3650, value=90, step=30, key="expiry_days")
+                conn = get_connection()
+                exp_df = batches.expiring_within(conn, days)
+                conn.close()
+                if exp_df.empty:
+                    st.success(f"No stock expires within {days} days.")
+                else:
+                    st.dataframe(exp_df.drop(columns=["key"]), use_container_width=True, hide_index=True)
 
             # 2. Select Patient
             conn = get_connection()
-            patients_df = pd.read_sql("SELECT * FROM patients", conn)
+            flow.show_worklist(conn, "Pharmacy")
+            patients_df = pd.read_sql(q.PHARMACY_PATIENTS_SQL, conn)
 
             if patients_df.empty:
                 conn.close()
@@ -860,10 +1540,7 @@ def run_app():
                     selected_patient_id = int(selected_patient_label.split(" - ")[0])
 
                     # 3. Load Visits for this Patient
-                    visits_df = pd.read_sql(
-                        "SELECT visit_id, visit_date, doctor_type, medicines, dispensed FROM visits WHERE patient_id=%s ORDER BY visit_date DESC",
-                        conn, params=(selected_patient_id,)
-                    )
+                    visits_df = pd.read_sql(q.PHARMACY_VISITS_SQL, conn, params=(selected_patient_id,))
                     conn.close() # Close early to free resource
 
                     if visits_df.empty:
@@ -891,128 +1568,43 @@ def run_app():
                                 visit_id = int(selected_visit_label.split(" — ")[0])
                                 visit_row = view_df[view_df["visit_id"] == visit_id].iloc[0]
 
-                                # 6. Parse Medicines (YOUR LOGIC)
-                                raw_meds = str(visit_row.get("medicines", "")).split(";")
-                                st.subheader(f"Dispensing for Visit ID: {visit_id}")
-                                st.write(f"**Doctor:** {visit_row['doctor_type']}")
-
-                                dispense_plan = []
-
-                                # Grid Header
-                                c1, c2, c3, c4, c5 = st.columns([3, 2, 2, 2, 2])
-                                c1.markdown("**Medicine**")
-                                c2.markdown("**Brand**")
-                                c3.markdown("**Stock**")
-                                c4.markdown("**Prescribed**")
-                                c5.markdown("**Dispense Qty**")
-                                st.divider()
-
-                                for i, raw in enumerate(raw_meds):
-                                    med_text = raw.strip()
-                                    if med_text == "": continue
-
-                                    # Regex parsing
-                                    brand_match = re.search(r"\[([^\]]+)\]", med_text)
-                                    brand = brand_match.group(1).strip() if brand_match else ""
-                                    generic = med_text.split("[")[0].strip()
-                                    generic_norm = generic.lower()
-
-                                    # Find matching stock
-                                    possible_brands = stock_df[stock_df["generic"].str.lower() == generic_norm]
-                                    brand_options = possible_brands["brand"].unique().tolist()
-
-                                    # Auto-select brand if only one exists, or let user pick
-                                    selected_brand = brand # Default to prescribed brand
-                                    if not possible_brands.empty:
-                                        # If the prescribed brand isn't in stock, or multiple options exist
-                                        if len(brand_options) > 0:
-                                            # Try to find the prescribed brand in the options
-                                            default_ix = 0
-                                            if brand in brand_options:
-                                                default_ix = brand_options.index(brand)
-
-                                            selected_brand = st.selectbox(
-                                                f"Brand for {generic}",
-                                                options=brand_options,
-                                                index=default_ix,
-                                                key=f"br_{visit_id}_{i}",
-                                                label_visibility="collapsed"
-                                            )
-
-                                    # Get precise stock row
-                                    matched = stock_df[
-                                        (stock_df["generic"].str.strip().str.lower() == generic_norm) &
-                                        (stock_df["brand"].str.strip().str.lower() == selected_brand.lower())
-                                        ]
-
-                                    stock_qty = int(matched.iloc[0]["stock_qty"]) if not matched.empty else 0
-
-                                    # Parse amount (e.g., "3 Days")
-                                    prescribed_match = re.search(r"\(([^)]*)\)", med_text)
-                                    prescribed_details = prescribed_match.group(1) if prescribed_match else ""
-
-                                    # Render Row
-                                    c1, c2, c3, c4, c5 = st.columns([3, 2, 2, 2, 2])
-                                    with c1: st.write(f"{generic}")
-                                    with c2: st.write(f"{selected_brand}")
-                                    with c3: st.write(f"{stock_qty}")
-                                    with c4: st.caption(prescribed_details)
-                                    with c5:
-                                        qty_to_dispense = st.number_input(
-                                            "Qty", min_value=0, max_value=stock_qty, value=0, step=1,
-                                            key=f"qty_{visit_id}_{i}", label_visibility="collapsed"
-                                        )
-
-                                    dispense_plan.append({
-                                        "display": f"{generic} [{selected_brand}]",
-                                        "generic": generic,
-                                        "brand": selected_brand,
-                                        "dispense_qty": int(qty_to_dispense),
-                                        "matched_index": matched.index[0] if not matched.empty else None
-                                    })
-                                    st.divider()
-
-                                # 7. Confirm Button
-                                if st.button("✅ Confirm Dispensation"):
-                                    to_dispense = [d for d in dispense_plan if d["dispense_qty"] > 0]
-
-                                    if not to_dispense:
-                                        st.error("Please enter a quantity greater than 0 for at least one medicine.")
-                                    else:
-                                        dispensed_summary = []
-                                        try:
-                                            # --- NEW ATOMIC LOGIC ---
-                                            for d in to_dispense:
-                                                if d["matched_index"] is not None:
-                                                    # 1. Get the Key directly from the dataframe
-                                                    idx = d["matched_index"]
-                                                    item_key = stock_df.at[idx, "key"]
-
-                                                    # 2. Deduct safely from DB
-                                                    deduct_stock_atomic(item_key, d["dispense_qty"])
-
-                                                    # 3. Add to summary log
-                                                    dispensed_summary.append(f"{d['display']} (Qty: {d['dispense_qty']})")
-                                                else:
-                                                    st.error(f"Error finding key for {d['display']}")
-
-                                            # 4. Update Visit Record
-                                            summary_str = "; ".join(dispensed_summary)
-                                            conn2 = get_connection()
-                                            cur2 = conn2.cursor()
-                                            cur2.execute(
-                                                "UPDATE visits SET dispensed='Yes', dispensed_details=%s WHERE visit_id=%s",
-                                                (summary_str, visit_id)
-                                            )
-                                            conn2.commit()
-                                            conn2.close()
-
-                                            # 5. Refresh Data from DB (So UI shows new true values)
-                                            refresh_stock()
-                                            st.success("Dispensation Saved! Inventory Updated.")
-                                            st.rerun()
-
-                                        except Exception as e:
-                                            st.error(f"Error saving dispensation: {e}")
+                                # 6. Dispensation grid (fragment: brand/qty edits only rerun the grid)
+                                dispensation_grid(visit_id, visit_row, stock_df)
+                else:
+                    conn.close()
+
+    # ---------- SEARCH RECORDS TAB ----------
+    if selected_page == "Search Records":
+        with st.container(), perf.section("Search Records"):
+            conn = get_connection()
+            search.show_search_page(conn)
+            conn.close()
+
+    # ---------- PATIENT FLOW TAB (admin) ----------
+    if selected_page == "Patient Flow":
+        with st.container(), perf.section("Patient Flow"):
+            if st.button("🔄 Refresh", key="flow_refresh"):
+                st.rerun()
+            conn = get_connection()
+            flow.show_flow_dashboard(conn)
+            conn.close()
+
+    # ---------- STOCK LEDGER TAB (admin) ----------
+    if selected_page == "Stock Ledger":
+        with st.container(), perf.section("Stock Ledger"):
+            show_stock_ledger()
+
+    # ---------- DEMAND FORECAST TAB (admin) ----------
+    if selected_page == "Demand Forecast":
+        with st.container(), perf.section("Demand Forecast"):
+            conn = get_connection()
+            show_demand_forecast(conn, get_stock_df())
+            conn.close()
+
+    # ---------- PERFORMANCE TAB (admin) ----------
+    if selected_page == "Performance":
+        with st.container():
+            perf.show_performance_dashboard()
+
 if __name__ == "__main__":
     run_app()
\ No newline at end of file
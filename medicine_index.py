@@ -0,0 +1,83 @@
+import re
+
+import pandas as pd
+
+# ---------- Medicine Search Index ----------
+# Prefix index over generic, brand, dosage form and dose of every stock row,
+# so the prescription picker can search "amox 250" or "panadol syp" without
+# scanning the stock frame per keystroke. Results carry the stock `key`,
+# which is saved with the prescription (visits.medicine_keys) so pharmacy
+# gets the exact row the doctor picked.
+
+TOKEN_RE = re.compile(r"[a-z0-9.]+")
+DEFAULT_LIMIT = 30
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def format_expiry(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    return str(value)[:7]   # YYYY-MM
+
+
+class MedicineIndex:
+    def __init__(self, stock_df):
+        cols = ["key", "generic", "brand", "dosage_form", "dose", "expiry", "stock_qty"]
+        df = stock_df.reindex(columns=cols).reset_index(drop=True)
+        df["stock_qty"] = pd.to_numeric(df["stock_qty"], errors="coerce").fillna(0).astype(int)
+        if "reserved_qty" in stock_df:
+            # units held for other patients' prescriptions are not on offer
+            reserved = pd.to_numeric(stock_df["reserved_qty"], errors="coerce").fillna(0).astype(int)
+            df["stock_qty"] = (df["stock_qty"] - reserved.reset_index(drop=True)).clip(lower=0)
+        for c in ["generic", "brand", "dosage_form", "dose"]:
+            df[c] = df[c].fillna("").astype(str).str.strip()
+        self.df = df
+        self.pos = {k: i for i, k in enumerate(df["key"].tolist())}
+
+        self._prefix = {}
+        text = (df["generic"] + " " + df["brand"] + " " + df["dosage_form"] + " " + df["dose"]).tolist()
+        for i, t in enumerate(text):
+            for token in set(tokenize(t)):
+                for n in range(1, len(token) + 1):
+                    self._prefix.setdefault(token[:n], set()).add(i)
+
+        # Default ordering: in stock first, then alphabetical
+        self._order = sorted(range(len(df)), key=lambda i: (
+            df.at[i, "stock_qty"] <= 0, df.at[i, "generic"].lower(), df.at[i, "brand"].lower()
+        ))
+        self._rank = {row: r for r, row in enumerate(self._order)}
+
+    def __len__(self):
+        return len(self.df)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Stock keys whose generic/brand/form/dose match every word of `query` (prefix match)."""
+        tokens = tokenize(query)
+        if not tokens:
+            rows = self._order[:limit]
+        else:
+            sets = sorted((self._prefix.get(t, set()) for t in tokens), key=len)
+            hits = set(sets[0]).intersection(*sets[1:]) if sets[0] else set()
+            first = tokens[0]
+            rows = sorted(hits, key=lambda i: (
+                self.df.at[i, "stock_qty"] <= 0,
+                not self.df.at[i, "generic"].lower().startswith(first),
+                self._rank[i],
+            ))[:limit]
+        return [self.df.at[i, "key"] for i in rows]
+
+    def row(self, key):
+        i = self.pos.get(key)
+        return None if i is None else self.df.iloc[i].to_dict()
+
+    def label(self, key):
+        r = self.row(key)
+        if r is None:
+            return str(key)
+        form = " ".join(x for x in [r["dosage_form"], r["dose"]] if x)
+        exp = format_expiry(r["expiry"])
+        stock = f"{r['stock_qty']} in stock" if r["stock_qty"] > 0 else "OUT OF STOCK"
+        return f"{r['generic']} [{r['brand']}] {form} · {stock}" + (f" · exp {exp}" if exp else "")
@@ -0,0 +1,126 @@
+import math
+import re
+
+import pandas as pd
+
+# ---------- Out-of-stock Substitutes ----------
+# Built once per loaded stock frame (same lifetime as the MedicineIndex), so
+# the prescription picker and the dispensation grid can propose in-stock
+# equivalents with no extra queries. Stock rows are grouped by
+# (generic, form, dose); for an empty group the candidates are, in order:
+#
+#   same dose      another brand / batch of the same generic, form and dose
+#   other strength same generic and form, qty scaled (500mg -> 2 x 250mg)
+#   other form     tab <-> cap of the same strength, or e.g. syrup for tablets
+#                  (dose to be checked by the doctor)
+
+FORM_ALIASES = {
+    "tab": "tab", "tabs": "tab", "tablet": "tab", "tablets": "tab",
+    "cap": "cap", "caps": "cap", "capsule": "cap", "capsules": "cap",
+    "syp": "syp", "syrup": "syp", "susp": "susp", "suspension": "susp", "powd sus": "susp",
+    "drop": "drops", "drops": "drops", "inj": "inj", "injection": "inj",
+}
+SOLID_FORMS = {"tab", "cap"}
+UNIT_TO_MG = {"mg": 1.0, "mcg": 0.001, "g": 1000.0}
+DOSE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(mg|mcg|g)?\s*(?:/\s*(\d+(?:\.\d+)?)?\s*ml)?\s*$", re.I)
+DEFAULT_LIMIT = 5
+
+
+def normalize_form(form):
+    f = str(form or "").strip().lower()
+    return FORM_ALIASES.get(f, f)
+
+
+def parse_strength(dose):
+    """'500mg' -> (500.0, 'mg'); '125mg/5ml' -> (25.0, 'mg/ml'); combos/volumes -> None."""
+    m = DOSE_RE.match(str(dose or ""))
+    if not m or (m.group(2) is None and m.group(3) is None):
+        return None
+    mg = float(m.group(1)) * UNIT_TO_MG[(m.group(2) or "mg").lower()]
+    if "/" in str(dose):
+        return mg / float(m.group(3) or 1), "mg/ml"
+    return mg, "mg"
+
+
+class SubstitutionIndex:
+    def __init__(self, stock_df, today=None):
+        cols = ["key", "generic", "brand", "dosage_form", "dose", "expiry", "stock_qty"]
+        df = stock_df.reindex(columns=cols).reset_index(drop=True)
+        free = pd.to_numeric(df["stock_qty"], errors="coerce").fillna(0)
+        if "reserved_qty" in stock_df:
+            free -= pd.to_numeric(stock_df["reserved_qty"], errors="coerce").fillna(0).reset_index(drop=True)
+        exp = pd.to_datetime(df["expiry"], errors="coerce")
+        expired = exp.notna() & (exp < pd.Timestamp(today or pd.Timestamp.today().normalize()))
+        df["free"] = free.where(~expired, 0).clip(lower=0).astype(int)
+        df["g"] = df["generic"].fillna("").astype(str).str.strip().str.lower()
+        df["f"] = df["dosage_form"].map(normalize_form)
+        df["d"] = df["dose"].fillna("").astype(str).str.strip().str.lower().str.replace(" ", "", regex=False)
+        strength = df["dose"].map(parse_strength)
+        df["mg"] = strength.map(lambda s: s[0] if s else None)
+        df["unit"] = strength.map(lambda s: s[1] if s else None)
+        self.df = df
+        self.pos = {k: i for i, k in enumerate(df["key"].tolist())}
+
+        # In-stock rows per generic, most stock first
+        in_stock = df[df["free"] > 0].sort_values("free", ascending=False)
+        self._by_generic = {g: rows.index.tolist() for g, rows in in_stock.groupby("g")}
+
+    def suggest(self, key, qty=1, limit=DEFAULT_LIMIT):
+        """
+        In-stock alternatives for stock row `key`, best first:
+        [{"key", "label", "kind", "factor", "qty", "free"}]. `qty` is the
+        prescribed quantity; `qty` in the result is what to give instead.
+        """
+        i = self.pos.get(key)
+        if i is None:
+            return []
+        me = self.df.iloc[i]
+        out = []
+        for j in self._by_generic.get(me["g"], []):
+            if j == i:
+                continue
+            r = self.df.iloc[j]
+            factor = 1.0
+            both_solid = me["f"] in SOLID_FORMS and r["f"] in SOLID_FORMS
+            if r["f"] == me["f"] and r["d"] == me["d"]:
+                rank, kind = 0, "same dose"
+            elif (r["f"] == me["f"] or both_solid) and me["mg"] and r["mg"] and r["unit"] == me["unit"]:
+                factor = me["mg"] / r["mg"]
+                if both_solid and factor != int(factor) and not (factor == 0.5 and r["f"] == "tab"):
+                    continue   # can't make the dose from whole (or half) tablets
+                rank, kind = 1, "other strength" if r["f"] == me["f"] else "other form"
+            else:
+                rank, kind = 2, "other form"
+            # tablets scale with the strength; a bottle is a bottle (the dose volume changes)
+            need = None if rank >= 2 else (math.ceil(int(qty) * factor) if both_solid else int(qty))
+            if need is not None and need > r["free"]:
+                rank += 0.5   # not enough for the whole course, still worth showing
+            out.append((rank, -int(r["free"]), j, kind, factor, need))
+
+        out.sort(key=lambda t: t[:2])
+        return [{
+            "key": self.df.at[j, "key"],
+            "label": self.label(j),
+            "kind": kind,
+            "factor": factor,
+            "qty": need,
+            "free": int(self.df.at[j, "free"]),
+        } for _, _, j, kind, factor, need in out[:limit]]
+
+    def label(self, i):
+        r = self.df.iloc[i]
+        return f"{r['generic']} [{r['brand']}] {r['dosage_form']} {r['dose']}".strip()
+
+    def describe(self, suggestion):
+        """One-line text for a suggestion, e.g. 'Amoxil [GSK] Cap 250mg · 2 × per dose · give 12 (40 free)'."""
+        s = suggestion
+        parts = [s["label"]]
+        if s["factor"] != 1:
+            unit = {"tab": "tablets", "cap": "capsules"}.get(self.df.at[self.pos[s["key"]], "f"], "volume")
+            parts.append(f"{s['factor']:g} × {unit} per dose")
+        elif s["qty"] is None:
+            parts.append("other form, check dose")
+        if s["qty"] is not None:
+            parts.append(f"give {s['qty']}")
+        parts[-1] += f" ({s['free']} free)"
+        return " · ".join(parts)
@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# ---------- Patient Flow ----------
+# Where each patient is in the camp today, and how long they waited at
+# every step:
+#
+#   patient_flow          one row per patient per camp day: current state + since when
+#   patient_flow_events   one row per move, with the time spent in the state left
+#
+#   registered -> waiting_doctor -> with_doctor -> waiting_pharmacy -> done
+#              -> waiting_dental -> with_dental -> done
+#
+# The desks move patients as part of what they already do (registration,
+# triage desk, Take Next, Save Visit, dispensation, dental save), inside
+# their own transaction where they have one. Worklists read the
+# (camp_day, state, entered_at) index, so they cost O(waiting) rows.
+
+STATES = ["registered", "waiting_doctor", "with_doctor", "waiting_pharmacy",
+          "waiting_dental", "with_dental", "done"]
+
+# state -> states it may move to (a patient with no row today may enter any state)
+TRANSITIONS = {
+    "registered": {"waiting_doctor", "with_doctor", "waiting_dental", "with_dental", "waiting_pharmacy", "done"},
+    "waiting_doctor": {"with_doctor", "waiting_dental", "waiting_pharmacy", "done"},
+    "with_doctor": {"waiting_doctor", "waiting_pharmacy", "waiting_dental", "done"},
+    "waiting_dental": {"with_dental", "waiting_doctor", "done"},
+    "with_dental": {"waiting_dental", "waiting_pharmacy", "waiting_doctor", "done"},
+    "waiting_pharmacy": {"done", "waiting_doctor", "with_doctor", "waiting_dental"},
+    "done": {"waiting_doctor", "with_doctor", "waiting_dental", "with_dental", "waiting_pharmacy"},
+}
+
+# station -> the state its worklist shows
+STATIONS = {"Doctor": "waiting_doctor", "Pharmacy": "waiting_pharmacy", "Dental": "waiting_dental"}
+
+FLOW_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS patient_flow (
+        patient_id INT,
+        camp_day DATE,
+        state VARCHAR(20),
+        entered_at DATETIME,
+        PRIMARY KEY (patient_id, camp_day)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS patient_flow_events (
+        event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        patient_id INT,
+        camp_day DATE,
+        from_state VARCHAR(20),
+        to_state VARCHAR(20),
+        moved_at DATETIME,
+        waited_seconds INT,
+        username VARCHAR(100)
+    )
+    """,
+]
+
+# (table, name, columns) - created by medical_camp.init_db
+FLOW_INDEXES = [
+    ("patient_flow", "idx_flow_worklist", "camp_day, state, entered_at"),
+    ("patient_flow_events", "idx_flow_events_day", "camp_day, from_state"),
+]
+
+
+# ---------- Moves ----------
+def advance(cur, patient_id, to_state, username=None):
+    """
+    Move a patient to `to_state` inside the caller's transaction. Returns
+    False (and changes nothing) if they are already there or the move is
+    not allowed from where they are.
+    """
+    cur.execute("""
+        SELECT state, TIMESTAMPDIFF(SECOND, entered_at, NOW()) FROM patient_flow
+        WHERE patient_id = %s AND camp_day = CURDATE() FOR UPDATE
+    """, (patient_id,))
+    row = cur.fetchone()
+    if row is None:
+        from_state, waited = None, None
+        cur.execute("INSERT IGNORE INTO patient_flow (patient_id, camp_day, state, entered_at) VALUES (%s, CURDATE(), %s, NOW())",
+                    (patient_id, to_state))
+        if cur.rowcount == 0:   # another desk created today's row first
+            return advance(cur, patient_id, to_state, username)
+    else:
+        from_state, waited = row[0], row[1]
+        if from_state == to_state or to_state not in TRANSITIONS.get(from_state, ()):
+            return False
+        cur.execute("UPDATE patient_flow SET state = %s, entered_at = NOW() WHERE patient_id = %s AND camp_day = CURDATE()",
+                    (to_state, patient_id))
+    cur.execute("""
+        INSERT INTO patient_flow_events (patient_id, camp_day, from_state, to_state, moved_at, waited_seconds, username)
+        VALUES (%s, CURDATE(), %s, %s, NOW(), %s, %s)
+    """, (patient_id, from_state, to_state, waited, username))
+    return True
+
+
+def move(conn, patient_id, to_state, username=None):
+    """advance() in its own transaction, for desks with nothing else to commit."""
+    cur = conn.cursor()
+    try:
+        moved = advance(cur, patient_id, to_state, username)
+        conn.commit()
+        return moved
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def arrive_many(cur, patient_ids, username=None):
+    """Batch registration: everyone starts today as 'registered' (two statements)."""
+    ids = [int(p) for p in patient_ids if p is not None]
+    if not ids:
+        return
+    cur.executemany("INSERT IGNORE INTO patient_flow (patient_id, camp_day, state, entered_at) VALUES (%s, CURDATE(), 'registered', NOW())",
+                    [(p,) for p in ids])
+    cur.executemany("""
+        INSERT INTO patient_flow_events (patient_id, camp_day, from_state, to_state, moved_at, waited_seconds, username)
+        VALUES (%s, CURDATE(), NULL, 'registered', NOW(), NULL, %s)
+    """, [(p, username) for p in ids])
+
+
+# ---------- Reads ----------
+WORKLIST_SQL = """
+    SELECT f.patient_id, p.patient_name, f.entered_at, TIMESTAMPDIFF(SECOND, f.entered_at, NOW()) AS waited_seconds
+    FROM patient_flow f
+    JOIN patients p ON p.patient_id = f.patient_id
+    WHERE f.camp_day = CURDATE() AND f.state = %s
+    ORDER BY f.entered_at
+    LIMIT %s
+"""
+
+
+def worklist(conn, state, limit=200):
+    """Patients in `state` today, longest waiting first."""
+    df = pd.read_sql(WORKLIST_SQL, conn, params=(state, int(limit)))
+    df["waiting_min"] = (df["waited_seconds"].fillna(0) // 60).astype(int)
+    return df.drop(columns=["waited_seconds"])
+
+
+def queue_lengths(conn):
+    """{state: patients in it now} for today."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT state, COUNT(*), MAX(TIMESTAMPDIFF(SECOND, entered_at, NOW()))
+        FROM patient_flow WHERE camp_day = CURDATE() GROUP BY state
+    """)
+    out = {state: (int(n), int(longest or 0)) for state, n, longest in cur.fetchall()}
+    cur.close()
+    return out
+
+
+def wait_stats(conn):
+    """Per state: moves out today and p50 / p95 / max minutes spent in it."""
+    events = pd.read_sql("""
+        SELECT from_state AS state, waited_seconds FROM patient_flow_events
+        WHERE camp_day = CURDATE() AND from_state IS NOT NULL
+    """, conn)
+    if events.empty:
+        return pd.DataFrame(columns=["state", "moves", "p50_min", "p95_min", "max_min"])
+    minutes = events.assign(m=pd.to_numeric(events["waited_seconds"], errors="coerce") / 60).groupby("state")["m"]
+    stats = pd.DataFrame({
+        "moves": minutes.size(),
+        "p50_min": minutes.quantile(0.5),
+        "p95_min": minutes.quantile(0.95),
+        "max_min": minutes.max(),
+    }).round(1)
+    order = {s: i for i, s in enumerate(STATES)}
+    return stats.reset_index().sort_values("state", key=lambda s: s.map(order)).reset_index(drop=True)
+
+
+# ---------- Pages ----------
+def show_worklist(conn, station):
+    """Compact worklist for one station (patients waiting there, longest first)."""
+    state = STATIONS[station]
+    df = worklist(conn, state)
+    with st.expander(f"🧾 Waiting for {station} ({len(df)})", expanded=False):
+        if df.empty:
+            st.caption("Nobody waiting.")
+        else:
+            st.dataframe(df[["patient_id", "patient_name", "waiting_min"]], use_container_width=True, hide_index=True)
+    return df
+
+
+def show_flow_dashboard(conn):
+    st.header("Patient Flow")
+    st.caption("Today's patients by station. Wait = time spent in a state before moving on.")
+    lengths = queue_lengths(conn)
+    stats = wait_stats(conn).set_index("state")
+
+    cols = st.columns(len(STATIONS))
+    for col, (station, state) in zip(cols, STATIONS.items()):
+        n, longest = lengths.get(state, (0, 0))
+        p50 = stats["p50_min"].get(state, np.nan) if not stats.empty else np.nan
+        p95 = stats["p95_min"].get(state, np.nan) if not stats.empty else np.nan
+        col.metric(f"Waiting: {station}", n, help=f"Longest current wait {longest // 60} min")
+        col.caption(f"p50 {p50:g} min · p95 {p95:g} min" if not pd.isna(p50) else "No completed waits yet")
+
+    table = pd.DataFrame({"state": STATES})
+    table["now"] = table["state"].map(lambda s: lengths.get(s, (0, 0))[0])
+    table["longest_now_min"] = table["state"].map(lambda s: round(lengths.get(s, (0, 0))[1] / 60, 1))
+    if not stats.empty:
+        table = table.merge(stats.reset_index(), on="state", how="left")
+    st.dataframe(table, use_container_width=True, hide_index=True)
+
+    station = st.selectbox("Worklist", list(STATIONS), key="flow_station")
+    df = worklist(conn, STATIONS[station])
+    st.dataframe(df, use_container_width=True, hide_index=True)
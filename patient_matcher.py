@@ -0,0 +1,268 @@
+import re
+import threading
+from difflib import SequenceMatcher
+
+import streamlit as st
+
+# ---------- Duplicate Patient Matcher ----------
+# Blocking index: every patient is filed under a handful of cheap keys
+# (phonetic name + age band, phone tail, CNIC halves). A lookup only scores
+# the patients that share at least one key, so it stays in the low
+# milliseconds even with 50k+ registered patients.
+
+AGE_BAND_WIDTH = 5
+MAX_BLOCK_SIZE = 2000       # ignore blocks that grew too generic to be useful
+MATCH_THRESHOLD = 0.6
+
+_SOUNDEX_CODES = {}
+for _letters, _code in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")):
+    for _ch in _letters:
+        _SOUNDEX_CODES[_ch] = _code
+
+
+def soundex(word):
+    """Classic 4 character Soundex code ('Muhammad' and 'Mohammed' -> 'M530')."""
+    word = re.sub(r"[^a-z]", "", str(word).lower())
+    if not word:
+        return ""
+    first = word[0]
+    codes = [first.upper()]
+    last = _SOUNDEX_CODES.get(first, "")
+    for ch in word[1:]:
+        code = _SOUNDEX_CODES.get(ch, "")
+        if code and code != last:
+            codes.append(code)
+        # h and w do not separate letters with the same code, vowels do
+        if ch not in "hw":
+            last = code
+        if len(codes) == 4:
+            break
+    return "".join(codes).ljust(4, "0")
+
+
+def normalize_name(name):
+    return " ".join(re.sub(r"[^a-z\s]", " ", str(name or "").lower()).split())
+
+
+def name_key(name):
+    """Order-insensitive phonetic key of all name tokens."""
+    codes = sorted(soundex(t) for t in normalize_name(name).split())
+    return "-".join(c for c in codes if c)
+
+
+def phone_digits(phone):
+    return re.sub(r"\D", "", str(phone or ""))
+
+
+def cnic_digits(cnic):
+    """Digits of a real CNIC; camp placeholders (NO-ID-xxxxxx) give ''."""
+    cnic = str(cnic or "")
+    if cnic.upper().startswith("NO-ID"):
+        return ""
+    digits = re.sub(r"\D", "", cnic)
+    return digits if len(digits) == 13 else ""
+
+
+def age_band(age):
+    try:
+        return int(age) // AGE_BAND_WIDTH
+    except (TypeError, ValueError):
+        return None
+
+
+def blocking_keys(name, cnic, phone, age, neighbours=False):
+    """
+    Keys a patient is filed under. With neighbours=True the adjacent age
+    bands are included as well, so a query tolerates a slightly wrong age.
+    """
+    keys = set()
+
+    nk = name_key(name)
+    band = age_band(age)
+    if nk:
+        if band is None:
+            keys.add(f"n:{nk}")
+        else:
+            bands = (band - 1, band, band + 1) if neighbours else (band,)
+            keys.update(f"na:{nk}:{b}" for b in bands)
+
+    digits = phone_digits(phone)
+    if len(digits) >= 7:
+        keys.add(f"p:{digits[-7:]}")
+
+    # Two halves of the CNIC: a single mistyped digit still leaves one intact
+    cd = cnic_digits(cnic)
+    if cd:
+        keys.add(f"c1:{cd[:7]}")
+        keys.add(f"c2:{cd[7:]}")
+
+    return keys
+
+
+class DuplicateIndex:
+    """In-memory blocking index over the patients table, updated on insert."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._patients = {}
+        # Only advanced by sync_duplicate_index, so rows inserted out of order
+        # by other desks are never skipped (re-adding a row is harmless).
+        self.last_patient_id = 0
+
+    def __len__(self):
+        return len(self._patients)
+
+    def patient_ids(self):
+        with self._lock:
+            return list(self._patients)
+
+    def add(self, patient_id, name, cnic="", phone="", age=None, gender=""):
+        patient_id = int(patient_id)
+        record = {
+            "patient_id": patient_id,
+            "patient_name": name,
+            "cnic": cnic,
+            "phone": phone,
+            "age": age,
+            "gender": gender,
+            "_name": normalize_name(name),
+            "_phone": phone_digits(phone),
+            "_cnic": cnic_digits(cnic),
+            "_keys": blocking_keys(name, cnic, phone, age),
+        }
+        with self._lock:
+            old = self._patients.get(patient_id)
+            if old:
+                self._drop_keys(old)
+            self._patients[patient_id] = record
+            for k in record["_keys"]:
+                self._blocks.setdefault(k, set()).add(patient_id)
+
+    def refile(self, patient_id, **changes):
+        """Re-file an indexed patient after an UPDATE of some columns (patient_name=..., age=...)."""
+        with self._lock:
+            old = self._patients.get(int(patient_id))
+        if old is None:
+            return False
+        fields = {k: old[k] for k in ("patient_name", "cnic", "phone", "age", "gender")}
+        fields.update(changes)
+        self.add(patient_id, fields["patient_name"], fields["cnic"], fields["phone"], fields["age"], fields["gender"])
+        return True
+
+    def discard(self, patient_id):
+        with self._lock:
+            old = self._patients.pop(int(patient_id), None)
+            if old:
+                self._drop_keys(old)
+
+    def _drop_keys(self, record):
+        for k in record["_keys"]:
+            block = self._blocks.get(k)
+            if block:
+                block.discard(record["patient_id"])
+                if not block:
+                    del self._blocks[k]
+
+    def find_matches(self, name, cnic="", phone="", age=None, gender="", limit=5):
+        """Return likely existing patients as a list of dicts, best first."""
+        query_keys = blocking_keys(name, cnic, phone, age, neighbours=True)
+
+        with self._lock:
+            candidate_ids = set()
+            for k in query_keys:
+                block = self._blocks.get(k)
+                if block and len(block) <= MAX_BLOCK_SIZE:
+                    candidate_ids.update(block)
+            candidates = [self._patients[pid] for pid in candidate_ids]
+
+        q_name = normalize_name(name)
+        q_phone = phone_digits(phone)
+        q_cnic = cnic_digits(cnic)
+
+        matches = []
+        for rec in candidates:
+            score, reasons = _score(rec, q_name, q_phone, q_cnic, age, gender)
+            if score >= MATCH_THRESHOLD:
+                matches.append({
+                    "patient_id": rec["patient_id"],
+                    "patient_name": rec["patient_name"],
+                    "cnic": rec["cnic"],
+                    "phone": rec["phone"],
+                    "age": rec["age"],
+                    "gender": rec["gender"],
+                    "score": round(score, 2),
+                    "reason": ", ".join(reasons),
+                })
+
+        matches.sort(key=lambda m: (-m["score"], -m["patient_id"]))
+        return matches[:limit]
+
+
+def _score(rec, q_name, q_phone, q_cnic, age, gender):
+    reasons = []
+    score = 0.0
+
+    if q_cnic and rec["_cnic"]:
+        mismatches = sum(a != b for a, b in zip(q_cnic, rec["_cnic"]))
+        if mismatches == 0:
+            return 1.0, ["same CNIC"]
+        if mismatches == 1:
+            score += 0.3
+            reasons.append("CNIC differs by 1 digit")
+
+    name_sim = SequenceMatcher(None, q_name, rec["_name"]).ratio() if q_name and rec["_name"] else 0.0
+    score += 0.6 * name_sim
+    if name_sim >= 0.8:
+        reasons.append("similar name")
+
+    if q_phone and len(q_phone) >= 7 and rec["_phone"][-7:] == q_phone[-7:]:
+        score += 0.3
+        reasons.append("same phone")
+
+    try:
+        age_diff = abs(int(age) - int(rec["age"]))
+        if age_diff <= 2:
+            score += 0.1
+            reasons.append("age match")
+        elif age_diff > 10:
+            score -= 0.2
+    except (TypeError, ValueError):
+        pass
+
+    if gender and rec["gender"] and gender != rec["gender"]:
+        score -= 0.3
+
+    return min(score, 1.0), reasons
+
+
+@st.cache_resource
+def get_duplicate_index():
+    """One index per server process, shared by every session."""
+    return DuplicateIndex()
+
+
+def sync_duplicate_index(index, conn):
+    """
+    Pull in patients inserted since the last sync (by any desk or process).
+    Updates made by this process are re-filed by the caller (refile); rows
+    deleted elsewhere are noticed by a primary-key count and dropped.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM patients WHERE patient_id <= %s", (index.last_patient_id,))
+    indexed = [pid for pid in index.patient_ids() if pid <= index.last_patient_id]
+    if cur.fetchone()[0] != len(indexed):
+        cur.execute("SELECT patient_id FROM patients WHERE patient_id <= %s", (index.last_patient_id,))
+        live = {int(r[0]) for r in cur.fetchall()}
+        for pid in indexed:
+            if pid not in live:
+                index.discard(pid)
+    cur.execute(
+        "SELECT patient_id, patient_name, cnic, phone, age, gender FROM patients WHERE patient_id > %s",
+        (index.last_patient_id,)
+    )
+    for row in cur.fetchall():
+        index.add(*row)
+        index.last_patient_id = max(index.last_patient_id, int(row[0]))
+    cur.close()
+    return index
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+import prescriptions as rx
+
+# ---------- Per-patient Timeline ----------
+# Everything the camp has recorded for one patient, newest first:
+#
+#   medical visits   visits         (patient_id, visit_date) index
+#   dental visits    dental_visits  (patient_id, visit_date) index
+#   dispensations    stock_movements of kind 'dispense', by visit_id index
+#
+# Timelines are cached per patient_id in the server process. Every desk that
+# writes a visit or a dispensation calls invalidate(patient_id) after its
+# commit; entries also expire after MAX_AGE_SECONDS in case another process
+# wrote. The cache is an LRU bounded by MAX_PATIENTS. Loads run outside the
+# lock, so each invalidate() bumps a per-patient generation and a load that
+# raced with one is returned but not cached.
+
+MAX_PATIENTS = 500
+MAX_AGE_SECONDS = 300
+
+# (table, name, columns) - created by medical_camp.init_db (dental_visits only if it exists)
+TIMELINE_INDEXES = [
+    ("visits", "idx_visits_patient_date", "patient_id, visit_date"),
+    ("dental_visits", "idx_dental_patient_date", "patient_id, visit_date"),
+    ("stock_movements", "idx_movements_visit", "visit_id"),
+]
+
+MEDICAL_SQL = """
+    SELECT visit_id, visit_date, doctor_type, history, bp, bp_sys, bp_dia, heart_rate, sat_o2, temp, rr, blood_glucose,
+           symptoms, indications, medicines, dispensed, dispensed_details
+    FROM visits WHERE patient_id = %s
+    ORDER BY visit_date DESC
+"""
+DENTAL_SQL = """
+    SELECT visit_id, visit_date, doctor_name, presenting_complaint, provisional_diagnosis, medicines, dispensed
+    FROM dental_visits WHERE patient_id = %s
+    ORDER BY visit_date DESC
+"""
+DISPENSED_SQL = """
+    SELECT m.visit_id, MAX(m.moved_at) AS dispensed_at, -SUM(m.qty) AS units
+    FROM visits v
+    JOIN stock_movements m ON m.visit_id = v.visit_id
+    WHERE v.patient_id = %s AND m.kind = 'dispense'
+    GROUP BY m.visit_id
+"""
+
+TIMELINE_COLUMNS = ["when", "event", "visit_id", "summary"]
+
+def _split(text):
+    return [s.strip() for s in str(text or "").split(";") if s.strip()]
+
+
+def _tag(prefix, value):
+    return f"{prefix}{value}" if isinstance(value, str) and value.strip() else ""
+
+
+def _join(*parts):
+    return " · ".join(p for p in parts if p)
+
+
+class Timeline:
+    def __init__(self, medical, dental, dispensed, last_rx):
+        self.medical = medical
+        self.last_rx = last_rx     # prescription lines of the latest medical visit
+        self.loaded_at = time.monotonic()
+        self.events = self._events(medical, dental, dispensed)
+
+    @staticmethod
+    def _events(medical, dental, dispensed):
+        rows = []
+        for v in medical.itertuples(index=False):
+            rows.append((v.visit_date, "Medical visit", v.visit_id,
+                         _join(_tag("", v.doctor_type), _tag("Dx: ", v.indications), _tag("Rx: ", v.medicines))))
+        for d in dental.itertuples(index=False):
+            rows.append((d.visit_date, "Dental visit", d.visit_id,
+                         _join(_tag("", d.presenting_complaint), _tag("Dx: ", d.provisional_diagnosis),
+                               _tag("Rx: ", d.medicines))))
+        # dispensations from the ledger; visits dispensed before it existed show at the visit time
+        details = dict(zip(medical["visit_id"], medical["dispensed_details"]))
+        in_ledger = set()
+        for m in dispensed.itertuples(index=False):
+            in_ledger.add(m.visit_id)
+            rows.append((m.dispensed_at, "Dispensed", m.visit_id,
+                         _tag("", details.get(m.visit_id)) or f"{int(m.units or 0)} units"))
+        for v in medical.itertuples(index=False):
+            if v.dispensed == "Yes" and v.visit_id not in in_ledger:
+                rows.append((v.visit_date, "Dispensed", v.visit_id, _tag("", v.dispensed_details)))
+        events = pd.DataFrame(rows, columns=TIMELINE_COLUMNS)
+        events["when"] = pd.to_datetime(events["when"])
+        return events.sort_values("when", ascending=False, ignore_index=True)
+
+    def __len__(self):
+        return len(self.events)
+
+    def last_visit(self):
+        """
+        Latest medical visit as form values: {"visit_date", "vitals", "diagnoses",
+        "medicines": [{"key", "frequency", "time", "amount"}]}, or None for a first visit.
+        """
+        if self.medical.empty:
+            return None
+        v = self.medical.iloc[0]
+        vitals = {c: v[c] for c in ["bp_sys", "bp_dia", "heart_rate", "sat_o2", "temp", "rr", "blood_glucose"]
+                  if pd.notna(v[c]) and v[c] > 0}
+        medicines = [{"key": r.stock_key, "frequency": r.frequency, "time": r.time_of_day, "amount": r.amount}
+                     for r in self.last_rx.itertuples(index=False) if r.stock_key]
+        return {"visit_date": v["visit_date"], "vitals": vitals,
+                "diagnoses": _split(v["indications"]), "medicines": medicines}
+
+
+def load_timeline(conn, patient_id):
+    """Indexed reads for one patient (plus the latest visit's prescription lines)."""
+    medical = pd.read_sql(MEDICAL_SQL, conn, params=(patient_id,))
+    try:
+        dental = pd.read_sql(DENTAL_SQL, conn, params=(patient_id,))
+    except Exception:
+        # dental_visits belongs to the dental app and may not exist yet
+        dental = pd.DataFrame(columns=["visit_id", "visit_date", "doctor_name", "presenting_complaint",
+                                       "provisional_diagnosis", "medicines", "dispensed"])
+    dispensed = pd.read_sql(DISPENSED_SQL, conn, params=(patient_id,))
+    last_rx = rx.load_prescriptions(conn, medical["visit_id"].iloc[0]) if not medical.empty else pd.DataFrame(columns=rx.COLUMNS)
+    return Timeline(medical, dental, dispensed, last_rx)
+
+
+class TimelineCache:
+    def __init__(self, max_patients=MAX_PATIENTS, max_age=MAX_AGE_SECONDS):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # patient_id -> Timeline, least recently used first
+        self._generations = {}          # patient_id -> invalidate() count
+        self.max_patients = max_patients
+        self.max_age = max_age
+
+    def get(self, conn, patient_id):
+        patient_id = int(patient_id)
+        with self._lock:
+            timeline = self._entries.get(patient_id)
+            if timeline is not None and time.monotonic() - timeline.loaded_at < self.max_age:
+                self._entries.move_to_end(patient_id)
+                return timeline
+            generation = self._generations.get(patient_id, 0)
+        timeline = load_timeline(conn, patient_id)
+        with self._lock:
+            if self._generations.get(patient_id, 0) != generation:
+                return timeline   # invalidated while loading: may predate that write
+            self._entries[patient_id] = timeline
+            self._entries.move_to_end(patient_id)
+            while len(self._entries) > self.max_patients:
+                self._entries.popitem(last=False)
+        return timeline
+
+    def invalidate(self, patient_id):
+        patient_id = int(patient_id)
+        with self._lock:
+            self._entries.pop(patient_id, None)
+            self._generations[patient_id] = self._generations.get(patient_id, 0) + 1
+
+
+@st.cache_resource
+def get_timeline_cache():
+    """One cache per server process, shared by every session."""
+    return TimelineCache()
+
+
+# ---------- View ----------
+def show_timeline(timeline):
+    """Collapsed 'previous visits' list for the selected patient."""
+    label = f"🕘 Previous visits & dispensations ({len(timeline)})"
+    with st.expander(label, expanded=False):
+        if not len(timeline):
+            st.caption("First visit.")
+            return
+        events = timeline.events.copy()
+        events["when"] = events["when"].dt.strftime("%d-%b-%Y %H:%M")
+        st.dataframe(events, use_container_width=True, hide_index=True)
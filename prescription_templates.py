@@ -0,0 +1,131 @@
+import threading
+from collections import Counter
+
+import streamlit as st
+
+import camp_queries as q
+from medicine_substitutes import normalize_form
+
+# ---------- Prescription Templates ----------
+# Mined from past visits: for each diagnosis, the medicines usually
+# prescribed with it and their usual frequency / duration. A medicine is
+# identified by generic + form + dose (taken from visits.medicine_keys), or
+# by the generic alone for visits saved before keys were stored.
+#
+# Counts are updated per visit (on save and by sync, like the symptom
+# index). build_template() turns the counts into a template of medicines
+# with free stock; the page caches those per loaded stock frame.
+
+MIN_VISITS = 3          # diagnosis needs this many visits before it gets a template
+MIN_SHARE = 0.3         # medicine must be in >= 30% of those visits
+MAX_ITEMS = 5
+
+
+def item_id(key, generic):
+    """(generic, form, dose) from a stock key, or (generic, '', '') without one."""
+    parts = [p.strip().lower() for p in str(key or "").split("||")]
+    if len(parts) >= 4 and parts[0]:
+        return parts[0], normalize_form(parts[2]), parts[3].replace(" ", "")
+    return str(generic).strip().lower(), "", ""
+
+
+def parse_prescription(medicines, medicine_keys):
+    """visits.medicines + medicine_keys -> [(item_id, frequency, amount)]."""
+    lines = [m.strip() for m in str(medicines or "").split(";") if m.strip()]
+    keys = [k.strip() for k in str(medicine_keys or "").split(";")]
+    out = []
+    for i, line in enumerate(lines):
+        generic, _, details = q.parse_medicine_line(line)
+        freq, _, amount = details.partition(",")
+        out.append((item_id(keys[i] if i < len(keys) else "", generic), freq.strip(), amount.strip()))
+    return out
+
+
+class PrescriptionPatterns:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.visits = Counter()     # diagnosis -> visits with a prescription
+        self.items = {}             # diagnosis -> Counter(item_id)
+        self.regimens = {}          # (diagnosis, item_id) -> Counter((frequency, amount))
+        self._seen = set()
+        self.last_visit_id = 0
+        self.version = 0            # bumped on every added visit
+
+    def add(self, visit_id, diagnoses, prescription):
+        if not diagnoses or not prescription:
+            return
+        with self._lock:
+            if visit_id in self._seen:
+                return
+            self._seen.add(visit_id)
+            for d in set(diagnoses):
+                self.visits[d] += 1
+                counts = self.items.setdefault(d, Counter())
+                for item, freq, amount in {p[0]: p for p in prescription}.values():
+                    counts[item] += 1
+                    self.regimens.setdefault((d, item), Counter())[(freq, amount)] += 1
+            self.version += 1
+
+    def pattern(self, diagnosis):
+        """[(item_id, frequency, amount, share)] most common first, or [] if too few visits."""
+        with self._lock:
+            n = self.visits.get(diagnosis, 0)
+            if n < MIN_VISITS:
+                return []
+            out = []
+            for item, count in self.items[diagnosis].most_common():
+                if count / n < MIN_SHARE:
+                    break
+                (freq, amount), _ = self.regimens[(diagnosis, item)].most_common(1)[0]
+                out.append((item, freq, amount, count / n))
+            return out
+
+
+@st.cache_resource
+def get_prescription_patterns():
+    """One set of patterns per server process, shared by every session."""
+    return PrescriptionPatterns()
+
+
+def sync_prescription_patterns(patterns, conn):
+    """Pull in visits saved since the last sync (by any desk or process)."""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT visit_id, indications, medicines, medicine_keys FROM visits WHERE visit_id > %s ORDER BY visit_id",
+        (patterns.last_visit_id,)
+    )
+    for visit_id, indications, medicines, keys in cur.fetchall():
+        diagnoses = [x.strip() for x in str(indications or "").split(";") if x.strip()]
+        patterns.add(int(visit_id), diagnoses, parse_prescription(medicines, keys))
+        patterns.last_visit_id = max(patterns.last_visit_id, int(visit_id))
+    cur.close()
+    return patterns
+
+
+# ---------- Templates against the current stock ----------
+def _in_stock_key(sub_index, item):
+    """Stock key with the most free units for this item (same generic/form/dose), or None."""
+    df = sub_index.df
+    g, f, d = item
+    mask = (df["g"] == g) & (df["free"] > 0)
+    if f:
+        mask &= (df["f"] == f) & (df["d"] == d)
+    rows = df[mask]
+    if rows.empty:
+        return None
+    return rows.loc[rows["free"].idxmax(), "key"]
+
+
+def build_template(patterns, sub_index, diagnosis):
+    """
+    {"items": [{"key", "frequency", "amount", "share"}], "missing": [generic, ...]}
+    with only medicines that have free stock right now.
+    """
+    items, missing = [], []
+    for item, freq, amount, share in patterns.pattern(diagnosis)[:MAX_ITEMS]:
+        key = _in_stock_key(sub_index, item)
+        if key is None:
+            missing.append(item[0].title())
+        else:
+            items.append({"key": key, "frequency": freq, "amount": amount, "share": share})
+    return {"items": items, "missing": missing}
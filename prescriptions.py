@@ -0,0 +1,120 @@
+import pandas as pd
+
+import camp_queries as q
+import stock_holds as holds
+
+# ---------- Structured Prescriptions ----------
+# One row per prescribed medicine, written by Save Visit in the visit's
+# transaction:
+#
+#   visit_prescriptions   (visit_id, line_no) -> stock key, generic, brand,
+#                         frequency, time, amount, qty to dispense
+#
+# Pharmacy loads a visit's lines with one primary-key range read instead of
+# taking visits.medicines apart again on every rerun. visits.medicines /
+# medicine_keys are still written for the record pages, CSV export and
+# search. Visits saved before this table existed are converted from those
+# strings once: all of them when the table is created, and any stragglers
+# (rows written by older app versions) the first time pharmacy opens them.
+
+PRESCRIPTIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS visit_prescriptions (
+        visit_id INT,
+        line_no INT,
+        stock_key VARCHAR(255),
+        generic VARCHAR(255),
+        brand VARCHAR(255),
+        frequency VARCHAR(50),
+        time_of_day VARCHAR(50),
+        amount VARCHAR(50),
+        qty INT,
+        PRIMARY KEY (visit_id, line_no)
+    )
+"""
+
+COLUMNS = ["line_no", "stock_key", "generic", "brand", "frequency", "time_of_day", "amount", "qty"]
+
+INSERT_SQL = f"""
+    INSERT INTO visit_prescriptions (visit_id, {', '.join(COLUMNS)})
+    VALUES (%s, {', '.join(['%s'] * len(COLUMNS))})
+"""
+LOAD_SQL = f"SELECT {', '.join(COLUMNS)} FROM visit_prescriptions WHERE visit_id = %s ORDER BY line_no"
+
+# Visits with a prescription string but no structured lines yet
+UNCONVERTED_SQL = """
+    SELECT v.visit_id, v.medicines, v.medicine_keys
+    FROM visits v
+    LEFT JOIN visit_prescriptions p ON p.visit_id = v.visit_id AND p.line_no = 0
+    WHERE p.visit_id IS NULL AND v.medicines IS NOT NULL AND v.medicines <> ''
+"""
+
+
+def prescription_rows(medicines):
+    """prescription_builder() medicines -> COLUMNS tuples (qty = units the prescription needs)."""
+    return [
+        (i, m["key"], m["generic"], m["brand"], m["frequency"], m.get("time"), m["amount"],
+         holds.estimate_qty(m["frequency"], m["amount"], m.get("dosage_form")))
+        for i, m in enumerate(medicines)
+    ]
+
+
+def insert_prescriptions(cur, visit_id, rows):
+    """Write a visit's lines (one executemany) inside the caller's transaction."""
+    if rows:
+        cur.executemany(INSERT_SQL, [(visit_id,) + tuple(r) for r in rows])
+
+
+def delete_prescriptions(cur, visit_ids):
+    """Lines of deleted visits, inside the caller's delete transaction."""
+    if visit_ids:
+        cur.execute(f"DELETE FROM visit_prescriptions WHERE visit_id IN ({', '.join(['%s'] * len(visit_ids))})",
+                    tuple(int(v) for v in visit_ids))
+
+
+# ---------- Migration from visits.medicines ----------
+def rows_from_strings(medicines, medicine_keys, forms=None):
+    """Old 'Generic [Brand] (freq, amount); ...' + keys -> COLUMNS tuples (time unknown)."""
+    keys = [k.strip() for k in str(medicine_keys or "").split(";")]
+    rows = []
+    for i, line in enumerate(l.strip() for l in str(medicines or "").split(";") if l.strip()):
+        generic, brand, details = q.parse_medicine_line(line)
+        freq, _, amount = (s.strip() for s in details.partition(","))
+        key = keys[i] if i < len(keys) and keys[i] else None
+        form = (forms or {}).get(key, "")
+        rows.append((i, key, generic, brand, freq, None, amount, holds.estimate_qty(freq, amount, form)))
+    return rows
+
+
+def convert_visits(cur, visit_ids=None):
+    """Structured lines for old visits (all unconverted ones, or just `visit_ids`). Returns visits converted."""
+    sql, params = UNCONVERTED_SQL, ()
+    if visit_ids is not None:
+        if not visit_ids:
+            return 0
+        sql += f" AND v.visit_id IN ({', '.join(['%s'] * len(visit_ids))})"
+        params = tuple(int(v) for v in visit_ids)
+    cur.execute(sql, params)
+    todo = cur.fetchall()
+    if not todo:
+        return 0
+    cur.execute("SELECT `key`, dosage_form FROM stock")
+    forms = dict(cur.fetchall())
+    lines = []
+    for visit_id, medicines, medicine_keys in todo:
+        lines += [(visit_id,) + r for r in rows_from_strings(medicines, medicine_keys, forms)]
+    cur.executemany(INSERT_SQL, lines)
+    return len(todo)
+
+
+# ---------- Reads ----------
+def load_prescriptions(conn, visit_id):
+    """A visit's lines in prescription order; converts the visit first if it predates the table."""
+    df = pd.read_sql(LOAD_SQL, conn, params=(int(visit_id),))
+    if df.empty:
+        cur = conn.cursor()
+        if convert_visits(cur, [visit_id]):
+            conn.commit()
+            df = pd.read_sql(LOAD_SQL, conn, params=(int(visit_id),))
+        cur.close()
+    df["qty"] = pd.to_numeric(df["qty"], errors="coerce").fillna(0).astype(int)
+    return df
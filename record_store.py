@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+# ---------- Append-only Record Store ----------
+# Replaces the "read whole CSV -> concat -> write whole CSV" pattern of the
+# standalone app. Every change is one JSON line appended (and fsync'd) to a
+# journal, so a save is O(1) and a crash can at worst lose the line being
+# written. The journal is periodically folded into a snapshot file.
+#
+# All journal operations are idempotent (put / patch with absolute values /
+# delete), so replaying a journal on top of a newer snapshot is harmless.
+
+
+class RecordStore:
+    def __init__(self, base_path, key_field, compact_every=1000):
+        self.key_field = key_field
+        self.snapshot_path = f"{base_path}.snapshot.jsonl"
+        self.journal_path = f"{base_path}.journal.jsonl"
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._records = {}          # in-memory index: key -> record dict
+        self._journal_ops = 0
+        self._journal = None
+        self._load()
+
+    # ---------- loading ----------
+    def _load(self):
+        for rec, _ in _read_jsonl(self.snapshot_path):
+            self._records[str(rec[self.key_field])] = rec
+        good_bytes = 0
+        for op, end in _read_jsonl(self.journal_path):
+            self._apply(op)
+            self._journal_ops += 1
+            good_bytes = end
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > good_bytes:
+            # Cut off a torn tail so new appends don't land behind it
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_bytes)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _apply(self, op):
+        key = str(op["key"])
+        if op["op"] == "put":
+            self._records[key] = op["record"]
+        elif op["op"] == "patch":
+            if key in self._records:
+                self._records[key] = {**self._records[key], **op["changes"]}
+        elif op["op"] == "delete":
+            self._records.pop(key, None)
+
+    # ---------- writes ----------
+    def _append(self, op):
+        with self._lock:
+            self._journal.write(json.dumps(op, default=str) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._apply(op)
+            self._journal_ops += 1
+            if self._journal_ops >= self.compact_every:
+                self._compact_locked()
+
+    def put(self, record):
+        """Insert or replace a whole record."""
+        record = {k: _plain(v) for k, v in record.items()}
+        self._append({"op": "put", "key": str(record[self.key_field]), "record": record})
+
+    def patch(self, key, changes):
+        """Set some fields of an existing record (values must be absolute, not deltas)."""
+        changes = {k: _plain(v) for k, v in changes.items()}
+        self._append({"op": "patch", "key": str(key), "changes": changes})
+
+    def delete(self, key):
+        self._append({"op": "delete", "key": str(key)})
+
+    # ---------- compaction ----------
+    def compact(self):
+        with self._lock:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        # 1. Write the full state to a temp file and atomically swap it in
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for rec in self._records.values():
+                f.write(json.dumps(rec, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+        # 2. Only then start a fresh journal (a crash in between just replays it)
+        self._journal.close()
+        self._journal = open(self.journal_path, "w", encoding="utf-8")
+        self._journal_ops = 0
+
+    # ---------- reads ----------
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return str(key) in self._records
+
+    def get(self, key):
+        return self._records.get(str(key))
+
+    def keys(self):
+        return list(self._records.keys())
+
+    def to_dataframe(self, columns=None):
+        with self._lock:
+            rows = list(self._records.values())
+        return pd.DataFrame(rows, columns=columns)
+
+    # ---------- conversion ----------
+    def import_dataframe(self, df):
+        """Bulk load rows (e.g. a legacy CSV) straight into a new snapshot."""
+        with self._lock:
+            for rec in df.to_dict("records"):
+                rec = {k: _plain(v) for k, v in rec.items()}
+                self._records[str(rec[self.key_field])] = rec
+            self._compact_locked()
+
+
+def import_csv(csv_path, store, **read_csv_kwargs):
+    """One-off converter from an existing records CSV into a RecordStore."""
+    df = pd.read_csv(csv_path, **read_csv_kwargs)
+    store.import_dataframe(df)
+    return len(df)
+
+
+def _read_jsonl(path):
+    """Yield (object, end_offset) per line, stopping at the first torn line."""
+    if not os.path.exists(path):
+        return
+    offset = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break  # torn last line from a crash mid-write
+            try:
+                obj = json.loads(raw.decode("utf-8")) if raw.strip() else None
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                break
+            offset += len(raw)
+            if obj is not None:
+                yield obj, offset
+
+
+def _plain(value):
+    """numpy scalars -> python scalars so json can store them."""
+    if hasattr(value, "item"):
+        return value.item()
+    return value
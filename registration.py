@@ -4,6 +4,10 @@ import pandas as pd
 import os
 import random
 import re
+from patient_matcher import get_duplicate_index, sync_duplicate_index
+import instrumentation as perf
+import triage_queue as triage
+import patient_flow as flow
 
 # ------------------- Input Validation Helper -------------------
 def validate_patient_inputs(name, cnic, nationality, address, phone, gender, age):
@@ -52,18 +56,19 @@ def validate_patient_inputs(name, cnic, nationality, address, phone, gender, age
     return True, formatted_cnic
 
 # Database Configuration
+# (EMR_DB_* environment variables override these, same as medical_camp.py)
 db_config = {
-    "host": "localhost",
-    "user": "root",
-    "port": 3306,
-    "password": "umerEMR123@",
-    "database": "emr_system",
+    "host": os.environ.get("EMR_DB_HOST", "localhost"),
+    "user": os.environ.get("EMR_DB_USER", "root"),
+    "port": int(os.environ.get("EMR_DB_PORT", 3306)),
+    "password": os.environ.get("EMR_DB_PASSWORD", "umerEMR123@"),
+    "database": os.environ.get("EMR_DB_NAME", "emr_system"),
     "connection_timeout": 5
 }
 
 def get_connection():
     try:
-        return mysql.connector.connect(**db_config)
+        return perf.connect(mysql.connector.connect, **db_config)
     except Exception as e:
         st.error(f"MySQL connection failed: {e}")
         st.stop()
@@ -87,6 +92,337 @@ def init_db():
     conn.commit()
     conn.close()
 
+def register_patient(patient, dup_index=None):
+    """Insert one patient row and file it in the duplicate index. Returns the new ID or None."""
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        # We removed the Check/Update logic. We ONLY Insert now.
+        # This allows duplicates or default CNICs.
+        c.execute("""
+            INSERT INTO patients (patient_name, cnic, nationality, address, phone, gender, age)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (patient["patient_name"], patient["cnic"], patient["nationality"], patient["address"],
+              patient["phone"], patient["gender"], patient["age"]))
+
+        new_id = c.lastrowid
+        flow.advance(c, new_id, "registered", st.session_state.get("username"))
+        conn.commit()
+        if dup_index is not None:
+            dup_index.add(new_id, patient["patient_name"], patient["cnic"], patient["phone"], patient["age"], patient["gender"])
+        st.success(f"✅ Registered: {patient['patient_name']} (ID: {new_id}) - CNIC: {patient['cnic']}")
+        return new_id
+
+    except mysql.connector.Error as err:
+        # If you forgot to run the SQL command in Step 1, this error will pop up
+        if err.errno == 1062: # Duplicate entry error code
+            st.error("⚠️ Database Error: The 'CNIC' column is still set to UNIQUE in MySQL.")
+            st.code("ALTER TABLE patients DROP INDEX cnic;")
+            st.info("Run the code above in MySQL Workbench to fix this.")
+        else:
+            st.error(f"Database Error: {err}")
+        return None
+    finally:
+        conn.close()
+
+# ------------------- Batch Registration -------------------
+BATCH_COLUMNS = ["patient_name", "cnic", "nationality", "address", "phone", "gender", "age"]
+BATCH_CHUNK_SIZE = 500  # rows per INSERT statement (keeps us under max_allowed_packet)
+
+
+class BatchIdMismatch(RuntimeError):
+    """A multi-row INSERT did not get consecutive IDs; the batch was rolled back and can be retried."""
+
+
+# Accepted CSV headers for pre-registered attendee lists
+CSV_COLUMN_ALIASES = {
+    "name": "patient_name", "patient name": "patient_name", "patient_name": "patient_name",
+    "cnic": "cnic", "id": "cnic", "nationality": "nationality", "address": "address",
+    "phone": "phone", "phone number": "phone", "mobile": "phone",
+    "gender": "gender", "sex": "gender", "age": "age",
+}
+GENDER_ALIASES = {"m": "Male", "male": "Male", "f": "Female", "female": "Female", "o": "Other", "other": "Other"}
+
+def read_attendee_csv(uploaded_file):
+    """Read a pre-registration CSV into staging rows (list of dicts)."""
+    df = pd.read_csv(uploaded_file, dtype=str).fillna("")
+    df = df.rename(columns=lambda c: CSV_COLUMN_ALIASES.get(c.strip().lower(), c.strip().lower()))
+    if "patient_name" not in df.columns:
+        raise ValueError("CSV needs a 'Name' or 'Patient Name' column.")
+    for col in BATCH_COLUMNS:
+        if col not in df.columns:
+            df[col] = "Pakistani" if col == "nationality" else ""
+    return df[BATCH_COLUMNS].to_dict("records")
+
+def validate_batch(rows):
+    """
+    Run validate_patient_inputs over every staged row.
+    Returns (valid_patients, errors) where errors is a list of (row_no, message).
+    """
+    valid, errors = [], []
+    for i, r in enumerate(rows, start=1):
+        name = str(r.get("patient_name") or "")
+        if not name.strip():
+            errors.append((i, "Patient Name is required."))
+            continue
+        try:
+            age = int(float(r.get("age") or 0))
+        except (TypeError, ValueError):
+            errors.append((i, "Age must be a valid integer."))
+            continue
+        gender = GENDER_ALIASES.get(str(r.get("gender") or "").strip().lower(), str(r.get("gender") or ""))
+
+        ok, result = validate_patient_inputs(
+            name, str(r.get("cnic") or ""), str(r.get("nationality") or ""),
+            str(r.get("address") or ""), str(r.get("phone") or ""), gender, age
+        )
+        if not ok:
+            errors.append((i, result))
+            continue
+        valid.append({
+            "patient_name": name.strip(),
+            "cnic": result,
+            "nationality": str(r.get("nationality") or "").strip(),
+            "address": str(r.get("address") or "").strip(),
+            "phone": str(r.get("phone") or "").strip(),
+            "gender": gender,
+            "age": age,
+        })
+    return valid, errors
+
+def insert_patients_bulk(patients):
+    """
+    Insert all patients in one transaction using multi-row INSERTs.
+    Returns the new patient IDs in the same order as `patients`; raises
+    BatchIdMismatch (after rolling back) if the IDs cannot be trusted.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    ids = []
+    try:
+        for start in range(0, len(patients), BATCH_CHUNK_SIZE):
+            chunk = patients[start:start + BATCH_CHUNK_SIZE]
+            values_sql = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+            params = [p[col] for p in chunk for col in BATCH_COLUMNS]
+            c.execute(f"""
+                INSERT INTO patients (patient_name, cnic, nationality, address, phone, gender, age)
+                VALUES {values_sql}
+            """, params)
+
+            # MySQL reports the ID of the FIRST row of a multi-row insert; InnoDB gives
+            # the rows of one INSERT ... VALUES consecutive IDs, in order
+            first_id = c.lastrowid
+            chunk_ids = [first_id + offset for offset in range(len(chunk))]
+            c.execute(
+                "SELECT cnic FROM patients WHERE patient_id BETWEEN %s AND %s ORDER BY patient_id",
+                (chunk_ids[0], chunk_ids[-1])
+            )
+            if [row[0] for row in c.fetchall()] != [p["cnic"] for p in chunk]:
+                raise BatchIdMismatch("New patient IDs were not consecutive; nothing was registered. Please retry.")
+            ids.extend(chunk_ids)
+
+        flow.arrive_many(c, ids, st.session_state.get("username"))
+        conn.commit()
+        return ids
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def build_token_sheet(registered):
+    """Printable HTML with one queue token per registered patient."""
+    slips = "".join(f"""
+        <div style="display: inline-block; width: 30%; margin: 1%; padding: 10px; border: 2px dashed #333; text-align: center; color: black;">
+            <div style="font-size: 12px;">Medical Camp Token</div>
+            <div style="font-size: 32px; font-weight: bold;">#{r['token']}</div>
+            <div><strong>ID:</strong> {r['patient_id']}</div>
+            <div>{r['patient_name']}</div>
+            <div style="font-size: 12px;">{r['age']} / {r['gender']} &nbsp;|&nbsp; {r['cnic']}</div>
+        </div>""" for r in registered)
+    return f"""
+    <html><head><title>Registration Tokens</title></head>
+    <body onload="window.print()" style="background-color: white; font-family: Arial, sans-serif;">
+    {slips}
+    </body></html>
+    """
+
+def run_batch_registration(dup_index):
+    if "reg_batch" not in st.session_state:
+        st.session_state["reg_batch"] = []
+        st.session_state["reg_batch_version"] = 0
+
+    st.subheader("Batch Registration Queue")
+    st.caption("Stage the queue locally, then commit everyone in one go.")
+
+    # Laid out top-to-bottom, but the queue is built first so that adding
+    # a row keeps any edits already made in the table.
+    form_area = st.container()
+    import_area = st.container()
+    queue_area = st.container()
+
+    def restage(new_rows):
+        st.session_state["reg_batch"] = new_rows
+        st.session_state["reg_batch_version"] += 1
+        st.rerun()
+
+    rows = []
+    with queue_area:
+        staged = st.session_state["reg_batch"]
+        if not staged:
+            st.info("Queue is empty.")
+        else:
+            st.markdown(f"**Queued: {len(staged)}** (edit cells to fix typos before committing)")
+            edited = st.data_editor(
+                pd.DataFrame(staged, columns=BATCH_COLUMNS), num_rows="dynamic",
+                use_container_width=True, key=f"batch_editor_{st.session_state['reg_batch_version']}"
+            )
+            rows = edited.fillna("").to_dict("records")
+
+            valid, errors = validate_batch(rows)
+            for row_no, msg in errors:
+                st.error(f"Row {row_no}: {msg}")
+
+            # Flag rows that look like patients we already have
+            flagged = [p["patient_name"] for p in valid
+                       if dup_index.find_matches(p["patient_name"], p["cnic"], p["phone"], p["age"], p["gender"], limit=1)]
+            if flagged:
+                st.warning(f"⚠️ Possible existing patients in queue: {', '.join(flagged)}")
+
+            col_a, col_b = st.columns(2)
+            if col_a.button(f"✅ Commit {len(valid)} Valid Patient(s)", type="primary", disabled=not valid):
+                try:
+                    ids = insert_patients_bulk(valid)
+                except mysql.connector.Error as err:
+                    st.error(f"Database Error: {err}")
+                except BatchIdMismatch as err:
+                    st.error(f"⚠️ {err}")
+                else:
+                    registered = []
+                    for token, (pid, p) in enumerate(zip(ids, valid), start=1):
+                        if pid is not None:
+                            dup_index.add(pid, p["patient_name"], p["cnic"], p["phone"], p["age"], p["gender"])
+                        registered.append({"token": token, "patient_id": pid, **p})
+                    st.session_state["reg_batch_result"] = registered
+                    # Keep only the rows that failed validation for correction
+                    restage([rows[i - 1] for i, _ in errors])
+            if col_b.button("🗑️ Clear Queue"):
+                restage([])
+
+    # --- Add to staging list ---
+    with form_area:
+        with st.form("batch_add_form", clear_on_submit=True):
+            col1, col2 = st.columns(2)
+            with col1:
+                name = st.text_input("Patient Name")
+                nationality = st.text_input("Nationality", value="Pakistani")
+                phone = st.text_input("Phone Number")
+                age = st.number_input("Age", min_value=0, max_value=120, step=1, value=0)
+            with col2:
+                cnic = st.text_input("CNIC (Leave empty if no ID)")
+                gender = st.selectbox("Gender", ["", "Male", "Female", "Other"])
+                address = st.text_area("Address")
+            added = st.form_submit_button("➕ Add to Queue")
+        if added:
+            if not name.strip():
+                st.warning("Patient Name is required.")
+            else:
+                restage(rows + [{
+                    "patient_name": name, "cnic": cnic, "nationality": nationality,
+                    "address": address, "phone": phone, "gender": gender, "age": int(age)
+                }])
+
+    # --- Or import pre-registered attendees ---
+    with import_area:
+        with st.expander("📥 Import Pre-Registered Attendees (CSV)"):
+            uploaded = st.file_uploader("CSV with Name, CNIC, Phone, Gender, Age, ...", type=["csv"], key="batch_csv")
+            if uploaded is not None and st.button("Add CSV Rows to Queue"):
+                try:
+                    imported = read_attendee_csv(uploaded)
+                except Exception as e:
+                    st.error(f"Could not read CSV: {e}")
+                else:
+                    restage(rows + imported)
+
+    # --- Result of the last committed batch ---
+    registered = st.session_state.get("reg_batch_result")
+    if registered:
+        st.markdown("---")
+        st.success(f"✅ Registered {len(registered)} patient(s).")
+        st.dataframe(
+            pd.DataFrame(registered)[["token", "patient_id", "patient_name", "cnic", "gender", "age", "phone"]],
+            use_container_width=True, hide_index=True
+        )
+        st.download_button(
+            label="🖨️ Download & Print Tokens",
+            data=build_token_sheet(registered),
+            file_name="Registration_Tokens.html",
+            mime="text/html",
+            type="primary",
+            key="download_batch_tokens"
+        )
+
+# ------------------- Triage Desk -------------------
+TRIAGE_RECENT = 300  # patients offered in the triage picker (latest registered first)
+
+def run_triage_desk():
+    st.subheader("Triage Desk")
+    st.caption("Vitals taken here set the patient's place in the doctors' queue.")
+
+    conn = get_connection()
+    try:
+        recent = pd.read_sql("SELECT patient_id, patient_name, age FROM patients ORDER BY patient_id DESC LIMIT %s",
+                             conn, params=(TRIAGE_RECENT,))
+    finally:
+        conn.close()
+    labels = {f"{r.patient_id} - {r.patient_name}": r for r in recent.itertuples(index=False)}
+
+    with st.form("triage_form", clear_on_submit=True):
+        who = st.selectbox("Patient", [""] + list(labels))
+        c1, c2, c3, c4 = st.columns(4)
+        bp_sys = c1.number_input("BP Sys", 0)
+        bp_dia = c2.number_input("BP Dia", 0)
+        heart_rate = c3.number_input("HR (BPM)", 0)
+        temp = c4.number_input("Temp (C)", 0.0, 45.0, 0.0, step=0.1)
+        c5, c6, c7 = st.columns(3)
+        sat_o2 = c5.number_input("O2 Sat %", 0, 100, 0)
+        rr = c6.number_input("Resp Rate", 0)
+        blood_glucose = c7.number_input("Glucose (mg/dL)", 0)
+        send_to = st.radio("Send to", ["Doctor", "Dental"], horizontal=True)
+        submitted = st.form_submit_button("➕ Add to Queue")
+
+    if submitted:
+        if not who:
+            st.warning("Select a patient first.")
+        else:
+            p = labels[who]
+            username = st.session_state.get("username")
+            conn = get_connection()
+            try:
+                if send_to == "Dental":
+                    flow.move(conn, int(p.patient_id), "waiting_dental", username)
+                    st.success(f"✅ {who} sent to the dental queue.")
+                else:
+                    vitals = {"bp_sys": bp_sys, "bp_dia": bp_dia, "heart_rate": heart_rate, "temp": temp,
+                              "sat_o2": sat_o2, "rr": rr, "blood_glucose": blood_glucose}
+                    _, score = triage.enqueue(conn, int(p.patient_id), vitals, p.age)
+                    flow.move(conn, int(p.patient_id), "waiting_doctor", username)
+                    st.success(f"✅ {who} queued with priority {score}.")
+            finally:
+                conn.close()
+
+    conn = get_connection()
+    try:
+        queue = triage.get_triage_queue().sync(conn)
+    finally:
+        conn.close()
+    st.markdown(f"**Waiting for a doctor: {len(queue)}**")
+    names = dict(zip(recent["patient_id"], recent["patient_name"]))
+    waiting = queue.waiting(20)
+    if waiting:
+        st.dataframe(triage.waiting_frame(waiting, queue.last_sync, names), use_container_width=True, hide_index=True)
+
+@perf.timed_rerun("registration")
 def run_registration():
     init_db()
 
@@ -102,6 +438,22 @@ def run_registration():
     st.set_page_config(layout="centered", page_title="Patient Registration")
     st.title("🧾 Patient Registration")
 
+    # Shared duplicate index, caught up with anything other desks inserted
+    dup_index = get_duplicate_index()
+    conn = get_connection()
+    try:
+        sync_duplicate_index(dup_index, conn)
+    finally:
+        conn.close()
+
+    mode = st.radio("Registration Mode", ["Single Patient", "Batch Queue", "Triage Desk"], horizontal=True, key="reg_mode")
+    if mode == "Batch Queue":
+        run_batch_registration(dup_index)
+        return
+    if mode == "Triage Desk":
+        run_triage_desk()
+        return
+
     # --- Input Form ---
     with st.form("reg_form", clear_on_submit=True):
         col1, col2 = st.columns(2)
@@ -131,33 +483,55 @@ def run_registration():
             if not is_valid:
                 st.error(f"❌ Validation failed: {result}")
             else:
-                final_cnic = result
+                patient = {
+                    "patient_name": name.strip(),
+                    "cnic": result,
+                    "nationality": nationality.strip(),
+                    "address": address.strip(),
+                    "phone": phone.strip(),
+                    "gender": gender,
+                    "age": int(age),
+                }
 
-                # --- SAVE LOGIC (ALWAYS INSERT) ---
-                conn = get_connection()
-                c = conn.cursor()
-                try:
-                    # We removed the Check/Update logic. We ONLY Insert now.
-                    # This allows duplicates or default CNICs.
-                    c.execute("""
-                        INSERT INTO patients (patient_name, cnic, nationality, address, phone, gender, age)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    """, (name.strip(), final_cnic, nationality.strip(), address.strip(), phone.strip(), gender, int(age)))
+                # --- DUPLICATE CHECK (blocking index, no DB round-trip) ---
+                matches = dup_index.find_matches(
+                    patient["patient_name"], cnic, patient["phone"], patient["age"], patient["gender"]
+                )
+                if matches:
+                    # Hold the submission until the desk decides
+                    st.session_state["reg_pending"] = {"patient": patient, "matches": matches}
+                else:
+                    register_patient(patient, dup_index)
 
-                    conn.commit()
-                    new_id = c.lastrowid
-                    st.success(f"✅ Registered: {name} (ID: {new_id}) - CNIC: {final_cnic}")
+    # --- Possible duplicates waiting for a decision ---
+    pending = st.session_state.get("reg_pending")
+    if pending:
+        p = pending["patient"]
+        st.warning(f"⚠️ '{p['patient_name']}' may already be registered. Check before creating a new record:")
+        st.dataframe(pd.DataFrame(pending["matches"]), use_container_width=True, hide_index=True)
 
-                except mysql.connector.Error as err:
-                    # If you forgot to run the SQL command in Step 1, this error will pop up
-                    if err.errno == 1062: # Duplicate entry error code
-                        st.error("⚠️ Database Error: The 'CNIC' column is still set to UNIQUE in MySQL.")
-                        st.code("ALTER TABLE patients DROP INDEX cnic;")
-                        st.info("Run the code above in MySQL Workbench to fix this.")
-                    else:
-                        st.error(f"Database Error: {err}")
+        col_a, col_b = st.columns(2)
+        with col_a:
+            existing = st.selectbox(
+                "Existing patient",
+                [f"{m['patient_id']} - {m['patient_name']}" for m in pending["matches"]],
+                key="reg_dup_existing"
+            )
+            if st.button("✅ Use Existing Patient", key="reg_dup_use"):
+                del st.session_state["reg_pending"]
+                existing_id = int(existing.split(" - ")[0])
+                conn = get_connection()
+                try:
+                    # Returning patient: into today's flow like a new registration
+                    flow.move(conn, existing_id, "registered", st.session_state.get("username"))
                 finally:
                     conn.close()
+                st.success(f"Using existing record — Patient ID: {existing_id}")
+        with col_b:
+            st.write("")
+            if st.button("➕ Register As New Anyway", key="reg_dup_new"):
+                del st.session_state["reg_pending"]
+                register_patient(p, dup_index)
 
     st.markdown("---")
     st.subheader("Registered Patients (Latest 10)")
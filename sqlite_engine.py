@@ -0,0 +1,119 @@
+import sqlite3
+import threading
+
+# ---------- Shared SQLite Engine (standalone variants) ----------
+# Diagnostic_tool.py and umer_SQL.py used to open a brand new connection per
+# operation with default (rollback journal) settings. Here every thread gets
+# ONE long-lived connection per database file, tuned for a single laptop
+# with several browser tabs hitting it at once:
+#   * WAL lets readers keep going while another tab writes
+#   * synchronous=NORMAL is crash-safe in WAL mode and much faster than FULL
+#   * busy_timeout makes a second writer wait instead of failing immediately
+# Callers must NOT close the connection they get back.
+
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", "5000"),
+    ("foreign_keys", "ON"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", "-16000"),       # ~16 MB page cache
+    ("mmap_size", "67108864"),      # 64 MB memory-mapped reads
+)
+
+_local = threading.local()
+
+
+def get_connection(db_file):
+    """The calling thread's connection to db_file (opened and tuned on first use)."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_file)
+    if conn is None:
+        conn = sqlite3.connect(db_file, timeout=5.0)
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+        conns[db_file] = conn
+    return conn
+
+
+def close_thread_connections():
+    """Close this thread's connections (e.g. at the end of a worker thread)."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+# ---------- Schema helpers ----------
+def table_columns(conn, table):
+    """{column_name: (declared_type, is_pk)} for an existing table ({} if missing)."""
+    return {r[1]: (r[2].upper(), r[5]) for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def ensure_index(conn, name, table, columns, unique=False):
+    """CREATE INDEX IF NOT EXISTS, skipped when the table lacks one of the columns."""
+    existing = table_columns(conn, table)
+    if not all(c in existing for c in columns):
+        return False
+    cols = ", ".join(f'"{c}"' for c in columns)
+    conn.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} ON {table} ({cols})')
+    conn.commit()
+    return True
+
+
+def index_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone() is not None
+
+
+def ensure_unique_key(conn, table, column):
+    """
+    Give `column` a unique index so upserts work. Tables written by
+    DataFrame.to_sql(if_exists="replace") lost their PRIMARY KEY and may
+    contain duplicates: keep the most recently written row of each key.
+    One-time migration: nothing is deleted once the column is the primary
+    key or the unique index exists (no duplicates can appear after that).
+    """
+    cols = table_columns(conn, table)
+    if column not in cols or cols[column][1] or index_exists(conn, f"ux_{table}_{column}"):
+        return False
+    conn.execute(f'DELETE FROM {table} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table} GROUP BY "{column}")')
+    conn.commit()
+    return ensure_index(conn, f"ux_{table}_{column}", table, [column], unique=True)
+
+
+def migrate_integer_pk(conn, table, pk):
+    """
+    Rebuild `table` so `pk` is INTEGER PRIMARY KEY AUTOINCREMENT.
+    Numeric text IDs are kept; anything else gets a fresh ID.
+    Returns True if a rebuild was needed.
+    """
+    cols = table_columns(conn, table)
+    if pk not in cols or cols[pk] == ("INTEGER", 1):
+        return False
+
+    col_defs = ", ".join(
+        f'"{pk}" INTEGER PRIMARY KEY AUTOINCREMENT' if c == pk else f'"{c}" {t}'
+        for c, (t, _) in cols.items()
+    )
+    col_list = ", ".join(f'"{c}"' for c in cols)
+    select_list = ", ".join(
+        f'CASE WHEN CAST("{pk}" AS INTEGER) || \'\' = "{pk}" THEN CAST("{pk}" AS INTEGER) END' if c == pk else f'"{c}"'
+        for c in cols
+    )
+
+    # Child tables (visits) reference the old table: FK checks off for the swap
+    conn.execute("PRAGMA foreign_keys=OFF")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"CREATE TABLE {table}__new ({col_defs})")
+        conn.execute(f"INSERT INTO {table}__new ({col_list}) SELECT {select_list} FROM {table} ORDER BY rowid")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+    return True
@@ -0,0 +1,203 @@
+import calendar
+import re
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+# ---------- Stock Batches & FEFO Allocation ----------
+# Every row of the `stock` table is one batch: a generic/brand/form/dose with
+# its own expiry date and quantity. Dispensing takes from the batch that
+# expires first (First-Expiry-First-Out) across all brands of the same
+# generic, form and dose, skipping expired batches. Allocation locks the
+# candidate rows (SELECT ... FOR UPDATE) and must run inside the caller's
+# dispensation transaction. Units reserved for other patients' prescriptions
+# (stock.reserved_qty, see stock_holds) are never allocated.
+#
+# The drug audit sheet writes expiry as "27-Oct" (= October 2027). Medicine
+# is usable to the end of the month, so that becomes 2027-10-31.
+#
+# An imported sheet is the count for the products on it. Rows already in
+# stock for those products under another key (loaded via Workbench, or the
+# same batch imported before with a different expiry) are superseded: the
+# admin confirms, they are set to 0 and their open holds move to the new
+# batch, so FEFO and free stock don't count the same boxes twice.
+
+MONTHS = {m.lower(): i for i, m in enumerate(calendar.month_abbr) if m}
+
+# (name, columns) - created by medical_camp.init_db
+STOCK_INDEXES = [
+    ("idx_stock_generic_expiry", "generic, expiry"),   # FEFO candidate lookup
+    ("idx_stock_expiry", "expiry"),                    # expiring-within-N-days report
+]
+
+CSV_COLUMNS = {"Generic": "generic", "Brand": "brand", "Dosage Form": "dosage_form", "Dose": "dose",
+               "Expiry": "expiry", "Quantity": "stock_qty", "Unit": "unit"}
+
+
+class InsufficientStock(ValueError):
+    """Not enough unexpired stock to cover the requested quantity."""
+
+
+def _month_end(year, month):
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def parse_expiry(value):
+    """'27-Oct', 'Oct-27', '10/2027', '2027-10' or a full date -> date (month end for month-only forms)."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    if not text or text.lower() in ("nan", "nat", "none"):
+        return None
+
+    m = re.fullmatch(r"(\d{2})[-/ ]([A-Za-z]{3})[A-Za-z]*", text)       # 27-Oct
+    if m and m.group(2).lower() in MONTHS:
+        return _month_end(2000 + int(m.group(1)), MONTHS[m.group(2).lower()])
+    m = re.fullmatch(r"([A-Za-z]{3})[A-Za-z]*[-/ ](\d{2}|\d{4})", text)  # Oct-27 / Oct 2027
+    if m and m.group(1).lower() in MONTHS:
+        y = int(m.group(2))
+        return _month_end(y if y > 99 else 2000 + y, MONTHS[m.group(1).lower()])
+    m = re.fullmatch(r"(\d{1,2})[-/](\d{4})", text)                      # 10/2027
+    if m and 1 <= int(m.group(1)) <= 12:
+        return _month_end(int(m.group(2)), int(m.group(1)))
+    m = re.fullmatch(r"(\d{4})[-/](\d{1,2})", text)                      # 2027-10
+    if m and 1 <= int(m.group(2)) <= 12:
+        return _month_end(int(m.group(1)), int(m.group(2)))
+    try:
+        return pd.to_datetime(text, dayfirst=True).date()
+    except (ValueError, TypeError):
+        return None
+
+
+def batch_key(generic, brand, dosage_form, dose, expiry):
+    exp = expiry.strftime("%Y-%m") if expiry else "noexp"
+    return "||".join(str(x).strip().lower() for x in [generic, brand, dosage_form, dose, exp])
+
+
+def read_stock_csv(source):
+    """Drug audit sheet (path or uploaded file) -> stock batch rows ready for save_stock()."""
+    raw = pd.read_csv(source)
+    raw.columns = raw.columns.str.strip()
+    missing = [c for c in CSV_COLUMNS if c not in raw.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    df = raw[list(CSV_COLUMNS)].rename(columns=CSV_COLUMNS)
+    df = df.dropna(how="all")
+    for c in ["generic", "brand", "dosage_form"]:
+        df[c] = df[c].fillna("").astype(str).str.strip().str.title()
+    df["dose"] = df["dose"].fillna("").astype(str).str.strip()
+    df["unit"] = df["unit"].fillna("").astype(str).str.strip().str.lower()
+    df = df[df["generic"] != ""]
+    df["expiry"] = df["expiry"].map(parse_expiry)
+    df["stock_qty"] = pd.to_numeric(df["stock_qty"], errors="coerce").fillna(0).astype(int)
+    df["key"] = [batch_key(*r) for r in df[["generic", "brand", "dosage_form", "dose", "expiry"]].itertuples(index=False)]
+    # Same product + expiry listed twice on the sheet = one batch
+    df = df.groupby("key", as_index=False).agg({
+        "generic": "first", "brand": "first", "dosage_form": "first", "dose": "first",
+        "expiry": "first", "unit": "first", "stock_qty": "sum",
+    })
+    return df[["key", "generic", "brand", "dosage_form", "dose", "expiry", "unit", "stock_qty"]]
+
+
+def _product(df):
+    cols = df[["generic", "brand", "dosage_form", "dose"]].fillna("").astype(str)
+    return cols.apply(lambda c: c.str.strip().str.lower()).agg("||".join, axis=1)
+
+
+def superseded_batches(stock_df, batch_df):
+    """
+    Stock rows (with units or holds) for a product on the import sheet but
+    not under one of its keys, plus `replaced_by` = that product's
+    earliest-expiry imported batch.
+    """
+    if stock_df.empty or batch_df.empty:
+        return stock_df.iloc[0:0].assign(replaced_by=pd.Series(dtype=object))
+    new = batch_df.assign(product=_product(batch_df), exp=pd.to_datetime(batch_df["expiry"]))
+    first = new.sort_values(["exp", "key"], na_position="last").drop_duplicates("product").set_index("product")["key"]
+    old = stock_df.assign(product=_product(stock_df))
+    held = pd.to_numeric(old["reserved_qty"], errors="coerce").fillna(0) if "reserved_qty" in old else 0
+    old = old[old["product"].isin(first.index) & ~old["key"].isin(batch_df["key"])
+              & ((pd.to_numeric(old["stock_qty"], errors="coerce").fillna(0) != 0) | (held > 0))]
+    return old.assign(replaced_by=old["product"].map(first)).drop(columns="product")
+
+
+# ---------- Allocation (inside the dispensation transaction) ----------
+def allocate_fefo(cur, generic, qty, dosage_form=None, dose=None, today=None):
+    """
+    Lock the unexpired batches of `generic` (optionally same form/dose) and
+    pick their free units earliest-expiry first until `qty` is covered.
+    Returns [{"key", "brand", "expiry", "take"}]; raises InsufficientStock.
+    """
+    today = today or date.today()
+    sql = """
+        SELECT `key`, brand, expiry, stock_qty - reserved_qty FROM stock
+        WHERE generic = %s AND stock_qty - reserved_qty > 0 AND (expiry IS NULL OR expiry >= %s)
+    """
+    params = [generic, today]
+    if dosage_form:
+        sql += " AND dosage_form = %s"
+        params.append(dosage_form)
+    if dose:
+        sql += " AND dose = %s"
+        params.append(dose)
+    sql += " ORDER BY expiry IS NULL, expiry, `key` FOR UPDATE"
+    cur.execute(sql, params)
+
+    allocations, remaining = [], int(qty)
+    for key, brand, expiry, free in cur.fetchall():
+        if remaining <= 0:
+            break
+        take = min(int(free), remaining)
+        allocations.append({"key": key, "brand": brand, "expiry": expiry, "take": take})
+        remaining -= take
+    if remaining > 0:
+        raise InsufficientStock(f"Only {int(qty) - remaining} of {int(qty)} {generic} available before expiry.")
+    return allocations
+
+
+def apply_allocations(cur, allocations):
+    """Deduct allocated quantities; fails if any batch dropped below its allocation meanwhile."""
+    for a in allocations:
+        cur.execute("UPDATE stock SET stock_qty = stock_qty - %s WHERE `key` = %s AND stock_qty - reserved_qty >= %s",
+                    (a["take"], a["key"], a["take"]))
+        if cur.rowcount != 1:
+            raise InsufficientStock(f"Stock for {a['key']} changed while dispensing. Please retry.")
+
+
+# ---------- Views over the loaded stock frame ----------
+def _expiry_dates(stock_df):
+    return pd.to_datetime(stock_df["expiry"], errors="coerce")
+
+
+def fefo_available(stock_df, generic, dosage_form=None, dose=None, today=None):
+    """Unexpired quantity FEFO can draw on for this generic/form/dose."""
+    today = pd.Timestamp(today or date.today())
+    mask = stock_df["generic"].str.lower() == str(generic).lower()
+    if dosage_form:
+        mask &= stock_df["dosage_form"] == dosage_form
+    if dose:
+        mask &= stock_df["dose"] == dose
+    exp = _expiry_dates(stock_df)
+    mask &= exp.isna() | (exp >= today)
+    return int(pd.to_numeric(stock_df.loc[mask, "stock_qty"], errors="coerce").clip(lower=0).sum())
+
+
+EXPIRING_SQL = """
+    SELECT `key`, generic, brand, dosage_form, dose, expiry, stock_qty, unit
+    FROM stock
+    WHERE expiry IS NOT NULL AND expiry <= %s AND stock_qty > 0
+    ORDER BY expiry, generic
+"""
+
+
+def expiring_within(conn, days, today=None):
+    """Batches with stock left that expire within `days` days (already expired ones included)."""
+    today = today or date.today()
+    df = pd.read_sql(EXPIRING_SQL, conn, params=(today + timedelta(days=int(days)),))
+    if not df.empty:
+        df["days_left"] = (pd.to_datetime(df["expiry"]) - pd.Timestamp(today)).dt.days
+    return df
@@ -0,0 +1,257 @@
+import logging
+import math
+import re
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+
+# ---------- Stock Reservations ----------
+# Save Visit puts a short-lived hold on each prescribed stock key, so the
+# medicine is still there when the patient reaches the pharmacy:
+#
+#   stock.reserved_qty   units held by open prescriptions (free = stock_qty - reserved_qty)
+#   stock_holds          one row per visit + key: held -> converted / released / expired
+#
+# Holds only ever touch the stock rows they are for (one SELECT ... FOR UPDATE
+# on those keys, taken in key order so two doctors can't deadlock each other,
+# then one UPDATE for all of them).
+# At dispensation the visit's holds are converted inside the dispensation
+# transaction: the units go back to "free" and are deducted by the FEFO
+# allocation right after. A background sweeper releases holds whose
+# patient never turned up.
+
+log = logging.getLogger("camp.holds")
+
+HOLD_TTL_MINUTES = 120
+SWEEP_SECONDS = 60
+SWEEP_BATCH = 500
+
+HOLDS_TABLE = """
+    CREATE TABLE IF NOT EXISTS stock_holds (
+        hold_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        visit_id INT,
+        stock_key VARCHAR(255),
+        qty INT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        expires_at DATETIME,
+        status VARCHAR(12) DEFAULT 'held',
+        username VARCHAR(100)
+    )
+"""
+
+# (table, name, columns) - created by medical_camp.init_db
+HOLD_INDEXES = [
+    ("stock_holds", "idx_holds_visit", "visit_id, status"),
+    ("stock_holds", "idx_holds_expiry", "status, expires_at"),
+]
+
+LIQUID_FORMS = ("syp", "syrup", "susp", "suspension", "drop", "drops", "cream", "oint", "ointment",
+                "gel", "lotion", "inhaler", "spray", "inj", "injection", "sachet", "solution")
+
+
+def estimate_qty(frequency, amount, dosage_form=""):
+    """
+    Units a prescription line will need: "1+0+1" for "3 Days" = 6 tablets;
+    a plain number ("10", "Qty 10", "10 tabs") is taken as-is; bottles,
+    tubes and inhalers count as one unit.
+    """
+    amount = str(amount or "").strip().lower()
+    if any(w in str(dosage_form or "").lower() for w in LIQUID_FORMS):
+        return 1
+    days = re.fullmatch(r"(\d+)\s*(d|day|days)", amount)
+    if days:
+        per_day = 0.0
+        for part in re.split(r"\+", str(frequency or "")):
+            m = re.fullmatch(r"\s*(\d+)(?:/(\d+))?\s*", part)
+            if m:
+                per_day += int(m.group(1)) / int(m.group(2) or 1)
+        return max(1, math.ceil(per_day * int(days.group(1))))
+    qty = re.search(r"\d+", amount)
+    return int(qty.group()) if qty else 1
+
+
+# ---------- Holds (inside the caller's transaction) ----------
+def _in(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _add_reserved(cur, per_key, sign=1):
+    """reserved_qty += sign * qty for {key: qty} in one UPDATE (never below zero)."""
+    keys = sorted(per_key)
+    cur.execute(f"""
+        UPDATE stock
+        SET reserved_qty = GREATEST(reserved_qty + CASE `key` {" ".join(["WHEN %s THEN %s"] * len(keys))} END, 0)
+        WHERE `key` IN ({_in(keys)})
+    """, [v for k in keys for v in (k, sign * per_key[k])] + keys)
+
+
+def place_holds(cur, visit_id, items, username=None, ttl_minutes=HOLD_TTL_MINUTES):
+    """
+    Reserve [(stock_key, qty)] for a visit, as much as is free. Locks only
+    the listed stock rows. Returns [(stock_key, wanted, held)] for lines
+    that could not be fully reserved.
+    """
+    wanted = {}
+    for key, qty in items:
+        if key and int(qty) > 0:
+            wanted[key] = wanted.get(key, 0) + int(qty)
+
+    if not wanted:
+        return []
+    keys = sorted(wanted)
+    cur.execute(f"SELECT `key`, stock_qty - reserved_qty FROM stock WHERE `key` IN ({_in(keys)}) ORDER BY `key` FOR UPDATE",
+                keys)
+    free = {k: max(int(q or 0), 0) for k, q in cur.fetchall()}
+
+    short, holds, per_key = [], [], {}
+    for key in keys:
+        held = min(free.get(key, 0), wanted[key])
+        if held > 0:
+            per_key[key] = held
+            holds.append((visit_id, key, held, int(ttl_minutes), username))
+        if held < wanted[key]:
+            short.append((key, wanted[key], held))
+    if holds:
+        _add_reserved(cur, per_key)
+        cur.executemany("""
+            INSERT INTO stock_holds (visit_id, stock_key, qty, expires_at, username)
+            VALUES (%s, %s, %s, NOW() + INTERVAL %s MINUTE, %s)
+        """, holds)
+    return short
+
+
+def move_holds(cur, moves):
+    """Superseded batches [(old_key, new_key)]: open holds and reserved units follow to the new key."""
+    moves = dict(moves)
+    if not moves:
+        return 0
+    old_keys = sorted(moves)
+    cur.execute(f"SELECT `key`, reserved_qty FROM stock WHERE `key` IN ({_in(old_keys)}) ORDER BY `key` FOR UPDATE",
+                old_keys)
+    reserved = {k: int(q or 0) for k, q in cur.fetchall() if int(q or 0) > 0}
+    if not reserved:
+        return 0
+    per_new = {}
+    for old, qty in reserved.items():
+        per_new[moves[old]] = per_new.get(moves[old], 0) + qty
+    _add_reserved(cur, reserved, sign=-1)
+    _add_reserved(cur, per_new)
+    for old in sorted(reserved):
+        cur.execute("UPDATE stock_holds SET stock_key = %s WHERE stock_key = %s AND status = 'held'", (moves[old], old))
+    return len(reserved)
+
+
+def _release(cur, where, params, status, limit=None):
+    """Give held units back to stock for the holds matching `where`; returns how many."""
+    cur.execute(f"""
+        SELECT hold_id, stock_key, qty FROM stock_holds
+        WHERE status = 'held' AND {where}
+        ORDER BY stock_key
+        {f"LIMIT {int(limit)}" if limit else ""}
+        FOR UPDATE
+    """, params)
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+    per_key = {}
+    for _, key, qty in rows:
+        per_key[key] = per_key.get(key, 0) + int(qty)
+    _add_reserved(cur, per_key, sign=-1)
+    ids = [r[0] for r in rows]
+    cur.execute(f"UPDATE stock_holds SET status = %s WHERE hold_id IN ({_in(ids)})",
+                [status] + ids)
+    return len(rows)
+
+
+def convert_holds(cur, visit_id):
+    """Dispensation: free the visit's held units so its own allocation can take them."""
+    return _release(cur, "visit_id = %s", (visit_id,), "converted")
+
+
+def release_holds(cur, visit_id):
+    """Prescription cancelled / changed: give everything back."""
+    return _release(cur, "visit_id = %s", (visit_id,), "released")
+
+
+def release_expired(conn, limit=SWEEP_BATCH):
+    cur = conn.cursor()
+    try:
+        conn.start_transaction()
+        n = _release(cur, "expires_at < NOW()", (), "expired", limit)
+        conn.commit()
+        return n
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# ---------- Reads ----------
+def visit_holds(conn, visit_id):
+    """{stock_key: held qty} for one visit."""
+    cur = conn.cursor()
+    cur.execute("SELECT stock_key, SUM(qty) FROM stock_holds WHERE visit_id = %s AND status = 'held' GROUP BY stock_key",
+                (visit_id,))
+    out = {k: int(q) for k, q in cur.fetchall()}
+    cur.close()
+    return out
+
+
+def free_stock(stock_df, own=None):
+    """
+    Copy of the stock frame where stock_qty is what this desk may use:
+    unreserved units plus the holds of the visit being dispensed (`own`).
+    """
+    if "reserved_qty" not in stock_df:
+        return stock_df
+    df = stock_df.copy()
+    reserved = pd.to_numeric(df["reserved_qty"], errors="coerce").fillna(0)
+    df["stock_qty"] = pd.to_numeric(df["stock_qty"], errors="coerce").fillna(0) - reserved
+    if own:
+        df["stock_qty"] += df["key"].map(own).fillna(0)
+    df["stock_qty"] = df["stock_qty"].clip(lower=0).astype(int)
+    return df
+
+
+ACTIVE_HOLDS_SQL = """
+    SELECT h.hold_id, h.visit_id, h.stock_key, s.generic, s.brand, h.qty, h.created_at, h.expires_at, h.username
+    FROM stock_holds h
+    LEFT JOIN stock s ON s.`key` = h.stock_key
+    WHERE h.status = 'held'
+    ORDER BY h.expires_at
+"""
+
+
+def active_holds(conn):
+    return pd.read_sql(ACTIVE_HOLDS_SQL, conn)
+
+
+# ---------- Background sweeper ----------
+@st.cache_resource
+def start_hold_sweeper(_connect, every=SWEEP_SECONDS):
+    """
+    One thread per server process releasing expired holds every `every`
+    seconds. `_connect` must be a plain connection factory: the thread has
+    no script context, so nothing here may call st.* .
+    """
+    def loop():
+        while True:
+            time.sleep(every)
+            try:
+                conn = _connect()
+                try:
+                    n = release_expired(conn)
+                finally:
+                    conn.close()
+                if n:
+                    log.info("Released %d expired stock holds", n)
+            except Exception:
+                # DB briefly unreachable or a broken query: logged, retried next round
+                log.exception("Releasing expired stock holds failed")
+
+    thread = threading.Thread(target=loop, name="stock-hold-sweeper", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,297 @@
+import numpy as np
+import pandas as pd
+
+import stock_batches as batches
+
+# ---------- Stock Movement Ledger ----------
+# Every change to stock is one row in `stock_movements` (signed qty delta):
+#
+#   receipt     new batch / stock added from the admin tools
+#   dispense    pharmacy dispensation (visit_id set)
+#   adjustment  admin edit or physical count correction
+#
+# Rows are only ever inserted, in the same transaction as the `stock` update
+# they describe, so `stock.stock_qty` stays the fast "current" value and the
+# ledger is its history. A snapshot stores every key's balance up to a
+# movement_id; a balance at any time T is then
+#
+#   latest snapshot taken before T  +  movements after it up to T
+#
+# so reads cost O(movements since the snapshot), not a replay from day one.
+# The first snapshot (movement 0) is the opening stock when the ledger is
+# created.
+
+SNAPSHOT_EVERY = 500    # movements between automatic snapshots
+
+LEDGER_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        movement_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        moved_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        stock_key VARCHAR(255),
+        kind VARCHAR(20),
+        qty INT,
+        visit_id INT,
+        username VARCHAR(100),
+        note VARCHAR(255)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        snapshot_id INT AUTO_INCREMENT PRIMARY KEY,
+        taken_at DATETIME,
+        last_movement_id BIGINT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshot_items (
+        snapshot_id INT,
+        stock_key VARCHAR(255),
+        qty INT,
+        PRIMARY KEY (snapshot_id, stock_key)
+    )
+    """,
+]
+
+# (table, name, columns) - created by medical_camp.init_db
+LEDGER_INDEXES = [
+    ("stock_movements", "idx_movements_moved_at", "moved_at"),
+    ("stock_movements", "idx_movements_key", "stock_key, movement_id"),
+    ("stock_snapshots", "idx_snapshots_taken_at", "taken_at"),
+]
+
+MOVEMENT_SQL = """
+    INSERT INTO stock_movements (stock_key, kind, qty, visit_id, username, note)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+# ---------- Writing (inside the caller's transaction) ----------
+def record_movements(cur, movements):
+    """Insert movements in one batch: [(stock_key, kind, qty, visit_id, username, note)]."""
+    rows = [(k, kind, int(qty), visit_id, username, note)
+            for k, kind, qty, visit_id, username, note in movements if int(qty) != 0]
+    if rows:
+        cur.executemany(MOVEMENT_SQL, rows)
+    return len(rows)
+
+
+def dispense_movements(allocations, visit_id, username=None):
+    """stock_batches allocations -> ledger rows (negative qty)."""
+    return [(a["key"], "dispense", -int(a["take"]), visit_id, username, None) for a in allocations]
+
+
+def upsert_movements(cur, new_df, username=None, note=None):
+    """
+    Ledger rows for an upsert of absolute quantities (save_stock): the
+    difference to what the table holds now. Call before the upsert.
+    """
+    keys = new_df["key"].tolist()
+    if not keys:
+        return []
+    placeholders = ", ".join(["%s"] * len(keys))
+    cur.execute(f"SELECT `key`, stock_qty FROM stock WHERE `key` IN ({placeholders}) FOR UPDATE", keys)
+    old = dict(cur.fetchall())
+    new_qty = pd.to_numeric(new_df["stock_qty"], errors="coerce").fillna(0).astype(int)
+    old_qty = new_df["key"].map(old)
+    delta = new_qty - old_qty.fillna(0).astype(int)
+    kind = np.where(old_qty.isna(), "receipt", "adjustment")
+    return [(k, kd, int(d), None, username, note)
+            for k, kd, d in zip(new_df["key"], kind, delta) if d != 0]
+
+
+# ---------- Snapshots ----------
+def ensure_opening_snapshot(cur):
+    """First run: the current stock table becomes snapshot #1 at movement 0."""
+    cur.execute("SELECT COUNT(*) FROM stock_snapshots")
+    if cur.fetchone()[0]:
+        return
+    cur.execute("INSERT INTO stock_snapshots (taken_at, last_movement_id) VALUES (NOW(), 0)")
+    snapshot_id = cur.lastrowid
+    cur.execute("SELECT `key`, stock_qty FROM stock")
+    rows = [(snapshot_id, k, int(qty or 0)) for k, qty in cur.fetchall()]
+    if rows:
+        cur.executemany("INSERT INTO stock_snapshot_items (snapshot_id, stock_key, qty) VALUES (%s, %s, %s)", rows)
+
+
+def _latest_snapshot(conn, when=None):
+    if when is None:
+        sql, params = "SELECT snapshot_id, taken_at, last_movement_id FROM stock_snapshots ORDER BY snapshot_id DESC LIMIT 1", ()
+    else:
+        sql = """
+            SELECT snapshot_id, taken_at, last_movement_id FROM stock_snapshots
+            WHERE taken_at <= %s ORDER BY taken_at DESC, snapshot_id DESC LIMIT 1
+        """
+        params = (when,)
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    cur.close()
+    return row
+
+
+def _balances(snapshot_items, movements):
+    """Vectorized: snapshot qty per key + sum of movement deltas per key."""
+    base = snapshot_items.set_index("stock_key")["qty"].astype(int)
+    delta = movements.groupby("stock_key")["qty"].sum().astype(int) if not movements.empty else pd.Series(dtype=int)
+    out = base.add(delta, fill_value=0).astype(int)
+    out.index.name = "key"
+    return out.rename("ledger_qty")
+
+
+def stock_at(conn, when=None):
+    """
+    Ledger balance per stock key at `when` (None = now) as a Series.
+    Cost: one snapshot read + the movements recorded after it.
+    """
+    snap = _latest_snapshot(conn, when)
+    if snap is None:   # before the ledger existed
+        return pd.Series(dtype=int, name="ledger_qty", index=pd.Index([], name="key"))
+    snapshot_id, _, last_id = snap
+    items = pd.read_sql("SELECT stock_key, qty FROM stock_snapshot_items WHERE snapshot_id = %s", conn, params=(snapshot_id,))
+    sql = "SELECT stock_key, qty FROM stock_movements WHERE movement_id > %s"
+    params = [last_id]
+    if when is not None:
+        sql += " AND moved_at <= %s"
+        params.append(when)
+    moves = pd.read_sql(sql, conn, params=tuple(params))
+    return _balances(items, moves)
+
+
+def take_snapshot(conn):
+    """
+    Fold the movements since the last snapshot into a new one. The share
+    lock on the movement range waits for dispensations still in flight, so
+    no movement can commit below the new snapshot's last_movement_id.
+    """
+    cur = conn.cursor()
+    try:
+        conn.start_transaction()
+        cur.execute("SELECT snapshot_id, last_movement_id FROM stock_snapshots ORDER BY snapshot_id DESC LIMIT 1")
+        prev_id, prev_last = cur.fetchone()
+        cur.execute(
+            "SELECT movement_id, stock_key, qty FROM stock_movements WHERE movement_id > %s LOCK IN SHARE MODE",
+            (prev_last,)
+        )
+        moves = pd.DataFrame(cur.fetchall(), columns=["movement_id", "stock_key", "qty"])
+        if moves.empty:
+            conn.rollback()
+            return None
+        cur.execute("SELECT stock_key, qty FROM stock_snapshot_items WHERE snapshot_id = %s", (prev_id,))
+        items = pd.DataFrame(cur.fetchall(), columns=["stock_key", "qty"])
+        balance = _balances(items, moves)
+
+        cur.execute("INSERT INTO stock_snapshots (taken_at, last_movement_id) VALUES (NOW(), %s)",
+                    (int(moves["movement_id"].max()),))
+        snapshot_id = cur.lastrowid
+        cur.executemany(
+            "INSERT INTO stock_snapshot_items (snapshot_id, stock_key, qty) VALUES (%s, %s, %s)",
+            [(snapshot_id, k, int(v)) for k, v in balance.items()]
+        )
+        conn.commit()
+        return snapshot_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def maybe_snapshot(conn, every=SNAPSHOT_EVERY):
+    """Take a snapshot once `every` movements have piled up since the last one."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COUNT(*) FROM stock_movements
+        WHERE movement_id > (SELECT COALESCE(MAX(last_movement_id), 0) FROM stock_snapshots)
+    """)
+    pending = cur.fetchone()[0]
+    cur.close()
+    return take_snapshot(conn) if pending >= every else None
+
+
+# ---------- Reports ----------
+RECENT_MOVEMENTS_SQL = """
+    SELECT m.movement_id, m.moved_at, m.kind, m.qty, s.generic, s.brand, s.expiry,
+           m.visit_id, m.username, m.note, m.stock_key
+    FROM stock_movements m
+    LEFT JOIN stock s ON s.`key` = m.stock_key
+    ORDER BY m.movement_id DESC
+    LIMIT %s
+"""
+
+
+def recent_movements(conn, limit=200):
+    return pd.read_sql(RECENT_MOVEMENTS_SQL, conn, params=(int(limit),))
+
+
+def read_count_csv(source):
+    """
+    Physical count sheet -> DataFrame[key, counted_qty]. Either the drug
+    audit layout (Generic, Brand, ..., Expiry, Quantity) or a plain
+    Key / Counted two-column sheet.
+    """
+    raw = pd.read_csv(source)
+    cols = {c.strip().lower(): c for c in raw.columns}
+    if "key" in cols:
+        qty_col = cols.get("counted") or cols.get("quantity") or cols.get("stock_qty")
+        if qty_col is None:
+            raise ValueError("Missing a Counted / Quantity column")
+        df = pd.DataFrame({
+            "key": raw[cols["key"]].astype(str).str.strip().str.lower(),
+            "counted_qty": pd.to_numeric(raw[qty_col], errors="coerce"),
+        })
+        df = df[df["key"].ne("") & df["key"].ne("nan")]
+    else:
+        if hasattr(source, "seek"):
+            source.seek(0)   # uploaded file, already read once above
+        df = batches.read_stock_csv(source)
+        df = df.rename(columns={"stock_qty": "counted_qty"})[["key", "counted_qty"]]
+    return df.groupby("key", as_index=False)["counted_qty"].sum(min_count=1)
+
+
+def reconcile(conn, counts):
+    """
+    Counted vs ledger vs stock table for every key, all at once.
+    status: match / short / over / not counted / not in system
+    """
+    ledger = stock_at(conn)
+    stock = pd.read_sql("SELECT `key`, generic, brand, dosage_form, dose, expiry, stock_qty FROM stock", conn)
+    df = stock.merge(ledger.reset_index(), on="key", how="outer")
+    df = df.merge(counts, on="key", how="outer")
+
+    counted = df["counted_qty"]
+    system = df["ledger_qty"].fillna(df["stock_qty"])
+    df["variance"] = counted - system
+    df["status"] = np.select(
+        [counted.isna(), system.isna(), df["variance"] == 0, df["variance"] < 0],
+        ["not counted", "not in system", "match", "short"],
+        default="over",
+    )
+    # stock_qty changed without a ledger row (e.g. a manual edit in Workbench)
+    df["untracked_change"] = df["stock_qty"].notna() & df["ledger_qty"].notna() & (df["stock_qty"] != df["ledger_qty"])
+    order = {"short": 0, "over": 1, "not in system": 2, "not counted": 3, "match": 4}
+    df["_rank"], df["_size"] = df["status"].map(order), df["variance"].abs()
+    df = df.sort_values(["_rank", "_size"], ascending=[True, False])
+    return df[["key", "generic", "brand", "dosage_form", "dose", "expiry", "stock_qty",
+               "ledger_qty", "counted_qty", "variance", "status", "untracked_change"]]
+
+
+def post_count(conn, report, username=None):
+    """Book the variances of a reconciliation as adjustments and set stock to the counted qty."""
+    rows = report[report["status"].isin(["short", "over"]) & report["stock_qty"].notna()]
+    if rows.empty:
+        return 0
+    cur = conn.cursor()
+    try:
+        conn.start_transaction()
+        record_movements(cur, [(k, "adjustment", int(v), None, username, "physical count")
+                               for k, v in zip(rows["key"], rows["variance"])])
+        cur.executemany("UPDATE stock SET stock_qty = %s WHERE `key` = %s",
+                        [(int(c), k) for k, c in zip(rows["key"], rows["counted_qty"])])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(rows)
@@ -0,0 +1,98 @@
+import heapq
+import threading
+
+import streamlit as st
+
+# ---------- Symptom -> Diagnosis Suggestions ----------
+# Sparse co-occurrence counts from past visits: for every symptom, how often
+# each ICD diagnosis was recorded with it. With symptoms S picked, a
+# diagnosis d scores
+#
+#   score(d) = mean over s in S of  count(s, d) / count(s)
+#
+# i.e. the average share of past visits with that symptom that ended in d.
+# Only diagnoses seen with at least one picked symptom are touched, so a
+# lookup is a few dict walks, not a scan of the visits. Saved visits are
+# added straight away; visits saved by other desks are pulled in by
+# sync_cooccurrence_index.
+
+DEFAULT_K = 5
+MIN_SUPPORT = 2   # ignore pairs seen only once
+
+
+def split_items(text):
+    return [x.strip() for x in str(text or "").split(";") if x.strip()]
+
+
+class CooccurrenceIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pairs = {}          # symptom -> {diagnosis: count}
+        self.symptom_visits = {}  # symptom -> visits with that symptom (and any diagnosis)
+        self._seen = set()
+        self.last_visit_id = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, visit_id, symptoms, diagnoses):
+        symptoms, diagnoses = set(symptoms), set(diagnoses)
+        if not symptoms or not diagnoses:
+            return
+        with self._lock:
+            if visit_id in self._seen:
+                return
+            self._seen.add(visit_id)
+            for s in symptoms:
+                self.symptom_visits[s] = self.symptom_visits.get(s, 0) + 1
+                row = self.pairs.setdefault(s, {})
+                for d in diagnoses:
+                    row[d] = row.get(d, 0) + 1
+
+    def scores(self, symptoms):
+        """{diagnosis: (score, support)} for the picked symptoms."""
+        known = [s for s in symptoms if s in self.symptom_visits]
+        if not known:
+            return {}
+        acc = {}
+        with self._lock:
+            for s in known:
+                total = self.symptom_visits[s]
+                for d, n in self.pairs[s].items():
+                    if n >= MIN_SUPPORT:
+                        score, support = acc.get(d, (0.0, 0))
+                        acc[d] = (score + n / total, support + n)
+        return {d: (score / len(symptoms), support) for d, (score, support) in acc.items()}
+
+    def suggest(self, symptoms, k=DEFAULT_K, exclude=()):
+        """Top-k [(diagnosis, score, support)] for the picked symptoms."""
+        exclude = set(exclude)
+        scored = ((d, s, n) for d, (s, n) in self.scores(symptoms).items() if d not in exclude)
+        return heapq.nlargest(k, scored, key=lambda t: (t[1], t[2]))
+
+    def rank(self, options, symptoms):
+        """Search results re-ordered most likely first (unscored keep their order)."""
+        scores = self.scores(symptoms)
+        if not scores:
+            return options
+        return sorted(options, key=lambda d: -scores.get(d, (0.0, 0))[0])
+
+
+@st.cache_resource
+def get_cooccurrence_index():
+    """One index per server process, shared by every session."""
+    return CooccurrenceIndex()
+
+
+def sync_cooccurrence_index(index, conn):
+    """Pull in visits saved since the last sync (by any desk or process)."""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT visit_id, symptoms, indications FROM visits WHERE visit_id > %s ORDER BY visit_id",
+        (index.last_visit_id,)
+    )
+    for visit_id, symptoms, indications in cur.fetchall():
+        index.add(int(visit_id), split_items(symptoms), split_items(indications))
+        index.last_visit_id = max(index.last_visit_id, int(visit_id))
+    cur.close()
+    return index
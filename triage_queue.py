@@ -0,0 +1,247 @@
+import heapq
+import threading
+from datetime import timedelta
+
+import pandas as pd
+import streamlit as st
+
+# ---------- Triage Queue ----------
+# Registration / the nurse desk enters vitals; each entry gets an
+# early-warning style score and doctors take the highest-scoring waiting
+# patient instead of the next ID in the list.
+#
+#   triage_queue   one row per queued patient: vitals, priority, status
+#                  waiting -> claimed (by a doctor) -> done, or back to waiting
+#
+# Every server process keeps the queue in a heap (priority, then arrival)
+# and only pulls rows changed since its last look (changed_at is indexed),
+# so refreshing the queue never rereads the patients table. A claim is a
+# conditional UPDATE (status = 'waiting'), so of two doctors pressing
+# "Take Next" at once exactly one gets the patient; the other moves on to
+# the next entry.
+
+SYNC_SLACK_SECONDS = 30   # re-read rows changed this long before the last sync (slow commits)
+
+TRIAGE_TABLE = """
+    CREATE TABLE IF NOT EXISTS triage_queue (
+        entry_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        patient_id INT,
+        queued_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        priority INT,
+        reasons VARCHAR(255),
+        bp_sys INT,
+        bp_dia INT,
+        heart_rate INT,
+        sat_o2 FLOAT,
+        temp FLOAT,
+        rr INT,
+        blood_glucose FLOAT,
+        status VARCHAR(10) DEFAULT 'waiting',
+        claimed_by VARCHAR(100),
+        claimed_at DATETIME,
+        changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# (table, name, columns) - created by medical_camp.init_db
+TRIAGE_INDEXES = [
+    ("triage_queue", "idx_triage_status", "status, priority"),
+    ("triage_queue", "idx_triage_changed", "changed_at"),
+    ("triage_queue", "idx_triage_patient", "patient_id, status"),
+]
+
+VITAL_FIELDS = ["bp_sys", "bp_dia", "heart_rate", "sat_o2", "temp", "rr", "blood_glucose"]
+
+# (column, label, [(low, high, points), ...]) - a value in [low, high) scores the points
+SCORE_BANDS = [
+    ("sat_o2", "SpO2", [(0, 92, 3), (92, 94, 2), (94, 96, 1)]),
+    ("bp_sys", "Systolic BP", [(0, 91, 3), (91, 101, 2), (160, 180, 2), (180, 999, 3)]),
+    ("heart_rate", "Heart rate", [(0, 41, 3), (41, 51, 1), (91, 111, 1), (111, 131, 2), (131, 999, 3)]),
+    ("rr", "Resp rate", [(0, 9, 3), (9, 12, 1), (21, 25, 2), (25, 999, 3)]),
+    ("temp", "Temp", [(0, 35.1, 3), (35.1, 36.1, 1), (38.1, 39.1, 1), (39.1, 99, 2)]),
+    ("blood_glucose", "Glucose", [(0, 70, 3), (300, 9999, 2)]),
+]
+AGE_POINTS = [(0, 5, 1), (65, 200, 1)]
+
+
+def priority_score(vitals, age=None):
+    """(score, 'SpO2 90, Temp 39.4') from a dict of vitals; 0 / missing values are skipped."""
+    score, reasons = 0, []
+    for col, label, bands in SCORE_BANDS:
+        value = vitals.get(col)
+        if value is None or pd.isna(value) or value <= 0:
+            continue
+        for low, high, points in bands:
+            if low <= value < high:
+                score += points
+                reasons.append(f"{label} {value:g}")
+                break
+    if age is not None and not pd.isna(age):
+        for low, high, points in AGE_POINTS:
+            if low <= int(age) < high:
+                score += points
+                reasons.append(f"Age {int(age)}")
+                break
+    return score, ", ".join(reasons)
+
+
+# ---------- Writes ----------
+def enqueue(conn, patient_id, vitals, age=None):
+    """Put a patient in the queue (or re-score their waiting entry). Returns (entry_id, score)."""
+    score, reasons = priority_score(vitals, age)
+    values = [vitals.get(f) if vitals.get(f) and vitals.get(f) > 0 else None for f in VITAL_FIELDS]
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT entry_id FROM triage_queue WHERE patient_id = %s AND status = 'waiting' FOR UPDATE",
+                    (patient_id,))
+        row = cur.fetchone()
+        if row:
+            entry_id = row[0]
+            cur.execute(f"""
+                UPDATE triage_queue SET priority = %s, reasons = %s,
+                    {', '.join(f'{f} = %s' for f in VITAL_FIELDS)}, changed_at = NOW()
+                WHERE entry_id = %s
+            """, [score, reasons] + values + [entry_id])
+        else:
+            cur.execute(f"""
+                INSERT INTO triage_queue (patient_id, priority, reasons, {', '.join(VITAL_FIELDS)})
+                VALUES (%s, %s, %s, {', '.join(['%s'] * len(VITAL_FIELDS))})
+            """, [patient_id, score, reasons] + values)
+            entry_id = cur.lastrowid
+        conn.commit()
+        return entry_id, score
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def claim(conn, entry_id, username):
+    """True if this desk got the entry (it was still waiting)."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE triage_queue SET status = 'claimed', claimed_by = %s, claimed_at = NOW(), changed_at = NOW()
+        WHERE entry_id = %s AND status = 'waiting'
+    """, (username, entry_id))
+    won = cur.rowcount == 1
+    conn.commit()
+    cur.close()
+    return won
+
+
+def release(conn, entry_id):
+    """Doctor hands the patient back: waiting again, same priority and place."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE triage_queue SET status = 'waiting', claimed_by = NULL, claimed_at = NULL, changed_at = NOW()
+        WHERE entry_id = %s AND status = 'claimed'
+    """, (entry_id,))
+    conn.commit()
+    cur.close()
+
+
+def complete(cur, patient_id):
+    """Save Visit (inside its transaction): the patient's queue entries are done."""
+    cur.execute("""
+        UPDATE triage_queue SET status = 'done', changed_at = NOW()
+        WHERE patient_id = %s AND status IN ('waiting', 'claimed')
+    """, (patient_id,))
+
+
+# ---------- In-process queue ----------
+QUEUE_COLUMNS = ["entry_id", "patient_id", "queued_at", "priority", "reasons"] + VITAL_FIELDS + ["status", "claimed_by"]
+
+
+class TriageQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entries = {}      # entry_id -> row dict (waiting / claimed only)
+        self._heap = []        # (-priority, entry_id); stale tuples are skipped
+        self.last_sync = None
+
+    def _apply(self, row):
+        entry_id = int(row["entry_id"])
+        if row["status"] in ("waiting", "claimed"):
+            old = self.entries.get(entry_id)
+            self.entries[entry_id] = row
+            if row["status"] == "waiting" and (old is None or old["status"] != "waiting" or old["priority"] != row["priority"]):
+                heapq.heappush(self._heap, (-int(row["priority"] or 0), entry_id))
+        else:
+            self.entries.pop(entry_id, None)
+
+    def _valid(self, item):
+        row = self.entries.get(item[1])
+        return row is not None and row["status"] == "waiting" and -int(row["priority"] or 0) == item[0]
+
+    def sync(self, conn):
+        """Pull rows changed since the last sync (all open rows the first time)."""
+        cur = conn.cursor()
+        cur.execute("SELECT NOW()")
+        now = pd.Timestamp(cur.fetchone()[0])
+        cols = ", ".join(QUEUE_COLUMNS)
+        if self.last_sync is None:
+            cur.execute(f"SELECT {cols} FROM triage_queue WHERE status IN ('waiting', 'claimed')")
+        else:
+            since = self.last_sync - timedelta(seconds=SYNC_SLACK_SECONDS)
+            cur.execute(f"SELECT {cols} FROM triage_queue WHERE changed_at >= %s", (since.to_pydatetime(),))
+        rows = [dict(zip(QUEUE_COLUMNS, r)) for r in cur.fetchall()]
+        cur.close()
+        with self._lock:
+            for row in rows:
+                self._apply(row)
+            if len(self._heap) > 2 * len(self.entries) + 64:
+                self._heap = [t for t in self._heap if self._valid(t)]
+                heapq.heapify(self._heap)
+            self.last_sync = now
+        return self
+
+    def __len__(self):
+        """Patients waiting (claimed ones not counted)."""
+        with self._lock:
+            return sum(1 for r in self.entries.values() if r["status"] == "waiting")
+
+    def waiting(self, k=10):
+        """Top-k waiting rows, highest priority first (then longest waiting)."""
+        with self._lock:
+            items = heapq.nsmallest(k, (t for t in self._heap if self._valid(t)))
+            return [self.entries[entry_id] for _, entry_id in items]
+
+    def claimed_by(self, username):
+        with self._lock:
+            return [r for r in self.entries.values() if r["status"] == "claimed" and r["claimed_by"] == username]
+
+    def claim_next(self, conn, username):
+        """Claim the best waiting entry; on a lost race try the next one. Returns the row or None."""
+        while True:
+            with self._lock:
+                while self._heap and not self._valid(self._heap[0]):
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    return None
+                _, entry_id = heapq.heappop(self._heap)
+                row = self.entries[entry_id]
+            if claim(conn, entry_id, username):
+                with self._lock:
+                    self._apply({**row, "status": "claimed", "claimed_by": username})
+                return self.entries[entry_id]
+            # someone else got it: forget it locally, the next sync brings the real state
+            with self._lock:
+                self.entries.pop(entry_id, None)
+
+
+@st.cache_resource
+def get_triage_queue():
+    """One queue per server process, shared by every session."""
+    return TriageQueue()
+
+
+def waiting_frame(rows, now, names=None):
+    """Display table for the queue panel (`now` = DB time of the last sync)."""
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame(rows)
+    df["waiting_min"] = ((now - pd.to_datetime(df["queued_at"])).dt.total_seconds() // 60).clip(lower=0).astype(int)
+    if names is not None:
+        df.insert(1, "patient_name", df["patient_id"].map(names))
+    return df[[c for c in ["priority", "patient_id", "patient_name", "reasons", "waiting_min"] if c in df]]
@@ -1,9 +1,9 @@
 # app_sqlite.py
 import pandas as pd
 import streamlit as st
-import sqlite3
 import os
 import re
+import sqlite_engine
 
 # --------- Config ----------
 DB_FILE = "emr.db"  # SQLite database
@@ -15,8 +15,8 @@ st.write("Enter patient details, symptoms, possible indications, and prescribed
 
 # --------- Database helpers ----------
 def get_connection():
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-    return conn
+    # Shared per-thread connection (WAL + tuned pragmas). Do not close it.
+    return sqlite_engine.get_connection(DB_FILE)
 
 def init_db():
     conn = get_connection()
@@ -24,7 +24,7 @@ def init_db():
     # Patients tablestreamlit run C:\Users\Administrator\Desktop\DIAGNOSTIC\check.py
     c.execute("""
     CREATE TABLE IF NOT EXISTS patients (
-        patient_id TEXT PRIMARY KEY,
+        patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_name TEXT,
         history TEXT,
         bp TEXT,
@@ -52,7 +52,12 @@ def init_db():
     )
     """)
     conn.commit()
-    conn.close()
+
+    # Older databases used hand-typed TEXT ids; switch to AUTOINCREMENT
+    sqlite_engine.migrate_integer_pk(conn, "patients", "patient_id")
+    sqlite_engine.ensure_unique_key(conn, "stock", "key")
+    sqlite_engine.ensure_index(conn, "idx_patients_dispensed", "patients", ["dispensed"])
+    sqlite_engine.ensure_index(conn, "idx_stock_generic", "stock", ["generic"])
 
 # Initialize DB
 init_db()
@@ -80,13 +85,19 @@ def load_stock():
         """, stock[["Key","Generic","Brand","Dosage Form","Dose","Expiry","Unit","StockQty"]].values.tolist())
         conn.commit()
     stock_df = pd.read_sql("SELECT * FROM stock", conn)
-    conn.close()
     return stock_df
 
 def save_stock(df):
+    # Upsert instead of to_sql(if_exists="replace"), which would drop the key and indexes
     conn = get_connection()
-    df.to_sql("stock", conn, if_exists="replace", index=False)
-    conn.close()
+    conn.executemany("""
+        INSERT INTO stock (key,generic,brand,dosage_form,dose,expiry,unit,stock_qty)
+        VALUES (?,?,?,?,?,?,?,?)
+        ON CONFLICT(key) DO UPDATE SET
+            generic=excluded.generic, brand=excluded.brand, dosage_form=excluded.dosage_form,
+            dose=excluded.dose, expiry=excluded.expiry, unit=excluded.unit, stock_qty=excluded.stock_qty
+    """, df[["key","generic","brand","dosage_form","dose","expiry","unit","stock_qty"]].values.tolist())
+    conn.commit()
 
 # Initialize stock in session_state
 if "stock_df" not in st.session_state:
@@ -96,7 +107,6 @@ def refresh_stock():
     """Refresh stock from database into session_state"""
     conn = get_connection()
     latest_stock = pd.read_sql("SELECT * FROM stock", conn)
-    conn.close()
     st.session_state["stock_df"] = latest_stock.copy()
 
 # --------- UI Tabs ----------
@@ -108,7 +118,8 @@ with tab1:
     if "stock_df" not in st.session_state:
         refresh_stock()
     stock_df = st.session_state["stock_df"]
-    patient_id = st.text_input("Patient ID", key="p_patient_id")
+    # IDs come from SQLite AUTOINCREMENT on save, so two tabs can't get the same one
+    st.text_input("Patient ID (auto)", value="Assigned on save", disabled=True)
     patient_name = st.text_input("Patient Name", key="p_patient_name")
     patient_history = st.text_area("History", key="p_history")
 
@@ -173,11 +184,10 @@ with tab1:
             })
 
 if st.button("Save Patient Record"):
-    if not patient_id or not patient_name:
-        st.error("Please enter Patient ID and Patient Name.")
+    if not patient_name:
+        st.error("Please enter Patient Name.")
     else:
         record = {
-            "patient_id": patient_id,
             "patient_name": patient_name,
             "history": patient_history,
             "bp": f"{bp_sys}/{bp_dia}",
@@ -194,10 +204,10 @@ if st.button("Save Patient Record"):
         placeholders = ", ".join(["?"]*len(record))
         columns = ", ".join(record.keys())
         values = list(record.values())
-        conn.cursor().execute(f"INSERT OR REPLACE INTO patients ({columns}) VALUES ({placeholders})", values)
+        cur = conn.execute(f"INSERT INTO patients ({columns}) VALUES ({placeholders})", values)
         conn.commit()
-        conn.close()
-        st.success("Patient record saved successfully!")
+        record = {"patient_id": cur.lastrowid, **record}
+        st.success(f"Patient record saved successfully! (ID: {record['patient_id']})")
         st.json(record)
 
 # ---------------- TAB 2: Patient Records ----------------
@@ -205,24 +215,37 @@ with tab2:
     st.header("Patient Records")
     conn = get_connection()
     records_df = pd.read_sql("SELECT * FROM patients", conn)
-    conn.close()
     if not records_df.empty:
         edited_df = st.data_editor(records_df, num_rows="dynamic")
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Update Records"):
+                # Upsert edited rows / delete removed ones (to_sql "replace" would drop the schema)
                 conn = get_connection()
-                edited_df.to_sql("patients", conn, if_exists="replace", index=False)
-                conn.close()
+                columns = list(records_df.columns)
+                placeholders = ", ".join(["?"] * len(columns))
+                kept = edited_df.dropna(subset=["patient_id"])
+                new_rows = edited_df[edited_df["patient_id"].isna()].drop(columns=["patient_id"])
+                removed = set(records_df["patient_id"]) - set(kept["patient_id"].astype(int))
+                conn.executemany("DELETE FROM patients WHERE patient_id=?", [(int(pid),) for pid in removed])
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO patients ({', '.join(columns)}) VALUES ({placeholders})",
+                    kept[columns].astype(object).where(kept[columns].notna(), None).values.tolist()
+                )
+                if not new_rows.empty:
+                    conn.executemany(
+                        f"INSERT INTO patients ({', '.join(new_rows.columns)}) VALUES ({', '.join(['?'] * len(new_rows.columns))})",
+                        new_rows.astype(object).where(new_rows.notna(), None).values.tolist()
+                    )
+                conn.commit()
                 st.success("Records updated successfully!")
         with col2:
             del_id = st.selectbox("Select Patient ID to Delete", options=[""]+records_df["patient_id"].tolist(), index=0)
             if st.button("Delete Record"):
                 if del_id:
                     conn = get_connection()
-                    conn.cursor().execute("DELETE FROM patients WHERE patient_id=?", (del_id,))
+                    conn.execute("DELETE FROM patients WHERE patient_id=?", (int(del_id),))
                     conn.commit()
-                    conn.close()
                     st.success(f"Record with Patient ID '{del_id}' deleted.")
                     st.experimental_rerun()
         st.dataframe(records_df, use_container_width=True)
@@ -261,7 +284,6 @@ with tab3:
     # Dispense for patient
     conn = get_connection()
     patients_df = pd.read_sql("SELECT * FROM patients", conn)
-    conn.close()
     if not patients_df.empty:
         patient_ids = patients_df["patient_id"].tolist()
         selected_patient = st.selectbox("Select Patient ID to Dispense For", options=[""] + patient_ids, index=0)
@@ -342,16 +364,16 @@ with tab3:
                             "RemainingStock": new_stock_val
                         })
 
-                    # Save updated stock to session and SQLite
-                    st.session_state["stock_df"] = updated_stock.copy()
-                    save_stock(updated_stock)
-                    refresh_stock()
-                    # Update patient record in DB
+                    # Deduct only the dispensed rows and mark the patient, in one transaction
                     conn = get_connection()
+                    conn.executemany(
+                        "UPDATE stock SET stock_qty = stock_qty - ? WHERE key=?",
+                        [(d["dispense_qty"], stock_df.at[d["matched_index"], "key"]) for d in to_dispense if d["matched_index"] is not None]
+                    )
                     dd = "; ".join([f"{s['Medicine']} => {s['QuantityDispensed']} (remaining {s['RemainingStock']})" for s in dispensed_summary])
-                    conn.cursor().execute("UPDATE patients SET dispensed='Yes', dispensed_details=? WHERE patient_id=?", (dd, selected_patient))
+                    conn.execute("UPDATE patients SET dispensed='Yes', dispensed_details=? WHERE patient_id=?", (dd, selected_patient))
                     conn.commit()
-                    conn.close()
+                    refresh_stock()
 
                     st.success("Dispensation recorded and stock updated.")
                     st.subheader("Dispensed summary")
@@ -0,0 +1,163 @@
+import html
+import re
+
+import pandas as pd
+import streamlit as st
+
+# ---------- Full-text Search over History & Complaints ----------
+# MySQL FULLTEXT indexes (InnoDB) on the free-text fields:
+#
+#   visits.history                                          (medical)
+#   dental_visits.presenting_complaint, history_complaint   (dental)
+#
+# A search is one MATCH ... AGAINST per source in BOOLEAN MODE, every word
+# required and prefix-matched ("chest pai" -> +chest* +pai*), so the index
+# does the work and only one page of rows comes back. Snippets are cut
+# around the first hit in Python from that page only.
+
+PAGE_SIZE = 20
+MIN_WORD = 3          # InnoDB's default innodb_ft_min_token_size; shorter words aren't indexed
+SNIPPET_WIDTH = 160
+
+# (table, name, columns) - created by medical_camp.init_db
+FULLTEXT_INDEXES = [
+    ("visits", "ft_visits_history", "history"),
+    ("dental_visits", "ft_dental_complaints", "presenting_complaint, history_complaint"),
+]
+
+SOURCES = {
+    "medical": """
+        SELECT 'Medical' AS source, v.visit_id, v.visit_date, p.patient_id, p.patient_name,
+               v.history AS text, MATCH(v.history) AGAINST(%s IN BOOLEAN MODE) AS score
+        FROM visits v
+        JOIN patients p ON p.patient_id = v.patient_id
+        WHERE MATCH(v.history) AGAINST(%s IN BOOLEAN MODE)
+    """,
+    "dental": """
+        SELECT 'Dental' AS source, d.visit_id, d.visit_date, p.patient_id, p.patient_name,
+               CONCAT_WS(' | ', d.presenting_complaint, d.history_complaint) AS text,
+               MATCH(d.presenting_complaint, d.history_complaint) AGAINST(%s IN BOOLEAN MODE) AS score
+        FROM dental_visits d
+        JOIN patients p ON p.patient_id = d.patient_id
+        WHERE MATCH(d.presenting_complaint, d.history_complaint) AGAINST(%s IN BOOLEAN MODE)
+    """,
+}
+COUNTS = {
+    "medical": "SELECT COUNT(*) FROM visits WHERE MATCH(history) AGAINST(%s IN BOOLEAN MODE)",
+    "dental": "SELECT COUNT(*) FROM dental_visits WHERE MATCH(presenting_complaint, history_complaint) AGAINST(%s IN BOOLEAN MODE)",
+}
+INDEX_FOR = {"medical": "ft_visits_history", "dental": "ft_dental_complaints"}
+ORDERS = {"Best match": "score DESC, visit_date DESC", "Newest first": "visit_date DESC, score DESC"}
+
+
+def search_words(text):
+    """Words of the search box that the index can match (letters/digits, >= MIN_WORD long)."""
+    return [w for w in re.findall(r"\w+", str(text or "").lower()) if len(w) >= MIN_WORD]
+
+
+def boolean_query(words):
+    """['chest', 'pai'] -> '+chest* +pai*' (every word required, prefix match)."""
+    return " ".join(f"+{w}*" for w in words)
+
+
+def available_sources(cur):
+    """Sources whose FULLTEXT index exists (dental_visits may not be set up yet)."""
+    cur.execute(f"""
+        SELECT INDEX_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND INDEX_NAME IN ({', '.join(['%s'] * len(INDEX_FOR))})
+    """, tuple(INDEX_FOR.values()))
+    names = {r[0] for r in cur.fetchall()}
+    return [s for s, name in INDEX_FOR.items() if name in names]
+
+
+def search(conn, text, sources=("medical", "dental"), page=0, page_size=PAGE_SIZE, order="Best match"):
+    """(page DataFrame, total matches) for the search box text."""
+    words = search_words(text)
+    cols = ["source", "visit_id", "visit_date", "patient_id", "patient_name", "text", "score"]
+    if not words or not sources:
+        return pd.DataFrame(columns=cols), 0
+    query = boolean_query(words)
+
+    cur = conn.cursor()
+    total = 0
+    for s in sources:
+        cur.execute(COUNTS[s], (query,))
+        total += int(cur.fetchone()[0])
+    if total == 0:
+        cur.close()
+        return pd.DataFrame(columns=cols), 0
+
+    sql = " UNION ALL ".join(SOURCES[s] for s in sources)
+    sql = f"SELECT * FROM ({sql}) hits ORDER BY {ORDERS[order]} LIMIT %s OFFSET %s"
+    cur.execute(sql, tuple(query for _ in sources for _ in range(2)) + (int(page_size), int(page) * int(page_size)))
+    rows = pd.DataFrame(cur.fetchall(), columns=cols)
+    cur.close()
+    return rows, total
+
+
+def snippet(text, words, width=SNIPPET_WIDTH):
+    """HTML-escaped window of `text` around the first hit, with the hits in <mark>."""
+    text = re.sub(r"\s+", " ", str(text or "")).strip()
+    if not words:
+        return html.escape(text[:width])
+    hit_re = re.compile(r"\b(" + "|".join(map(re.escape, words)) + r")\w*", re.I)
+    m = hit_re.search(text)
+    start = max(0, (m.start() if m else 0) - width // 3)
+    if start:
+        space = text.find(" ", start)
+        start = space + 1 if 0 <= space < start + 20 else start
+    window = text[start:start + width]
+    out = hit_re.sub(lambda h: f"\x00{h.group(0)}\x01", window)
+    out = html.escape(out).replace("\x00", "<mark>").replace("\x01", "</mark>")
+    return ("… " if start else "") + out + (" …" if start + width < len(text) else "")
+
+
+# ---------- Page ----------
+def show_search_page(conn):
+    st.header("🔎 Search History & Complaints")
+    cur = conn.cursor()
+    have = available_sources(cur)
+    cur.close()
+    if not have:
+        st.warning("Full-text indexes are not set up yet; restart the app once to create them.")
+        return
+
+    c1, c2, c3 = st.columns([4, 2, 2])
+    text = c1.text_input("Search", key="fts_text", placeholder="e.g. chest pain, toothache night")
+    labels = {"medical": "Medical", "dental": "Dental"}
+    picked = c2.multiselect("In", [labels[s] for s in have], default=[labels[s] for s in have], key="fts_sources")
+    order = c3.selectbox("Sort", list(ORDERS), key="fts_order")
+    sources = [s for s in have if labels[s] in picked]
+
+    # A new search starts on page 1
+    if st.session_state.get("fts_last") != (text, tuple(sources), order):
+        st.session_state["fts_last"] = (text, tuple(sources), order)
+        st.session_state["fts_page"] = 0
+    page = st.session_state.get("fts_page", 0)
+
+    words = search_words(text)
+    if not text.strip():
+        return
+    if not words:
+        st.info(f"Type at least one word of {MIN_WORD}+ letters.")
+        return
+
+    rows, total = search(conn, text, sources, page, PAGE_SIZE, order)
+    pages = max(1, -(-total // PAGE_SIZE))
+    st.caption(f"{total} matching visits · page {page + 1} of {pages}")
+
+    for r in rows.itertuples(index=False):
+        when = pd.to_datetime(r.visit_date).strftime("%d-%b-%Y %H:%M") if pd.notna(r.visit_date) else ""
+        st.markdown(
+            f"**{html.escape(str(r.patient_name))}** (ID {r.patient_id}) · {r.source} visit #{r.visit_id} · {when}<br>"
+            f"<span style='color:#555'>{snippet(r.text, words)}</span>",
+            unsafe_allow_html=True,
+        )
+
+    p1, _, p2 = st.columns([1, 4, 1])
+    if p1.button("◀ Previous", disabled=page == 0, key="fts_prev"):
+        st.session_state["fts_page"] = page - 1
+        st.rerun()
+    if p2.button("Next ▶", disabled=page + 1 >= pages, key="fts_next"):
+        st.session_state["fts_page"] = page + 1
+        st.rerun()
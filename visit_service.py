@@ -0,0 +1,99 @@
+import stock_holds as holds
+import triage_queue as triage
+import patient_flow as flow
+import prescriptions as rx
+import vitals
+
+# ---------- Visit Save Service ----------
+# Save Visit as one transaction on one cursor, one statement per step:
+#
+#   1. patient           new registrations: CNIC lookup (FOR UPDATE on the non-unique
+#                        idx_patients_cnic, so only that CNIC is locked), then UPDATE
+#                        the existing row or INSERT a new one (CNIC is not unique:
+#                        registration allows shared / default CNICs)
+#   2. visit INSERT      visit_id comes back as lastrowid (no extra query)
+#   3. prescription lines (one executemany into visit_prescriptions)
+#   4. triage / flow / stock holds for the visit (holds: one locking SELECT and
+#      one UPDATE for all prescribed keys, one executemany for the hold rows)
+#   5. commit
+#
+# That is still several statements per save, not a single round trip: the
+# flow and hold rules live here in Python, and a stored procedure would be a
+# second copy of them.
+#
+# The caller gets the ids back and updates its own caches (patient list,
+# co-occurrence, templates) instead of rereading them on the next rerun.
+
+# (table, name, columns) - created by medical_camp.init_db; non-unique, see step 1
+PATIENT_INDEXES = [
+    ("patients", "idx_patients_cnic", "cnic"),
+]
+
+FIND_PATIENT_SQL = "SELECT patient_id FROM patients WHERE cnic = %s ORDER BY patient_id LIMIT 1 FOR UPDATE"
+UPDATE_PATIENT_SQL = "UPDATE patients SET patient_name = %s, age = %s WHERE patient_id = %s"
+INSERT_PATIENT_SQL = """
+    INSERT INTO patients (patient_name, cnic, nationality, address, phone, gender, age)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+INSERT_VISIT_SQL = """
+    INSERT INTO visits (patient_id, doctor_type, visit_date, history, bp, bp_sys, bp_dia, heart_rate, sat_o2, temp, rr, blood_glucose, gender, age, symptoms, indications, medicines, medicine_keys, dispensed)
+    VALUES (%s, %s, NOW(), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'No')
+"""
+
+PATIENT_FIELDS = ["patient_name", "cnic", "nationality", "address", "phone", "gender", "age"]
+
+
+def medicine_text(medicines):
+    """(medicines, medicine_keys) strings stored on the visit row."""
+    med_str = "; ".join(f"{m['generic']} [{m['brand']}] ({m['frequency']}, {m['amount']})" for m in medicines)
+    med_keys = "; ".join(str(m["key"]) for m in medicines)
+    return med_str, med_keys
+
+
+def save_visit(conn, patient, visit, medicines, username=None):
+    """
+    Save one visit. `patient` is {"patient_id": ...} for a registered patient
+    or the PATIENT_FIELDS of a new registration (matched by CNIC); `visit`
+    holds the form values. Returns {"patient_id", "visit_id", "created",
+    "short"} where created = a new patients row was inserted and short =
+    medicines that could not be fully held (see stock_holds.place_holds).
+    """
+    cur = conn.cursor()
+    try:
+        created = False
+        if patient.get("patient_id") is None:
+            cur.execute(FIND_PATIENT_SQL, (patient["cnic"],))
+            row = cur.fetchone()
+            if row:
+                patient_id = row[0]
+                cur.execute(UPDATE_PATIENT_SQL, (patient["patient_name"], patient["age"], patient_id))
+            else:
+                cur.execute(INSERT_PATIENT_SQL, tuple(patient[f] for f in PATIENT_FIELDS))
+                patient_id = cur.lastrowid
+                created = True
+        else:
+            patient_id = int(patient["patient_id"])
+
+        med_str, med_keys = medicine_text(medicines)
+        bp_sys, bp_dia = visit["bp_sys"], visit["bp_dia"]
+        cur.execute(INSERT_VISIT_SQL, (
+            patient_id, visit["doctor_type"], visit["history"], f"{bp_sys}/{bp_dia}",
+            vitals.measured(bp_sys), vitals.measured(bp_dia), visit["heart_rate"], visit["sat_o2"], visit["temp"],
+            vitals.measured(visit["rr"]), visit["blood_glucose"], visit["gender"], visit["age"],
+            "; ".join(visit["symptoms"]), "; ".join(visit["indications"]), med_str, med_keys,
+        ))
+        visit_id = cur.lastrowid
+        lines = rx.prescription_rows(medicines)
+        rx.insert_prescriptions(cur, visit_id, lines)
+
+        triage.complete(cur, patient_id)
+        flow.advance(cur, patient_id, "waiting_pharmacy" if medicines else "done", username)
+        short = holds.place_holds(cur, visit_id, [(line[1], line[7]) for line in lines], username)
+        conn.commit()
+        return {"patient_id": patient_id, "visit_id": visit_id, "created": created, "short": short}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
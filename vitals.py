@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# ---------- Vitals & Abnormal-Vitals Flags ----------
+# Vitals are stored as numbers on visits (bp_sys / bp_dia next to the old
+# "sys/dia" text in bp). A 0 from the entry form means "not measured" and
+# is stored as NULL in the new columns; older rows may still hold 0s, so
+# the flags treat anything <= 0 as missing.
+#
+# Each rule is a list of (column, op, threshold) conditions, any of which
+# raises the flag. flag_vitals() evaluates every rule over the whole
+# records frame at once (one numpy comparison per condition).
+
+# (flag, [(column, op, threshold), ...]) - a flag is raised when any condition holds
+VITAL_RULES = [
+    ("Hypertension", [("bp_sys", ">=", 140), ("bp_dia", ">=", 90)]),
+    ("Hypoxia", [("sat_o2", "<", 94)]),
+    ("Fever", [("temp", ">=", 38.0)]),
+    ("Hypoglycemia", [("blood_glucose", "<", 70)]),
+    ("Hyperglycemia", [("blood_glucose", ">=", 200)]),
+]
+FLAGS = [name for name, _ in VITAL_RULES]
+OPS = {">=": np.greater_equal, ">": np.greater, "<": np.less, "<=": np.less_equal}
+
+BP_RE = r"^\s*(\d{2,3})\s*/\s*(\d{2,3})\s*$"
+
+# Server-side backfill of bp_sys / bp_dia from the old "sys/dia" strings
+BACKFILL_BP_SQL = """
+    UPDATE visits
+    SET bp_sys = NULLIF(CAST(SUBSTRING_INDEX(bp, '/', 1) AS UNSIGNED), 0),
+        bp_dia = NULLIF(CAST(SUBSTRING_INDEX(bp, '/', -1) AS UNSIGNED), 0)
+    WHERE bp_sys IS NULL AND bp REGEXP '^[0-9]{2,3}/[0-9]{2,3}$'
+"""
+
+
+def measured(value):
+    """Form value -> number for the DB, or None for the 0 'not measured' default."""
+    return value if value and value > 0 else None
+
+
+def parse_bp(bp):
+    """'120/80' strings -> DataFrame[bp_sys, bp_dia] (NaN where unreadable or 0)."""
+    parts = pd.Series(bp, dtype=object).astype(str).str.extract(BP_RE).astype(float)
+    parts.columns = ["bp_sys", "bp_dia"]
+    return parts.where(parts > 0)
+
+
+def numeric_vitals(df):
+    """Vitals columns as floats, missing = NaN; bp_sys/bp_dia fall back to parsing bp."""
+    out = pd.DataFrame(index=df.index)
+    for col in ["bp_sys", "bp_dia", "heart_rate", "sat_o2", "temp", "rr", "blood_glucose"]:
+        out[col] = pd.to_numeric(df[col], errors="coerce") if col in df else np.nan
+    if "bp" in df:
+        parsed = parse_bp(df["bp"]).set_axis(df.index)
+        out["bp_sys"] = out["bp_sys"].fillna(parsed["bp_sys"])
+        out["bp_dia"] = out["bp_dia"].fillna(parsed["bp_dia"])
+    return out.where(out > 0)
+
+
+def flag_vitals(df):
+    """One boolean column per flag in VITAL_RULES, aligned with df."""
+    v = numeric_vitals(df)
+    flags = {}
+    for name, conditions in VITAL_RULES:
+        hit = np.zeros(len(v), dtype=bool)
+        for col, op, threshold in conditions:
+            values = v[col].to_numpy(dtype=float)
+            with np.errstate(invalid="ignore"):
+                hit |= OPS[op](values, threshold) & ~np.isnan(values)
+        flags[name] = hit
+    return pd.DataFrame(flags, index=df.index)
+
+
+def flag_labels(flags):
+    """Boolean flag frame -> 'Hypertension; Fever' text per row ('' when normal)."""
+    labels = pd.Series("", index=flags.index)
+    for name in flags.columns:
+        labels = labels + np.where(flags[name].to_numpy(), name + "; ", "")
+    return labels.str.rstrip("; ")